@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+"""
+Benchmarks for M2E audio loading, trial processing and evaluation.
+
+All fixtures are synthetic and generated from fixed seeds, so results only
+depend on the code and the machine. Results are printed as a table and can be
+saved as JSON and compared against a previous run.
+
+Examples
+--------
+Run everything and save the results::
+
+    python benchmarks/bench_m2e.py -o bench_results.json
+
+Run a quick subset and compare with a saved run::
+
+    python benchmarks/bench_m2e.py --quick --compare bench_results.json
+"""
+
+import argparse
+import datetime
+import fnmatch
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import mcvqoe.base
+import numpy as np
+import pandas as pd
+
+import mcvqoe.mouth2ear
+from mcvqoe.mouth2ear import evaluate, measure, streaming_evaluate
+from mcvqoe.mouth2ear.m2e import FakeAi
+
+# sample rate used for measurements
+fs = 48000
+
+
+def speech_like(rng, dur, fs):
+    """Generate noise with a syllable like envelope."""
+    n = int(dur * fs)
+    # ~4 Hz syllable rate with pauses
+    env = np.repeat(rng.uniform(0, 1, size=n // (fs // 4) + 1) > 0.3, fs // 4)[:n]
+    env = np.convolve(env.astype(float), np.hanning(fs // 50), mode="same")
+    return 0.1 * env * rng.normal(size=n)
+
+
+def time_func(func, repeat, setup=None):
+    """Time func, calling setup, untimed, before each call."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+class benchmark_runner():
+    """Run benchmarks and collect results."""
+
+    def __init__(self, select=None, repeat=5):
+        self.select = select
+        self.repeat = repeat
+        self.results = []
+
+    def selected(self, name):
+        """Check if the benchmark called name should be run."""
+        return not self.select or any(fnmatch.fnmatch(name, s) for s in self.select)
+
+    def run(self, name, func, setup=None, repeat=None, **params):
+        """Time func and store the result under name."""
+        if not self.selected(name):
+            return
+        self.record(name, time_func(func, repeat or self.repeat, setup), **params)
+
+    def record(self, name, times, **params):
+        """Store times, measured elsewhere, under name."""
+        res = {
+            "name": name,
+            "params": params,
+            "times": times,
+            "min": min(times),
+            "median": float(np.median(times)),
+        }
+        self.results.append(res)
+        print(f"{name:<45}{res['min'] * 1e3:>12.2f}{res['median'] * 1e3:>12.2f}", flush=True)
+
+
+# --------------------------------[imports]--------------------------------
+
+
+def import_time(module):
+    """Get the time, in seconds, to import module in a new interpreter."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    # last line is the module itself, with the cumulative time in us
+    m = re.search(r"\|\s*(\d+)\s*\|\s*" + re.escape(module) + r"\s*$", out.stderr, re.MULTILINE)
+    return int(m.group(1)) * 1e-6
+
+
+def bench_imports(runner):
+    # measured in a new interpreter so nothing is cached
+    for module in (
+        "mcvqoe.base",
+        "mcvqoe.mouth2ear",
+        "mcvqoe.mouth2ear.m2e_reprocess",
+        "mcvqoe.mouth2ear.m2e_eval",
+    ):
+        name = f"import.{module}"
+        if not runner.selected(name):
+            continue
+        runner.record(name, [import_time(module) for _ in range(runner.repeat)], module=module)
+
+
+# ------------------------------[load_audio]------------------------------
+
+
+def bench_load_audio(runner, tmp_dir):
+    rng = np.random.default_rng(0)
+    clip_dir = os.path.join(tmp_dir, "clips")
+    os.makedirs(clip_dir)
+
+    names = {}
+    for rate in (fs, 16000):
+        names[rate] = []
+        for k in range(4):
+            name = f"clip{k}_{rate}.wav"
+            mcvqoe.base.audio_write(os.path.join(clip_dir, name), rate, speech_like(rng, 4, rate))
+            names[rate].append(name)
+
+    noise_name = os.path.join(clip_dir, "noise.wav")
+    mcvqoe.base.audio_write(noise_name, fs, 0.05 * rng.normal(size=10 * fs))
+
+    cache_dir = os.path.join(tmp_dir, "cache")
+
+    cases = [
+        ("native", fs, "", ""),
+        ("resample", 16000, "", ""),
+        ("resample_noise", 16000, noise_name, ""),
+        ("resample_noise_cached", 16000, noise_name, cache_dir),
+    ]
+
+    for case, rate, noise, cache in cases:
+        def load():
+            test_obj = measure(
+                audio_interface=FakeAi(sample_rate=fs),
+                audio_path=clip_dir,
+                audio_files=names[rate],
+                bgnoise_file=noise,
+                clip_cache_dir=cache,
+            )
+            test_obj.load_audio()
+
+        if cache:
+            # warm the cache
+            load()
+
+        runner.run(f"load_audio.{case}", load, clips=4, clip_dur=4, file_rate=rate)
+
+
+# -----------------------------[process_audio]-----------------------------
+
+
+def bench_process_audio(runner, tmp_dir, windowed=False):
+    rng = np.random.default_rng(1)
+    chan_names = ["rx_voice", "PTT_signal", "timecode", "start_signal"]
+
+    for dur in (3, 10, 30):
+        clip = speech_like(rng, dur, fs)
+
+        test_obj = measure(audio_interface=FakeAi(sample_rate=fs), windowed_search=windowed)
+        test_obj.y = [clip]
+        test_obj.load_dly_est()
+
+        # received audio is delayed with overplay
+        rx = np.concatenate((np.zeros(int(0.2 * fs)), clip, np.zeros(int(0.8 * fs))))
+        rx += 1e-4 * rng.normal(size=rx.shape)
+
+        for chans in (1, 2, 4):
+            rec_chans = chan_names[:chans]
+            dat = np.column_stack([rx] + [0.1 * rng.normal(size=rx.shape) for _ in range(chans - 1)])
+            name = os.path.join(tmp_dir, f"rx_{dur}_{chans}.wav")
+            mcvqoe.base.audio_write(name, fs, dat)
+
+            # first trial sets up the delay prior for windowed searches
+            test_obj.process_audio(0, name, rec_chans)
+
+            search = "windowed" if windowed else "full"
+            runner.run(
+                f"process_audio.{search}.{dur}s.{chans}ch",
+                lambda: test_obj.process_audio(0, name, rec_chans),
+                clip_dur=dur,
+                channels=chans,
+                search=search,
+            )
+
+
+# -------------------------------[evaluate]-------------------------------
+
+
+def write_sessions(path, trials, sessions=4):
+    """Write synthetic session csv files with a total number of trials."""
+    rng = np.random.default_rng(2)
+    names = []
+    for k in range(sessions):
+        n = trials // sessions
+        # autocorrelated latency, like real measurements
+        e = rng.normal(scale=1e-3, size=n)
+        x = np.empty(n)
+        x[0] = e[0]
+        for m in range(1, n):
+            x[m] = 0.5 * x[m - 1] + e[m]
+        name = os.path.join(path, f"01-Jan-2021_00-00-{k:02d}_M2E.csv")
+        pd.DataFrame({
+            "Timestamp": "01-Jan-2021 00:00:00",
+            "Filename": [f"F{m % 4 + 1}_harvard_phrases" for m in range(n)],
+            "m2e_latency": 0.2 + x,
+            "channels": "(rx_voice)",
+        }).to_csv(name, index=False)
+        names.append(name)
+    return names
+
+
+def bench_evaluate(runner, tmp_dir, scales, resamples):
+    for trials in scales:
+        path = os.path.join(tmp_dir, f"eval_{trials}")
+        os.makedirs(path)
+        names = write_sessions(path, trials)
+
+        params = {"trials": trials, "resamples": resamples}
+
+        def remove_sidecars():
+            for f in os.listdir(path):
+                if not f.endswith(".csv"):
+                    os.remove(os.path.join(path, f))
+
+        runner.run(
+            f"evaluate.init.csv.{trials}",
+            lambda: evaluate(names, seed=0, resamples=resamples),
+            **params,
+        )
+        runner.run(
+            f"evaluate.init.sidecar_write.{trials}",
+            lambda: evaluate(names, use_sidecar=True, seed=0, resamples=resamples),
+            setup=remove_sidecars,
+            **params,
+        )
+        runner.run(
+            f"evaluate.init.sidecar.{trials}",
+            lambda: evaluate(names, use_sidecar=True, seed=0, resamples=resamples),
+            **params,
+        )
+
+        runner.run(
+            f"evaluate.streaming.{trials}",
+            lambda: streaming_evaluate(names, seed=0, resamples=resamples).close(),
+            **params,
+        )
+
+        eval_obj = evaluate(names, seed=0, resamples=resamples)
+        runner.run(f"evaluate.find_thinning_factor.{trials}", eval_obj.find_thinning_factor, **params)
+        runner.run(f"evaluate.eval.{trials}", eval_obj.eval, **params)
+
+        js = eval_obj.to_json()
+        npz = eval_obj.to_npz()
+        runner.run(f"evaluate.to_json.{trials}", eval_obj.to_json, size=len(js), **params)
+        runner.run(f"evaluate.load_json_data.{trials}", lambda: evaluate.load_json_data(js), **params)
+        runner.run(f"evaluate.to_npz.{trials}", eval_obj.to_npz, size=len(npz), **params)
+        runner.run(f"evaluate.load_npz_data.{trials}", lambda: evaluate.load_npz_data(npz), **params)
+
+
+# ---------------------------------[main]---------------------------------
+
+
+def compare(results, baseline_name):
+    """Print the change in median time relative to a saved run."""
+    with open(baseline_name) as f:
+        baseline = {r["name"]: r for r in json.load(f)["results"]}
+
+    print(f"\n{'Benchmark':<45}{'Baseline (ms)':>14}{'Now (ms)':>12}{'Ratio':>8}")
+    for r in results:
+        if r["name"] in baseline:
+            old = baseline[r["name"]]["median"]
+            print(f"{r['name']:<45}{old * 1e3:>14.2f}{r['median'] * 1e3:>12.2f}{r['median'] / old:>8.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-o', '--output', default=None, metavar='FILE',
+                        help='Write results, as JSON, to FILE')
+    parser.add_argument('-c', '--compare', default=None, metavar='FILE',
+                        help='Compare results with a JSON file from a previous run')
+    parser.add_argument('-k', '--select', default=[], action='extend', nargs='+', metavar='PATTERN',
+                        help='Only run benchmarks with names matching PATTERN, e.g. \'evaluate.*\'')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='Number of times to run each benchmark (default: %(default)s)')
+    parser.add_argument('-s', '--scales', type=int, default=[1000, 100000, 1000000], action='store', nargs='+',
+                        metavar='N', help='Numbers of trials for evaluate benchmarks (default: %(default)s)')
+    parser.add_argument('-R', '--resamples', type=int, default=1000,
+                        help='Bootstrap resamples for evaluate benchmarks (default: %(default)s)')
+    parser.add_argument('--quick', action='store_true',
+                        help='Run fewer repeats and skip the largest evaluate scale')
+
+    args = parser.parse_args()
+
+    if args.quick:
+        args.repeat = min(args.repeat, 2)
+        args.scales = [s for s in args.scales if s < 1000000]
+
+    runner = benchmark_runner(select=args.select, repeat=args.repeat)
+
+    print(f"{'Benchmark':<45}{'Min (ms)':>12}{'Median (ms)':>12}")
+
+    bench_imports(runner)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench_load_audio(runner, tmp_dir)
+        bench_process_audio(runner, tmp_dir)
+        bench_process_audio(runner, tmp_dir, windowed=True)
+        bench_evaluate(runner, tmp_dir, args.scales, args.resamples)
+
+    out = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "version": mcvqoe.mouth2ear.version,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "cpus": os.cpu_count(),
+            "repeat": args.repeat,
+        },
+        "results": runner.results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(out, f, indent=2)
+
+    if args.compare:
+        compare(runner.results, args.compare)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
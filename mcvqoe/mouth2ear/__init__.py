@@ -1,3 +1,11 @@
 from .m2e import measure
-from .m2e_eval import evaluate
 from .version import version, version_tuple
+
+
+def __getattr__(name):
+    # evaluation pulls in pandas and plotly, only import it when used
+    if name in ("evaluate", "streaming_evaluate"):
+        from . import m2e_eval
+
+        return getattr(m2e_eval, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
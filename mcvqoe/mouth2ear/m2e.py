@@ -1,20 +1,273 @@
+import datetime
+import importlib.resources
+import io
 import os
+import shutil
+import time
+import warnings
 
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from fractions import Fraction
+from itertools import cycle
 
-import mcvqoe.mouth2ear.m2e_eval as evaluation
 import mcvqoe.base
 import mcvqoe.delay
 import numpy as np
-import pkg_resources
 import scipy.signal
+from mcvqoe.base.misc import write_cp
 from mcvqoe.base.terminal_user import terminal_progress_update
-from mcvqoe.delay.ITS_delay import active_speech_level
+from mcvqoe.base.write_log import fill_log, pre as log_pre
 
 # version import for logging purposes
 from .version import version
 
+from .m2e_audio import (
+    audio_formats,
+    audio_read,
+    audio_read_channel,
+    audio_write,
+    clip_cache,
+    compress_audio,
+    find_audio_file,
+    noise_mixer,
+    save_recording,
+)
+from .m2e_delay import delay_estimator
+from .m2e_timing import profile_hook, timed, trial_timer
+from .m2e_writer import background_writer
+
+# named tuple to hold sample rate when there is no audio interface
+FakeAi = namedtuple("FakeAi", "sample_rate")
+
+# bootstrap resamples used when checking sequential stopping
+_seq_resamples = 1000
+
+# number of recent delays used for the windowed search prior
+_dly_history_len = 10
+
+# bootstrap resamples used for post test results, same as `evaluate`
+_post_resamples = int(1e4)
+
+# measure object used by post_process worker processes
+_worker_obj = None
+
+# attributes that are not copied to worker processes. Hardware, callbacks and
+# test state are not needed to process audio and may not be picklable
+_worker_skip = (
+    "audio_interface", "ri", "get_post_notes", "progress_update", "gui_extras", "timing_hooks", "info", "dly_est",
+)
+
+
+def _clip_path(name):
+    """Get the path of a clip that is included with the package."""
+    try:
+        clips = importlib.resources.files("mcvqoe.mouth2ear") / "audio_clips"
+    except AttributeError:
+        # importlib.resources.files is new in python 3.9
+        clips = os.path.join(os.path.dirname(__file__), "audio_clips")
+    return os.path.join(str(clips), name)
+
+
+def _eval_latency(latency):
+    """
+    Get the mean and confidence interval of one test, as `evaluate` would.
+
+    Parameters
+    ----------
+    latency : numpy array
+        Latencies, in seconds, for each trial in the test.
+
+    Returns
+    -------
+    tuple
+        Mean, of the thinned data, and confidence interval.
+    """
+    from . import m2e_eval as evaluation
+
+    thinning, _ = evaluation.common_thinning_factor(latency)
+    if np.isnan(thinning):
+        warnings.warn("No common thinning factor found ")
+        thinning = 1
+
+    thinned = latency[::thinning]
+    ci = evaluation.bootstrap_datasets_ci(thinned, R=_post_resamples)
+    return np.mean(thinned), ci
+
+
+def add_process_options(parser, test_obj):
+    """
+    Add command line options for how recorded trials are processed.
+
+    These are shared by the test entry points, through `add_run_options`, and
+    m2e-reprocess. Defaults are taken from test_obj.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        Parser to add options to.
+    test_obj : measure
+        Object to get default values from.
+    """
+    parser.add_argument('-j', '--jobs', type=int, default=test_obj.jobs, metavar='N',
+                        help='Number of processes to use for processing trials. During a test, these are the '
+                        'background workers used with --pipeline (default: %(default)s)')
+    parser.add_argument('--windowed-search', dest='windowed_search', action='store_true',
+                        default=test_obj.windowed_search,
+                        help='Search for delay in a window around the delays of recent trials')
+    parser.add_argument('--full-search', dest='windowed_search', action='store_false',
+                        help='Search the full range of delays for every trial (default)')
+    parser.add_argument('--search-window', dest='search_window', type=float, default=test_obj.search_window,
+                        metavar='W', help='Half width, in seconds, of the windowed search (default: %(default)s)')
+    parser.add_argument('--poly-resample', dest='poly_resample', action='store_true', default=test_obj.poly_resample,
+                        help='Resample audio for delay estimation with a polyphase filter. Faster, but results can '
+                        'differ slightly from the FFT resampling used by default')
+
+
+def add_run_options(parser, test_obj):
+    """
+    Add command line options for how a test is run, stored and stopped.
+
+    These are shared by the hardware and simulation entry points. Defaults
+    are taken from test_obj. Use `apply_run_options` to set them.
+
+    Parameters
+    ----------
+    parser : argparse.ArgumentParser
+        Parser to add options to.
+    test_obj : measure
+        Object to get default values from.
+    """
+    parser.add_argument('--audio-format', dest='audio_format', default=test_obj.audio_format,
+                        choices=list(audio_formats),
+                        help='Format to store saved audio in (default: %(default)s)')
+    parser.add_argument('--background-write', dest='background_write', action='store_true',
+                        default=test_obj.background_write,
+                        help='Write audio and csv data in a background thread')
+    parser.add_argument('--no-background-write', dest='background_write', action='store_false',
+                        help='Write audio and csv data between trials (default)')
+    parser.add_argument('--write-queue-size', dest='write_queue_size', type=int, default=test_obj.write_queue_size,
+                        metavar='N', help='Maximum number of background writes waiting at once (default: %(default)s)')
+    parser.add_argument('--timing', dest='timing', action='store_true', default=test_obj.timing,
+                        help='Record how long each stage of each trial takes and print a summary')
+    parser.add_argument('--profile', dest='profile', default=None, metavar='FILE',
+                        help='Profile trial stages with cProfile and save stats to FILE, implies --timing')
+    parser.add_argument('--pipeline', dest='pipeline', action='store_true', default=test_obj.pipeline,
+                        help='Estimate latency in the background while the next trial is played')
+    parser.add_argument('--no-pipeline', dest='pipeline', action='store_false',
+                        help='Estimate latency for each trial before playing the next one')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=test_obj.batch_size, metavar='N',
+                        help='Number of trials sent to the background worker at once with --pipeline '
+                        '(default: %(default)s)')
+    parser.add_argument('--ci-target', dest='ci_target', type=float, default=test_obj.ci_target, metavar='W',
+                        help='Stop the test once the confidence interval half-width, in seconds, is below W. '
+                        '--trials sets the maximum number of trials. (default: run all trials)')
+    parser.add_argument('--min-trials', dest='min_trials', type=int, default=test_obj.min_trials, metavar='T',
+                        help='Minimum number of trials to run before checking --ci-target (default: %(default)s)')
+    parser.add_argument('--ci-check-trials', dest='ci_check_trials', type=int, default=test_obj.ci_check_trials,
+                        metavar='K', help='Check --ci-target every K trials (default: %(default)s)')
+    parser.add_argument('--ci-alpha', dest='ci_alpha', type=float, default=test_obj.ci_alpha, metavar='A',
+                        help='Significance level of the confidence interval checked against --ci-target. '
+                        'It is corrected for the number of checks. (default: %(default)s)')
+    add_process_options(parser, test_obj)
+    parser.add_argument('--clip-cache', dest='clip_cache_dir', default=test_obj.clip_cache_dir, metavar='DIR',
+                        help='Cache resampled and noise mixed clips in DIR so they are only processed once. '
+                        'Uses up to --clip-cache-size bytes of disk. (default: no cache)')
+    parser.add_argument('--clip-cache-size', dest='clip_cache_size', type=float, default=test_obj.clip_cache_size,
+                        metavar='BYTES', help='Maximum disk space used by --clip-cache (default: %(default)s)')
+
+
+def apply_run_options(test_obj, args):
+    """
+    Set attributes of test_obj from parsed command line arguments.
+
+    Every argument that matches an attribute of test_obj is set. The
+    --profile option, from `add_run_options`, adds a `profile_hook`.
+
+    Parameters
+    ----------
+    test_obj : measure
+        Object to set attributes on.
+    args : argparse.Namespace
+        Parsed arguments.
+    """
+    for k, v in vars(args).items():
+        if hasattr(test_obj, k):
+            setattr(test_obj, k, v)
+
+    # profile trial stages
+    if getattr(args, "profile", None):
+        test_obj.timing = True
+        test_obj.timing_hooks.append(profile_hook(filename=args.profile))
+
+
+def _init_worker(obj):
+    """Set up a measure object, from `measure._worker_copy`, in a worker process."""
+    global _worker_obj
+
+    _worker_obj = obj
+    _worker_obj.load_dly_est()
+
+
+def _process_trial(args):
+    """Call process_audio, in a worker process, for one trial."""
+    return _worker_obj.process_audio(*args)
+
+
+def _process_trials(args_list):
+    """Call process_audio, in a worker process, for a batch of trials."""
+    return [_worker_obj.process_audio(*args) for args in args_list]
+
+
+class _trial_batch():
+    """Trials that are sent to a worker process together."""
+
+    def __init__(self):
+        self.args = []
+        self.future = None
+
+    def add(self, args):
+        """Add a trial to the batch and return its result placeholder."""
+        self.args.append(args)
+        return _batch_result(self, len(self.args) - 1)
+
+    def submit(self, executor):
+        """Send the batch to a worker process, if not already sent."""
+        if self.future is None and self.args:
+            self.future = executor.submit(_process_trials, self.args)
+
+
+class _batch_result():
+    """Result of one trial in a `_trial_batch`, works like a Future."""
+
+    def __init__(self, batch, index):
+        self.batch = batch
+        self.index = index
+
+    def done(self):
+        return self.batch.future is not None and self.batch.future.done()
+
+    def result(self):
+        return self.batch.future.result()[self.index]
+
+
+class _trial_output():
+    """Where, and how, `measure` writes the trials of a test."""
+
+    def __init__(self, data_file, dat_format, writer, executor):
+        # .csv file and format string for its rows
+        self.data_file = data_file
+        self.dat_format = dat_format
+        # background_writer for audio and .csv rows
+        self.writer = writer
+        # worker pool, for pipelined runs
+        self.executor = executor
+        # trials waiting to be sent to a worker
+        self.batch = _trial_batch()
+        # trials that have been played but not written
+        self.pending = deque()
+
 
 class measure(mcvqoe.base.Measure):
     # on load conversion to datetime object fails for some reason
@@ -27,17 +280,17 @@ class measure(mcvqoe.base.Measure):
         "channels": mcvqoe.base.parse_audio_channels,
     }
 
-    no_log = ("test", "rng")
+    no_log = ("test", "rng", "dly_est", "timing_hooks", "gui_extras")
     
     measurement_name = "M2E"
 
     def __init__(self, **kwargs):
 
         self.audio_files = [
-            pkg_resources.resource_filename("mcvqoe.mouth2ear", "audio_clips/F1_harvard_phrases.wav"),
-            pkg_resources.resource_filename("mcvqoe.mouth2ear", "audio_clips/F2_harvard_phrases.wav"),
-            pkg_resources.resource_filename("mcvqoe.mouth2ear", "audio_clips/M1_harvard_phrases.wav"),
-            pkg_resources.resource_filename("mcvqoe.mouth2ear", "audio_clips/M2_harvard_phrases.wav"),
+            _clip_path("F1_harvard_phrases.wav"),
+            _clip_path("F2_harvard_phrases.wav"),
+            _clip_path("M1_harvard_phrases.wav"),
+            _clip_path("M2_harvard_phrases.wav"),
         ]
         self.audio_path = ""
         self.full_audio_dir = False
@@ -54,9 +307,48 @@ class measure(mcvqoe.base.Measure):
         self.trials = 100
         self.get_post_notes = None
         self.progress_update = terminal_progress_update
+        # extra arguments passed to progress_update by a GUI
+        self.gui_extras = []
         self.rng = np.random.default_rng()
         self.save_tx_audio = True
         self.save_audio = True
+        # format for saved audio, a key in m2e_audio.audio_formats
+        self.audio_format = "wav"
+        # write audio and csv rows in a background thread
+        self.background_write = False
+        # maximum number of writes waiting in the background
+        self.write_queue_size = 64
+        # record how long each stage of each trial takes
+        self.timing = False
+        # timing_hook objects to notify of timed stages
+        self.timing_hooks = []
+        # directory to cache resampled and noise mixed clips in, None to disable
+        self.clip_cache_dir = None
+        # maximum disk space, in bytes, used by the clip cache
+        self.clip_cache_size = 500e6
+        # number of processes to use for post_process and pipelined runs
+        self.jobs = 1
+        # estimate latency in the background while the next trial is played
+        self.pipeline = False
+        # number of trials sent to a worker at once in pipelined runs
+        self.batch_size = 1
+        # keep recordings in memory, used when save_audio is False
+        self.in_memory = False
+        # stop when the CI half-width, in seconds, is below this. None to disable
+        self.ci_target = None
+        # minimum number of trials before checking ci_target
+        self.min_trials = 30
+        # number of trials between ci_target checks
+        self.ci_check_trials = 10
+        # significance level of the confidence interval checked against ci_target
+        self.ci_alpha = 0.05
+        # search for delay in a window around recent delays
+        self.windowed_search = False
+        # half width, in seconds, of the windowed search
+        self.search_window = 0.1
+        # resample received audio with a polyphase filter instead of the FFT
+        # resampling used by ITS_delay_est, faster but results can differ slightly
+        self.poly_resample = False
         # Variables for multiple iterations
         self.iterations = 1
         self.data_filename = []
@@ -99,6 +391,17 @@ class measure(mcvqoe.base.Measure):
         In most cases run() will call this automatically but, it can be called
         in the case that self.audio_files is changed after run() is called
 
+        If self.full_audio_dir is True, all audio files in self.audio_path are
+        used. Clips that are stored in more than one format are only loaded
+        once, from the file in self.audio_format if there is one.
+
+        If self.bgnoise_file is set, noise is mixed into all clips at once with
+        a `noise_mixer`, after they have been loaded. Clips that need to be
+        resampled or mixed with noise are cached in self.clip_cache_dir, if it
+        is set, so they only need to be processed once. The cache is off by
+        default, when enabled it uses up to self.clip_cache_size bytes of disk
+        space and the least recently used clips are removed past that.
+
         Parameters
         ----------
 
@@ -124,35 +427,62 @@ class measure(mcvqoe.base.Measure):
             # set to none for now, we'll get this from files
             fs_test = None
 
-        # Get bgnoise_file and resample
+        # get clip cache, if enabled
+        if self.clip_cache_dir:
+            cache = clip_cache(self.clip_cache_dir, max_size=self.clip_cache_size)
+        else:
+            cache = None
+
+        # settings, other than sample rate, that change the processed clip
         if self.bgnoise_file:
-            nfs, nf = mcvqoe.base.audio_read(self.bgnoise_file)
-            rs = Fraction(fs_test / nfs)
-            nf = scipy.signal.resample_poly(nf, rs.numerator, rs.denominator)
+            noise_settings = {
+                "bgnoise_file": clip_cache.file_id(self.bgnoise_file),
+                "bgnoise_snr": self.bgnoise_snr,
+            }
+        else:
+            noise_settings = {}
 
         if self.full_audio_dir:
-            # override audio_files
-            self.audio_files = []
+            # audio file for each clip name, a clip may be stored in more than
+            # one format, such as after converting in place, only use one
+            clip_files = {}
             # look through all things in audio_path
             for f in os.scandir(self.audio_path):
                 # make sure this is a file
                 if f.is_file():
                     # get extension
-                    _, ext = os.path.splitext(f.name)
-                    # check for .wav files
-                    if ext == ".wav":
-                        # add to list
-                        self.audio_files.append(f.name)
+                    stem, ext = os.path.splitext(f.name)
+                    # check for audio files
+                    if ext in audio_formats.values():
+                        # prefer the format that audio is saved in
+                        if stem not in clip_files or ext == audio_formats[self.audio_format]:
+                            clip_files[stem] = f.name
                 # TODO : recursive search?
+            # override audio_files
+            self.audio_files = list(clip_files.values())
 
         # list for input speech
         self.y = []
 
+        # index and cache key for clips that were not found in the cache
+        new_clips = []
+
         for f in self.audio_files:
-            # make full path from relative paths
-            f_full = os.path.join(self.audio_path, f)
+            # make full path from relative paths, clips may be compressed
+            f_full = find_audio_file(os.path.join(self.audio_path, f))
+
+            # check cache, only possible if we know the sample rate
+            if cache and fs_test:
+                cache_key = cache.key(f_full, sample_rate=fs_test, **noise_settings)
+                audio = cache.load(cache_key)
+                if audio is not None:
+                    self.y.append(audio)
+                    continue
+            else:
+                cache_key = None
+
             # load audio
-            fs_file, audio_dat = mcvqoe.base.audio_read(f_full)
+            fs_file, audio_dat = audio_read(f_full)
             # check fs
             if fs_file != fs_test:
                 # check if we have a sample rate
@@ -163,38 +493,98 @@ class measure(mcvqoe.base.Measure):
                     audio = audio_dat
                 else:
                     # yes, resample to desired rate
-                    rs_factor = Fraction(fs_test / fs_file)
+                    rs_factor = Fraction(int(fs_test), int(fs_file))
                     audio = scipy.signal.resample_poly(audio_dat, rs_factor.numerator, rs_factor.denominator)
             else:
                 # set audio
                 audio = audio_dat
 
-            # check if we are adding noise
-            if self.bgnoise_file:
+            # only cache clips that need processing
+            if fs_file == fs_test and not self.bgnoise_file:
+                cache_key = None
+
+            new_clips.append((len(self.y), cache_key))
 
-                # measure amplitude of signal and noise
-                sig_level = active_speech_level(audio, self.audio_interface.sample_rate)
-                noise_level = active_speech_level(nf, self.audio_interface.sample_rate)
+            # append audio to list
+            self.y.append(audio)
 
-                # calculate noise gain required to get desired SNR
-                noise_gain = sig_level - (self.bgnoise_snr + noise_level)
+        # check if we are adding noise
+        if self.bgnoise_file and new_clips:
+            # resample noise and measure level once for all clips
+            mixer = noise_mixer(self.bgnoise_file, fs_test)
 
-                # set noise to the correct level
-                noise_scaled = nf * (10 ** (noise_gain / 20))
+            new_idx = [n for n, _ in new_clips]
+            noisy_clips = mixer.mix([self.y[n] for n in new_idx], self.bgnoise_snr)
 
-                # add noise (repeated to audio file size)
-                audio = audio + np.resize(noise_scaled, audio.size)
+            for n, audio in zip(new_idx, noisy_clips):
+                self.y[n] = audio
 
-            # append audio to list
-            self.y.append(audio)
+        # store processed clips in the cache
+        for n, cache_key in new_clips:
+            if cache_key:
+                cache.store(cache_key, self.y[n])
 
         # check if we have an audio interface (running actual test)
         if not self.audio_interface:
-            # create a named tuple to hold sample rate
-            FakeAi = namedtuple("FakeAi", "sample_rate")
             # create a fake one
             self.audio_interface = FakeAi(sample_rate=fs_test)
 
+        # precompute clip spectra for delay estimation
+        self.load_dly_est()
+
+    def load_dly_est(self):
+        """
+        create delay estimators for the audio clips in self.y.
+
+        This creates a `delay_estimator` for each clip and stores them in
+        self.dly_est. Clip spectra are computed here so they do not need to be
+        recomputed for every trial. This is called by load_audio() so, it only
+        needs to be called if self.y is changed after that.
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+
+        See Also
+        --------
+        mcvqoe.mouth2ear.m2e_delay.delay_estimator : Delay estimator class.
+        """
+
+        self.dly_est = [
+            delay_estimator(
+                clip,
+                fs=self.audio_interface.sample_rate,
+                windowed=self.windowed_search,
+                window=self.search_window,
+                poly_resample=self.poly_resample,
+            )
+            for clip in self.y
+        ]
+        # recent delays, used as the prior for windowed searches
+        self._dly_history = deque(maxlen=_dly_history_len)
+
+    def _worker_copy(self):
+        """
+        Get a copy of this object for processing trials in worker processes.
+
+        All settings, and the audio clips, are copied so workers process
+        trials exactly like this object. Hardware, callbacks and private test
+        state are left out, see `_worker_skip`.
+
+        Returns
+        -------
+        measure
+            Copy to pass to `_init_worker`.
+        """
+        obj = measure.__new__(measure)
+        obj.__dict__.update({
+            k: v for k, v in vars(self).items() if not k.startswith("_") and k not in _worker_skip
+        })
+        obj.audio_interface = FakeAi(sample_rate=self.audio_interface.sample_rate)
+        return obj
+
     def param_check(self):
         """Check all input parameters for value errors"""
 
@@ -206,12 +596,612 @@ class measure(mcvqoe.base.Measure):
 
         if self.ptt_wait < 0:
             raise ValueError("\nptt_wait parameter must be >= 0")
+
+        if self.ci_target is not None and self.ci_target <= 0:
+            raise ValueError("\nci_target parameter must be greater than 0")
+
+        if self.min_trials < 1:
+            raise ValueError("\nmin_trials parameter must be at least 1")
+
+        if self.ci_check_trials < 1:
+            raise ValueError("\nci_check_trials parameter must be at least 1")
+
+        if not 0 < self.ci_alpha < 1:
+            raise ValueError("\nci_alpha parameter must be between 0 and 1")
+
+        if self.batch_size < 1:
+            raise ValueError("\nbatch_size parameter must be at least 1")
+
+        if self.jobs < 1:
+            raise ValueError("\njobs parameter must be at least 1")
+
+        if self.write_queue_size < 1:
+            raise ValueError("\nwrite_queue_size parameter must be at least 1")
+
+        if self.audio_format not in audio_formats:
+            raise ValueError(f"\n{self.audio_format} is not a supported audio format. "
+                             f"Must be one of {list(audio_formats)}")
+
+        if self.search_window <= 0:
+            raise ValueError("\nsearch_window parameter must be greater than zero")
             
         if self.iterations < 1:
             raise ValueError(
                 f"Can't have less than 1 iteration of a test. {self.iterations} iterations chosen."
             )
 
+    def run_1loc(self):
+        """
+        Run a one location M2E test.
+
+        This is a copy of `mcvqoe.base.Measure.run_1loc`, section by section,
+        so fixes there can be carried over. The base loop processes and writes
+        each trial inline, with no way to defer that, so the only changes are
+        in small per-trial hooks: `_play_record` chooses where recordings go,
+        `_process_trial` estimates latency and writes the trial, now or later,
+        and `_flush_trials` writes any trials that are left. Sequential
+        stopping, timing and the background writer are added around the loop.
+        This copy can go once the base class has hooks for these.
+
+        If self.pipeline is True, latency estimation for each trial is done in
+        a background process while the next trial is played. Workers get a
+        copy of this object from `_worker_copy`. Trials are sent to workers in
+        batches of self.batch_size. Rows are written to the .csv file, in trial
+        order, as results become available.
+
+        If self.in_memory is True and self.save_audio is False, recordings are
+        kept in memory buffers and never written to disk.
+
+        If self.background_write is True, recordings are kept in memory and
+        saved, along with .csv rows, by a `background_writer` thread so the
+        playback loop doesn't wait for storage. Files are flushed and synced
+        at the end of each test, even if there is an error.
+
+        If self.timing is True, the duration of each stage of each trial is
+        written to a '_timing.csv' file next to the data file and a summary is
+        printed at the end of the test. Stages are timed with a `trial_timer`
+        that notifies self.timing_hooks.
+
+        Returns
+        -------
+        list of str
+            Names of the .csv files that data was written to.
+        """
+
+        # only keep files from this run, so repeated runs index the right test
+        self.data_dirs = []
+        self.data_filename = []
+
+        # sequential stopping statistics for each test folder
+        if not hasattr(self, "_stop_stats"):
+            self._stop_stats = {}
+
+        # background writer statistics for each test folder
+        if not hasattr(self, "_writer_stats"):
+            self._writer_stats = {}
+
+        # latencies for each test folder, used for post test results
+        if not hasattr(self, "_test_latencies"):
+            self._test_latencies = {}
+
+        # -----------------[Try statement for ending post notes]---------------
+
+        try:
+
+            # ------------------[For loop for multiple iterations]-----------------
+
+            for itr in range(self.iterations):
+
+                # ------------------------[Test specific setup]------------------------
+
+                self.test_setup()
+
+                # ------------------[Check for correct audio channels]------------------
+
+                self.check_channels()
+
+                # -------------------------[Get Test Start Time]-------------------------
+
+                self.info["Tstart"] = datetime.datetime.now()
+                dtn = self.info["Tstart"].strftime("%d-%b-%Y_%H-%M-%S")
+
+                # --------------------------[Fill log entries]--------------------------
+
+                # Set test name
+                self.info["test"] = self.measurement_name
+
+                # Add iteration number
+                self.info["iteration #"] = f"{itr+1} of {self.iterations}"
+
+                # Add any extra entries
+                self.log_extra()
+
+                # Fill in standard stuff
+                self.info.update(fill_log(self))
+
+                # -----------------------[Setup Files and folders]-----------------------
+
+                # Generate this test's naming convention
+                fold_file_name = f"{dtn}_{self.info['test']}"
+
+                # Create data folder
+                self.data_dirs.append(os.path.join(self.outdir, fold_file_name))
+                os.makedirs(self.data_dirs[itr], exist_ok=True)
+
+                # generate and create wav directory
+                wavdir = os.path.join(self.data_dirs[itr], "wav")
+                os.makedirs(wavdir, exist_ok=True)
+
+                # generate csv name
+                csv_name = os.path.join(self.data_dirs[itr], f"{fold_file_name}.csv")
+
+                # generate temp csv name
+                temp_data_filename = os.path.join(self.data_dirs[itr], f"{fold_file_name}_TEMP.csv")
+                # Temporarily make the data filename the TEMP name
+                self.data_filename.append(temp_data_filename)
+
+                # ---------------------[Load Audio Files if Needed]---------------------
+
+                if not hasattr(self, "y"):
+                    self.load_audio()
+
+                # check audio clips, and possibly, adjust the number of trials
+                self.audio_clip_check()
+
+                # generate clip index
+                self.clipi = self.rng.permutation(self.trials) % len(self.y)
+
+                # -----------------------[Add Tx audio to wav dir]-----------------------
+
+                # get name with out path or ext
+                clip_names = [os.path.basename(os.path.splitext(a)[0]) for a in self.audio_files]
+
+                if hasattr(self, "cutpoints"):
+                    cutpoints = self.cutpoints
+                else:
+                    # placeholder for zip
+                    cutpoints = cycle((None,))
+                # write out Tx clips to files
+                # cutpoints, if present, are always written
+                for dat, name, cp in zip(self.y, clip_names, cutpoints):
+                    out_name = os.path.join(wavdir, f"Tx_{name}")
+                    if self.save_tx_audio and self.save_audio:
+                        audio_write(
+                            out_name + audio_formats[self.audio_format],
+                            int(self.audio_interface.sample_rate),
+                            dat,
+                        )
+                    # write cutpoints, if present
+                    if cp:
+                        write_cp(out_name + ".csv", cp)
+
+                # -------------------------[Generate CSV header]-------------------------
+
+                header, dat_format = self.csv_header_fmt()
+
+                # ---------------------------[write log entry]---------------------------
+
+                # Add the log file to the outside folder and test specific folder
+                log_pre(info=self.info, outdir=self.outdir, test_folder=self.data_dirs[itr])
+
+                # ------------------[Save Time for Set Timing]---------------------
+
+                set_start = datetime.datetime.now().replace(microsecond=0)
+
+                # -------------------------[Turn on RI LED]-------------------------
+
+                self.ri.led(1, True)
+
+                # -----------------------[write initial csv file]-----------------------
+
+                with open(temp_data_filename, "wt") as f:
+                    f.write(header)
+
+                # ------------------------[Measurement Loop]------------------------
+
+                # zero pause count
+                self._pause_count = 0
+
+                if not hasattr(self, "pause_trials"):
+                    # if we don't have pause_trials, that means no pauses
+                    self.pause_trials = np.inf
+
+                # latencies for sequential stopping and post test results
+                self._latencies = self._test_latencies[self.data_dirs[itr]] = []
+                ci_reached = False
+                # number of written trials to check ci_target at next
+                self._next_look = self.min_trials
+
+                if self.pipeline:
+                    # create pool for estimating latency in the background
+                    executor = ProcessPoolExecutor(
+                        max_workers=self.jobs,
+                        initializer=_init_worker,
+                        initargs=(self._worker_copy(),),
+                    )
+                else:
+                    executor = nullcontext()
+
+                # csv rows and audio are written in the background, if enabled
+                writer = background_writer(self.write_queue_size, threaded=self.background_write)
+
+                # where, and how, trials are written by _process_trial
+                self._out = _trial_output(temp_data_filename, dat_format, writer, executor)
+
+                # time trial stages, if enabled
+                self._timer = trial_timer(self.timing_hooks) if self.timing else None
+
+                with executor, writer:
+
+                    for trial in range(self.trials):
+
+                        # -----------------------[Update progress]-------------------------
+
+                        if not self.progress_update("test", self.trials, trial, gui_extras=self.gui_extras):
+                            # turn off LED
+                            self.ri.led(1, False)
+                            print("Exit from user")
+                            break
+
+                        # -----------------------[Get Trial Timestamp]-----------------------
+
+                        ts = datetime.datetime.now().strftime("%d-%b-%Y %H:%M:%S")
+
+                        # --------------------[Key Radio and play audio]--------------------
+
+                        # Press the push to talk button
+                        self.ri.ptt(True)
+
+                        # Pause the indicated amount to allow the radio to access the system
+                        with self._stage(trial, "ptt_wait"):
+                            time.sleep(self.ptt_wait)
+
+                        clip_index = self.clipi[trial]
+
+                        # Create audiofile name/path for recording
+                        audioname = os.path.join(wavdir, f"Rx{trial+1}_{clip_names[clip_index]}.wav")
+
+                        # Play/Record
+                        with self._stage(trial, "play_record"):
+                            recording, rec_chans = self._play_record(trial, clip_index, audioname)
+
+                        # Release the push to talk button
+                        self.ri.ptt(False)
+
+                        # -----------------------[Pause Between runs]-----------------------
+
+                        with self._stage(trial, "ptt_gap"):
+                            time.sleep(self.ptt_gap)
+
+                        # -----------------------------[Data Processing]----------------------------
+
+                        extra = {"Timestamp": ts, "Filename": clip_names[clip_index]}
+
+                        # process and write now, or in the background
+                        self._process_trial(trial, clip_index, recording, rec_chans, extra, audioname)
+
+                        # ------------------[Check sequential stopping]------------------
+
+                        if self.ci_target is not None and self._ci_check_due():
+                            stats = self._sequential_stats()
+                            if stats and stats["half_width"] <= self.ci_target:
+                                ci_reached = True
+                                break
+
+                        # ------------------[Check if we should pause]------------------
+
+                        # increment pause count
+                        self._pause_count += 1
+
+                        if self._pause_count >= self.pause_trials:
+
+                            # zero pause count
+                            self._pause_count = 0
+
+                            # Calculate set time
+                            time_diff = datetime.datetime.now().replace(microsecond=0)
+                            set_time = time_diff - set_start
+
+                            # Turn on LED when waiting for user input
+                            self.ri.led(2, True)
+
+                            # wait for user
+                            user_exit = self.user_check(
+                                    "normal-stop",
+                                    "check batteries.",
+                                    trials=self.pause_trials,
+                                    time=set_time,
+                                )
+
+                            # Turn off LED, resuming
+                            self.ri.led(2, False)
+
+                            if user_exit:
+                                # write trials that have been played, the
+                                # writer is flushed when its block exits
+                                self._flush_trials()
+                                raise SystemExit()
+
+                            # Save time for next set
+                            set_start = datetime.datetime.now().replace(microsecond=0)
+
+                    # write out trials that are still being processed
+                    self._flush_trials()
+
+                if self.background_write:
+                    self._writer_stats[self.data_dirs[itr]] = writer.stats()
+                    print(self._writer_log(writer.stats()), end="")
+
+                if self._timer:
+                    self._timer.write(os.path.join(self.data_dirs[itr], f"{fold_file_name}_timing.csv"))
+                    print(self._timer.summary(), end="")
+                    self._timer.end()
+
+                # save final stopping statistics for the log. Trials that were
+                # being processed when the target was reached have been written
+                # so statistics are computed again with all of them
+                if self.ci_target is not None:
+                    stats = self._sequential_stats() or {"trials": len(self._latencies)}
+                    if ci_reached:
+                        print(f"CI target reached after {stats['trials']} trials")
+                    stats["reason"] = "CI target reached" if ci_reached else "CI target not reached"
+                    self._stop_stats[self.data_dirs[itr]] = stats
+
+                # -----------------------------[Cleanup]-----------------------------
+
+                # Add csv_name to self.data_filename
+                # This is done here just in case we abort during a test
+                self.data_filename[itr] = csv_name
+
+                # move temp file to real file
+                shutil.move(temp_data_filename, self.data_filename[itr])
+
+                # ---------------------------[Turn off RI LED]---------------------------
+
+                self.ri.led(1, False)
+
+        finally:
+
+            # don't time process_audio calls made after the test
+            self._timer = None
+
+            # Try just in case we don't have directories yet
+            try:
+                # Sending lists so that post_write can handle multiple iterations
+                post_start = time.perf_counter()
+                self.post_write(test_folder=self.data_dirs, file=self.data_filename)
+                if self.timing:
+                    print(f"post_write took {time.perf_counter() - post_start:.3f} s")
+
+            except AttributeError as e:
+                # Haven't created the self.data_dirs yet
+                print("Error occured before testing began")
+                print(f"\n\n{e}\n\n")
+
+        # Return filename list
+        return self.data_filename
+
+    def _play_record(self, trial, clip_index, audioname):
+        """
+        Play a clip and record the result, for `run_1loc`.
+
+        Parameters
+        ----------
+        trial : int
+            Trial number.
+        clip_index : int
+            Index of the clip to play.
+        audioname : str
+            File to record to. If recordings are kept in memory, this is the
+            name they are saved as, if they are saved.
+
+        Returns
+        -------
+        recording : str or file-like
+            Recorded audio file name or buffer.
+        rec_chans : list of str
+            Recorded channels, as returned by `play_record`.
+        """
+        if self.background_write or (self.in_memory and not self.save_audio):
+            # keep recording in memory, it is saved in the background
+            recording = io.BytesIO()
+            # the audio interface may use the name to get the format
+            recording.name = audioname
+        else:
+            recording = audioname
+
+        rec_chans = self.audio_interface.play_record(self.y[clip_index], recording)
+
+        return recording, rec_chans
+
+    def _process_trial(self, trial, clip_index, recording, rec_chans, extra, audioname):
+        """
+        Estimate latency for a trial and write it, now or once it is processed.
+
+        This does what `mcvqoe.base.Measure.run_1loc` does inline after each
+        trial: process_audio is called and the .csv row is written. If
+        self.pipeline is True, the trial is sent to a worker process, in
+        batches of self.batch_size, and written, in trial order, by a later
+        call once it is done.
+
+        Parameters
+        ----------
+        trial : int
+            Trial number.
+        clip_index : int
+            Index of the clip that was played.
+        recording : str or file-like
+            Recorded audio file name or buffer.
+        rec_chans : list of str
+            Recorded channels, as returned by `play_record`.
+        extra : dict
+            Extra row data, timestamp and clip name.
+        audioname : str
+            Name to save audio as, if it is in a buffer.
+        """
+        out = self._out
+
+        if not self.pipeline:
+            # trial number, for timing stages in process_audio
+            self._trial = trial
+            trial_dat = self.process_audio(clip_index, recording, rec_chans)
+            self._write_trial(trial, trial_dat, extra, recording, audioname)
+            return
+
+        # process in the background, once the batch is full
+        trial_res = out.batch.add((clip_index, recording, rec_chans))
+        out.pending.append((trial, trial_res, extra, recording, audioname))
+        if len(out.batch.args) >= self.batch_size:
+            out.batch.submit(out.executor)
+            out.batch = _trial_batch()
+
+        self._write_trials()
+
+    def _flush_trials(self):
+        """Wait for, and write, all trials that have not been written."""
+        out = self._out
+
+        # send any partial batch
+        out.batch.submit(out.executor)
+        out.batch = _trial_batch()
+
+        self._write_trials(wait=True)
+
+    def _write_trials(self, wait=False):
+        """
+        Write .csv rows for pipelined trials that have finished processing.
+
+        Rows are written in trial order, so this stops at the first trial that
+        is not done.
+
+        Parameters
+        ----------
+        wait : bool, default=False
+            If True, wait for all pending trials to finish.
+        """
+        pending = self._out.pending
+
+        while pending and (wait or pending[0][1].done()):
+            trial, trial_res, extra, recording, audioname = pending.popleft()
+
+            self._write_trial(trial, trial_res.result(), extra, recording, audioname)
+
+    def _write_trial(self, trial, trial_dat, extra, recording, audioname):
+        """
+        Save audio and write the .csv row for one processed trial.
+
+        Parameters
+        ----------
+        trial : int
+            Trial number.
+        trial_dat : dict
+            Results from `process_audio`.
+        extra : dict
+            Extra row data, timestamp and clip name.
+        recording : str or file-like
+            Recorded audio file name or buffer.
+        audioname : str
+            Name to save audio as, if it is in a buffer.
+        """
+        writer = self._out.writer
+
+        # add processing times, measured where the trial was processed
+        timing = trial_dat.pop("timing", None)
+        if self._timer and timing:
+            for name, duration in timing.items():
+                self._timer.add(trial, name, duration)
+
+        # add extra info
+        trial_dat.update(extra)
+
+        # -------------------[Save or delete audio]-------------------
+
+        with self._stage(trial, "audio_write"):
+            if not isinstance(recording, str):
+                if self.save_audio:
+                    writer.submit(save_recording, recording, audioname, self.audio_format)
+            elif not self.save_audio:
+                writer.submit(os.remove, recording)
+            elif self.audio_format != "wav":
+                # processing is done, store in the requested format
+                writer.submit(compress_audio, recording, self.audio_format)
+
+        with self._stage(trial, "csv_write"):
+            writer.append(self._out.data_file, self._out.dat_format.format(**trial_dat))
+
+        self._latencies.append(trial_dat["m2e_latency"])
+
+    def _stage(self, trial, name):
+        """Time a stage of a trial, if timing is enabled."""
+        if getattr(self, "_timer", None) is None:
+            return nullcontext()
+        return self._timer.stage(trial, name)
+
+    def _ci_check_due(self):
+        """
+        Check if ci_target should be checked after the current trial.
+
+        Checks are due every self.ci_check_trials written trials, starting at
+        self.min_trials. Pipelined trials are written several at a time, or
+        not at all, after a trial is played so a check is due once the written
+        count reaches the next check point, and is not repeated until it
+        reaches the one after that.
+        """
+        n = len(self._latencies)
+        if n < self._next_look:
+            return False
+
+        # skip any check points that were passed at once
+        self._next_look = n + self.ci_check_trials - (n - self.min_trials) % self.ci_check_trials
+        return True
+
+    def _ci_looks(self):
+        """Get the largest number of times ci_target can be checked in a test."""
+        return max(1, 1 + (self.trials - self.min_trials) // self.ci_check_trials)
+
+    def _sequential_stats(self):
+        """
+        Compute the running mean and confidence interval of the current test.
+
+        Latencies are thinned, as in `evaluate`, before the mean and
+        confidence interval are computed. A fixed bootstrap seed is used so
+        stopping decisions are repeatable.
+
+        The interval is checked every self.ci_check_trials trials so, to keep
+        the chance of stopping on a bad interval below self.ci_alpha, the
+        significance level is divided by the number of checks that can be
+        made in the test (Bonferroni correction).
+
+        Returns
+        -------
+        dict or None
+            Number of trials, thinning factor, mean, confidence interval,
+            CI half-width and the significance level used for the interval.
+            None if no thinning factor could be found.
+        """
+        # evaluation pulls in pandas, only import it when needed
+        from . import m2e_eval as evaluation
+
+        lat = np.array(self._latencies)
+
+        thinning, _ = evaluation.common_thinning_factor(lat)
+        if np.isnan(thinning):
+            return None
+
+        alpha = self.ci_alpha / self._ci_looks()
+
+        thinned = lat[::thinning]
+        ci = evaluation.bootstrap_datasets_ci(thinned, R=_seq_resamples, alpha=alpha, seed=0)
+
+        return {
+            "trials": len(lat),
+            "thinning": thinning,
+            "mean": np.mean(thinned),
+            "ci": ci,
+            "half_width": (ci[1] - ci[0]) / 2,
+            "alpha": alpha,
+        }
+
     def process_audio(self, clip_index, fname, rec_chans):
         """
         estimate mouth to ear latency for an audio clip.
@@ -220,8 +1210,9 @@ class measure(mcvqoe.base.Measure):
         ----------
         clip_index : int
             index of the matching transmit clip. can be found with find_clip_index
-        fname : str
-            audio file to process
+        fname : str or file-like
+            audio file to process. If fname does not exist, the same recording
+            stored in another format is used, see `find_audio_file`.
         rec_chans : list of strs
             List of audio channel types as returned by `play_record`.
         check : bool, default=False
@@ -232,7 +1223,11 @@ class measure(mcvqoe.base.Measure):
         Returns
         -------
         dict
-            returns a dictionary with estimated values
+            returns a dictionary with estimated values. If self.timing is
+            True and there is no trial timer, as in worker processes, the
+            'timing' entry has the audio read and delay estimation times in
+            seconds. In the measurement process these stages are timed
+            directly, so hooks are notified as they start and end.
 
         See Also
         --------
@@ -242,20 +1237,46 @@ class measure(mcvqoe.base.Measure):
 
         # -----------------------------[Load audio]----------------------------
         
-        fs, rec_dat = mcvqoe.base.audio_read(fname)
-
         # check if we have more than one channel
-        if rec_dat.ndim != 1:
+        if len(rec_chans) > 1:
             # get index of the rx_voice channel
             voice_idx = rec_chans.index("rx_voice")
-            # get voice channel
-            voice_dat = rec_dat[:, voice_idx]
         else:
             # only one channel
-            voice_dat = rec_dat
+            voice_idx = 0
+
+        # in the measurement process stages are timed, and hooks notified, by
+        # self._timer. Worker processes don't have one so times are returned
+        if getattr(self, "_timer", None) is not None:
+            timing = None
+            read_stage = self._stage(self._trial, "audio_read")
+            est_stage = self._stage(self._trial, "delay_est")
+        else:
+            timing = {} if self.timing else None
+            read_stage = timed(timing, "audio_read")
+            est_stage = timed(timing, "delay_est")
+
+        # read only the voice channel, level is normalized in delay estimation
+        # so samples don't need to be converted to float first
+        with read_stage:
+            fs, voice_dat = audio_read_channel(fname, voice_idx)
+
+        with est_stage:
+            # check that we have delay estimators for the current clips
+            if len(getattr(self, "dly_est", ())) != len(self.y):
+                self.load_dly_est()
 
-        # Estimate the mouth to ear latency
-        (_, dly) = mcvqoe.delay.ITS_delay_est(self.y[clip_index], voice_dat, "f", fs=self.audio_interface.sample_rate)
+            # search around recent delays, if enabled
+            if self._dly_history:
+                prior = int(np.median(self._dly_history))
+            else:
+                prior = None
+
+            # Estimate the mouth to ear latency
+            (_, dly) = self.dly_est[clip_index].estimate(voice_dat, prior=prior)
+
+        if dly != 0:
+            self._dly_history.append(dly)
 
         # ----------------------------[calculate M2E]----------------------------
 
@@ -272,88 +1293,260 @@ class measure(mcvqoe.base.Measure):
 
         # -----------------------------[Return Info]-----------------------------
 
-        return {
+        res = {
             "m2e_latency": estimated_m2e_latency,
             "channels": mcvqoe.base.audio_channels_to_string(rec_chans),
         }
+
+        if timing is not None:
+            # returned so times from worker processes can be collected
+            res["timing"] = timing
+
+        return res
     
+    def post_process(self, test_dat, fname, audio_path):
+        """
+        process csv data.
+
+        If self.jobs is greater than one, trials are processed in a pool of
+        worker processes. Each worker gets a copy of the audio clips when it is
+        started, so clips are not sent for every trial. Rows are written in the
+        original trial order.
+
+        Parameters
+        ----------
+        test_data : list of dicts
+            csv data for trials to process
+        fname : string
+            file name to write processed data to
+        audio_path : string
+            where to look for recorded audio clips
+
+        Returns
+        -------
+        """
+
+        if self.jobs <= 1:
+            return super().post_process(test_dat, fname, audio_path)
+
+        # do extra setup things
+        self.test_setup()
+
+        # get .csv header and data format
+        header, dat_format = self.csv_header_fmt()
+
+        # get arguments for process_audio for each trial
+        trial_args = []
+        for n, trial in enumerate(test_dat):
+            # find clip index
+            clip_index = self.find_clip_index(trial["Filename"])
+            # create clip file name
+            clip_name = "Rx" + str(n + 1) + "_" + trial["Filename"] + ".wav"
+
+            try:
+                # attempt to get channels from data
+                rec_chans = trial["channels"]
+            except KeyError:
+                # fall back to only one channel
+                rec_chans = ("rx_voice",)
+
+            trial_args.append((clip_index, os.path.join(audio_path, clip_name), rec_chans))
+
+        # send trials in chunks to cut down on overhead
+        chunksize = max(1, len(trial_args) // (4 * self.jobs))
+
+        with ProcessPoolExecutor(
+                max_workers=self.jobs,
+                initializer=_init_worker,
+                initargs=(self._worker_copy(),),
+                ) as executor, open(fname, "wt") as f_out:
+
+            f_out.write(header)
+
+            # map returns results in trial order
+            results = executor.map(_process_trial, trial_args, chunksize=chunksize)
+
+            for n, (trial, new_dat) in enumerate(zip(test_dat, results)):
+
+                # update progress
+                self.progress_update("proc", self.trials, n)
+
+                # overwrite new data with old and merge
+                merged_dat = {**trial, **new_dat}
+
+                # write line with new data
+                f_out.write(dat_format.format(**merged_dat))
+
     def post_write(self, test_folder="", file=""):
-        """Overwrites measure class post_write() in order to print M2E results in
-        tests.log
         """
-        
+        Write post test notes and M2E results to tests.log files.
+
+        Results are computed from the latencies kept in memory during the
+        test, rather than by reading the data files back with `evaluate`. The
+        data file is only read for tests that were not run by this object. If
+        self.jobs is greater than one, tests are evaluated in parallel.
+
+        The log entries for all tests are written to the outer tests.log at
+        once.
+
+        Parameters
+        ----------
+        test_folder : list of str
+            Test specific data folders.
+        file : list of str
+            Data files for each test.
+        """
+
         if self.get_post_notes:
             # get notes
-            info = {}
-            info.update(self.get_post_notes())
-            for itr in range(len(file)): 
-                eval_obj = evaluation.evaluate(test_names=file[itr])
-                info["mean"], info["ci"] = eval_obj.eval()
-                self.post(info=info, outdir=self.outdir, test_folder=test_folder[itr])
+            notes = self.get_post_notes()
         else:
-            info = {}
-            for itr in range(len(file)):
-                self.post(info=info, outdir=self.outdir, test_folder=test_folder[itr])
-        
+            notes = {}
+
+        results = self._eval_tests(test_folder, file)
+
+        entries = []
+        for folder, res in zip(test_folder, results):
+            info = dict(notes)
+            if res is not None:
+                info["mean"], info["ci"] = res
+            info["sequential"] = getattr(self, "_stop_stats", {}).get(folder)
+            info["writer"] = getattr(self, "_writer_stats", {}).get(folder)
+
+            text = self._post_log(info)
+            entries.append(text)
+
+            # Write ending log entry into specific tests.log
+            with open(os.path.join(folder, "tests.log"), "a") as f:
+                f.write(text)
+
+        # Write to outer tests.log
+        if entries:
+            with open(os.path.join(self.outdir, "tests.log"), "a") as f:
+                f.write("".join(entries))
+
+    def _eval_tests(self, test_folder, file):
+        """
+        Get the mean and confidence interval of each test.
+
+        Parameters
+        ----------
+        test_folder : list of str
+            Test specific data folders.
+        file : list of str
+            Data files for each test.
+
+        Returns
+        -------
+        list
+            Tuple of mean and confidence interval, or None if there is no
+            data, for each test.
+        """
+        from . import m2e_eval as evaluation
+
+        latencies = getattr(self, "_test_latencies", {})
+
+        results = [None] * len(test_folder)
+        # tests to evaluate from in memory latencies
+        todo = []
+        for k, (folder, name) in enumerate(zip(test_folder, file)):
+            if folder in latencies:
+                if latencies[folder]:
+                    todo.append(k)
+            else:
+                # not run by this object, read data file
+                eval_obj = evaluation.evaluate(test_names=name)
+                results[k] = (eval_obj.mean, eval_obj.ci)
+
+        lat = [np.array(latencies[test_folder[k]]) for k in todo]
+
+        if self.jobs > 1 and len(todo) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(todo))) as executor:
+                res = list(executor.map(_eval_latency, lat))
+        else:
+            res = [_eval_latency(x) for x in lat]
+
+        for k, r in zip(todo, res):
+            results[k] = r
+
+        return results
+
     def post(self, info={}, outdir="", test_folder=""):
         """
         Take in a QoE measurement class info dictionary to write post-test to tests.log.
         Specific to M2E
-        ...
-    
+
         Parameters
         ----------
         info : dict
             The <measurement>.info dictionary.
         outdir : str
             The directory to write to.
+        test_folder : str, default=""
+            Test specific folder to also write to.
         """
-    
-        # Add 'outdir' to tests.log path
-        log_datadir = os.path.join(outdir, "tests.log")
-        
+        text = self._post_log(info)
+
         # Write to outer tests.log
-        with open(log_datadir, "a") as file:
-            if "Error Notes" in info:
-                notes = info["Error Notes"]
-                header = "===Test-Error Notes==="
-            else:
-                header = "===Post-Test Notes==="
-                notes = info.get("Post Test Notes", "")
-    
-            # Write header
-            file.write(header + "\n")
-            # Write notes
-            file.write("".join(["\t" + line + "\n" for line in notes.splitlines(keepends=False)]))
-            # Write results
-            file.write("===M2E Results===" + "\n")
-            file.write("\t" + f"Mouth-To-Ear Latency Estimate: {info['mean']}, 95% Confidence Interval: " +
-                       f'{np.array2string(info["ci"], separator=", ")} seconds' + "\n")
-            # Write end
-            file.write("===End Test===\n\n")
-            
+        with open(os.path.join(outdir, "tests.log"), "a") as f:
+            f.write(text)
+
         # Add test's specific log file to folder if given
         if test_folder != "":
-            
-            # Add "test_folder" to tests.log path
-            log_datadir = os.path.join(test_folder, "tests.log")
-            
-            # Write ending log entry into specific tests.log
-            with open(log_datadir, "a") as file:
-                if "Error Notes" in info:
-                    notes = info["Error Notes"]
-                    header = "===Test-Error Notes==="
-                else:
-                    header = "===Post-Test Notes==="
-                    notes = info.get("Post Test Notes", "")
-        
-                # Write header
-                file.write(header + "\n")
-                # Write notes
-                file.write("".join(["\t" + line + "\n" for line in notes.splitlines(keepends=False)]))
-                # Write results
-                file.write("===M2E Results===" + "\n")
-                file.write("\t" + f"Mouth-To-Ear Latency Estimate: {info['mean']}, 95% Confidence Interval: " +
-                           f'{np.array2string(info["ci"], separator=", ")} seconds' + "\n")
-                # Write end
-                file.write("===End Test===\n\n")
\ No newline at end of file
+            with open(os.path.join(test_folder, "tests.log"), "a") as f:
+                f.write(text)
+
+    def _post_log(self, info):
+        """Format post test notes and M2E results for tests.log."""
+        if "Error Notes" in info:
+            notes = info["Error Notes"]
+            header = "===Test-Error Notes==="
+        else:
+            header = "===Post-Test Notes==="
+            notes = info.get("Post Test Notes", "")
+
+        # header and notes
+        text = header + "\n"
+        text += "".join(["\t" + line + "\n" for line in notes.splitlines(keepends=False)])
+        # results, if any trials were done
+        if "mean" in info:
+            text += "===M2E Results===" + "\n"
+            text += (
+                "\t" + f"Mouth-To-Ear Latency Estimate: {info['mean']}, 95% Confidence Interval: " +
+                f'{np.array2string(info["ci"], separator=", ")} seconds' + "\n"
+            )
+        # sequential stopping statistics
+        if info.get("sequential"):
+            text += self._sequential_log(info["sequential"])
+        # background writer statistics
+        if info.get("writer"):
+            text += self._writer_log(info["writer"])
+        text += "===End Test===\n\n"
+        return text
+
+    def _sequential_log(self, stats):
+        """Format sequential stopping statistics for tests.log."""
+        text = "===Sequential Stopping===\n"
+        text += f"\t{stats['reason']} after {stats['trials']} trials, CI half-width target: {self.ci_target} seconds\n"
+        text += (
+            f"\tChecked every {self.ci_check_trials} trials after {self.min_trials}, "
+            f"up to {self._ci_looks()} checks, overall confidence: {100 * (1 - self.ci_alpha):g}%\n"
+        )
+        if "half_width" in stats:
+            text += (
+                f"\tThinning factor: {stats['thinning']}, Running mean: {stats['mean']}, "
+                f"{100 * (1 - stats['alpha']):g}% Confidence Interval: "
+                f'{np.array2string(stats["ci"], separator=", ")}, '
+                f"CI half-width: {stats['half_width']} seconds\n"
+            )
+        return text
+
+    def _writer_log(self, stats):
+        """Format background writer statistics for tests.log."""
+        text = "===Background Writer===\n"
+        text += (
+            f"\tWrites: {stats['writes']}, Write time: {stats['write_time']:.3f} s, "
+            f"Max queue depth: {stats['max_depth']} of {self.write_queue_size}\n"
+            f"\tBlocked on full queue: {stats['blocked']} times, {stats['blocked_time']:.3f} s\n"
+        )
+        return text
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+"""
+Audio file reading, caching and noise mixing for M2E clips and recordings.
+"""
+
+import hashlib
+import os
+
+from fractions import Fraction
+
+import mcvqoe.base
+import numpy as np
+import scipy.io.wavfile
+import scipy.signal
+import soundfile
+
+# file extensions for supported audio storage formats
+audio_formats = {"wav": ".wav", "flac": ".flac"}
+
+
+def find_audio_file(filename):
+    """
+    Find an audio file that may have been stored in another format.
+
+    Parameters
+    ----------
+    filename : str
+        Audio file name, usually with a '.wav' extension.
+
+    Returns
+    -------
+    str
+        filename if it exists. Otherwise, the first file with the same base
+        name and an extension from `audio_formats` that exists. If no file is
+        found, filename is returned.
+    """
+    if os.path.exists(filename):
+        return filename
+
+    base, _ = os.path.splitext(filename)
+    for ext in audio_formats.values():
+        if os.path.exists(base + ext):
+            return base + ext
+
+    return filename
+
+
+def _is_flac(filename):
+    return os.path.splitext(filename)[1].lower() == audio_formats["flac"]
+
+
+def audio_read(filename):
+    """
+    Read an audio file, in any supported format, as float.
+
+    This gives the same results as `mcvqoe.base.audio_read` for a WAV file
+    with the same samples.
+
+    Parameters
+    ----------
+    filename : str
+        Audio file to read. See `find_audio_file`.
+
+    Returns
+    -------
+    sample_rate : int
+        Sample rate of the file.
+    audio_data : numpy array
+        Audio samples as float32.
+    """
+    filename = find_audio_file(filename)
+
+    if not _is_flac(filename):
+        return mcvqoe.base.audio_read(filename)
+
+    audio_data, sample_rate = soundfile.read(filename, dtype="int16")
+
+    return sample_rate, mcvqoe.base.audio_type(audio_data, dtype=np.dtype("float32"))
+
+
+def audio_write(filename, rate, data):
+    """
+    Write audio as 16 bit PCM in the format given by the file extension.
+
+    Parameters
+    ----------
+    filename : str
+        File to write. Files ending in '.flac' are written as FLAC, all others
+        are written with `mcvqoe.base.audio_write`.
+    rate : int
+        The sample rate (in samples/sec).
+    data : numpy array
+        A 1-D or 2-D array of integer or float audio.
+    """
+    if not _is_flac(filename):
+        mcvqoe.base.audio_write(filename, rate, data)
+        return
+
+    data = mcvqoe.base.audio_type(data, dtype=np.dtype("int16"))
+    soundfile.write(filename, data, rate, format="FLAC", subtype="PCM_16")
+
+
+def compress_audio(filename, audio_format):
+    """
+    Convert a WAV file to another storage format.
+
+    Parameters
+    ----------
+    filename : str
+        WAV file to convert. It is removed after conversion.
+    audio_format : str
+        Key in `audio_formats` to convert to.
+
+    Returns
+    -------
+    str
+        Name of the converted file.
+    """
+    base, ext = os.path.splitext(filename)
+    new_name = base + audio_formats[audio_format]
+    if new_name == filename:
+        return filename
+
+    # samples are kept as they are in the file, no conversion to float
+    rate, data = scipy.io.wavfile.read(filename)
+    audio_write(new_name, rate, data)
+    os.remove(filename)
+
+    return new_name
+
+
+def save_recording(buffer, filename, audio_format="wav"):
+    """
+    Save a recording, held in memory as WAV data, to a file.
+
+    Parameters
+    ----------
+    buffer : file-like
+        Buffer, such as `io.BytesIO`, holding a WAV file.
+    filename : str
+        File to save to. The extension is replaced to match audio_format.
+    audio_format : str, default='wav'
+        Key in `audio_formats` to save as.
+
+    Returns
+    -------
+    str
+        Name of the saved file.
+    """
+    filename = os.path.splitext(filename)[0] + audio_formats[audio_format]
+
+    if audio_format == "wav":
+        # already encoded, copy bytes as they are
+        with open(filename, "wb") as f:
+            f.write(buffer.getbuffer())
+    else:
+        buffer.seek(0)
+        rate, data = scipy.io.wavfile.read(buffer)
+        audio_write(filename, rate, data)
+
+    return filename
+
+
+def audio_read_channel(filename, channel=0):
+    """
+    Read a single channel from an audio file.
+
+    WAV files are memory mapped and a strided view of the requested channel is
+    returned, so other channels are never copied into memory. WAV files that
+    can not be memory mapped are read with `mcvqoe.base.audio_read`. FLAC files
+    are decoded with soundfile.
+
+    Parameters
+    ----------
+    filename : str or file-like
+        WAV or FLAC file to read, see `find_audio_file`. File-like objects,
+        such as `io.BytesIO`, are read, as WAV, from the start without memory
+        mapping.
+    channel : int, default=0
+        Index of the channel to return. Ignored for single channel files.
+
+    Returns
+    -------
+    sample_rate : int
+        Sample rate of WAV file.
+    audio_data : numpy array
+        1-D view of the requested channel. Data is in the sample format of the
+        file, it is not scaled to float.
+
+    See Also
+    --------
+    mcvqoe.base.audio_read : Read all channels, converted to float.
+    """
+
+    if hasattr(filename, "read"):
+        # file-like object, can't be memory mapped
+        filename.seek(0)
+        sample_rate, audio_data = scipy.io.wavfile.read(filename)
+    elif _is_flac(find_audio_file(filename)):
+        audio_data, sample_rate = soundfile.read(find_audio_file(filename), dtype="int16")
+    else:
+        try:
+            sample_rate, audio_data = scipy.io.wavfile.read(filename, mmap=True)
+        except ValueError:
+            # format can't be memory mapped (e.g. 24-bit), read the whole file
+            sample_rate, audio_data = mcvqoe.base.audio_read(filename)
+
+    if audio_data.ndim != 1:
+        audio_data = audio_data[:, channel]
+
+    return sample_rate, audio_data
+
+
+class clip_cache():
+    """
+    On-disk cache of processed audio clips.
+
+    Clips are stored as .npy files named by a hash of the source file's path,
+    modification time and size along with any processing settings. When the
+    total size of the cache exceeds `max_size`, the least recently used clips
+    are removed.
+
+    Parameters
+    ----------
+    path : str
+        Directory to store cached clips in. Created if it does not exist.
+    max_size : int, default=500e6
+        Maximum total size, in bytes, of cached clips.
+
+    Examples
+    --------
+    >>> cache = clip_cache(path)
+    >>> key = cache.key('clip.wav', sample_rate=48000)
+    >>> audio = cache.load(key)
+    >>> if audio is None:
+    ...     audio = process_clip('clip.wav')
+    ...     cache.store(key, audio)
+    """
+
+    def __init__(self, path, max_size=500e6):
+        self.path = path
+        self.max_size = max_size
+
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def file_id(filename):
+        """Get a tuple that changes when `filename` changes."""
+        st = os.stat(filename)
+        return (os.path.abspath(filename), st.st_mtime_ns, st.st_size)
+
+    def key(self, filename, **settings):
+        """
+        Generate a cache key for a clip.
+
+        Parameters
+        ----------
+        filename : str
+            Source audio file.
+        **settings
+            Processing settings that change the resulting clip.
+
+        Returns
+        -------
+        str
+            Key for the clip.
+        """
+        key_dat = (self.file_id(filename), sorted(settings.items()))
+
+        return hashlib.sha1(repr(key_dat).encode("utf-8")).hexdigest()
+
+    def _name(self, key):
+        return os.path.join(self.path, key + ".npy")
+
+    def load(self, key):
+        """
+        Load a clip from the cache.
+
+        Parameters
+        ----------
+        key : str
+            Key, from `key`, for the clip.
+
+        Returns
+        -------
+        numpy array or None
+            The cached clip or None if the clip is not in the cache.
+        """
+        name = self._name(key)
+        try:
+            audio = np.load(name)
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+
+        # mark as recently used
+        os.utime(name)
+
+        return audio
+
+    def store(self, key, audio):
+        """
+        Store a clip in the cache and evict old clips if needed.
+
+        Parameters
+        ----------
+        key : str
+            Key, from `key`, for the clip.
+        audio : numpy array
+            Clip to store.
+        """
+        name = self._name(key)
+        # write to temp file first so partial files are never loaded
+        tmp_name = f"{name}.{os.getpid()}.tmp"
+        with open(tmp_name, "wb") as f:
+            np.save(f, audio)
+        os.replace(tmp_name, name)
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used clips until the cache fits in max_size."""
+        entries = []
+        for f in os.scandir(self.path):
+            if f.is_file() and f.name.endswith(".npy"):
+                st = f.stat()
+                entries.append((st.st_mtime, st.st_size, f.path))
+
+        total = sum(e[1] for e in entries)
+
+        # remove oldest first
+        for _, size, name in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                # removed by someone else
+                pass
+            total -= size
+
+
+def speech_levels(clips, fs, chunk_size=64):
+    """
+    Measure the active speech level of several clips.
+
+    This gives the same results as calling
+    `mcvqoe.delay.ITS_delay.active_speech_level` on each clip but, the
+    envelope filter is run on a zero padded matrix of clips so it only needs
+    to be called once for every `chunk_size` clips.
+
+    Parameters
+    ----------
+    clips : list of numpy arrays
+        Clips to measure.
+    fs : int
+        Sample rate of the clips.
+    chunk_size : int, default=64
+        Maximum number of clips to filter at once. Limits memory use for large
+        numbers of clips.
+
+    Returns
+    -------
+    numpy array
+        Active speech level of each clip in dB relative to overload.
+
+    Raises
+    ------
+    ValueError
+        If a clip has no signal.
+    """
+
+    # code will extend each active region by tau samples (forward in time)
+    tau = round(0.200 * fs)
+    # active speech is defined to be dBth dB below max
+    dBth = 20
+    # calculate filter coefficient from time constant
+    g = np.exp(-1 / (fs * 0.03))
+
+    levels = np.zeros(len(clips))
+
+    for start in range(0, len(clips), chunk_size):
+        chunk = clips[start:start + chunk_size]
+
+        lens = [len(c) for c in chunk]
+
+        # rectified, mean removed, clips padded to the same length. filter is
+        # causal so padding at the end doesn't change the filtered clips
+        x = np.zeros((len(chunk), max(lens)))
+        for k, c in enumerate(chunk):
+            x[k, :lens[k]] = np.abs(c - np.mean(c))
+
+        # perform 2nd order IIR filtering
+        x = scipy.signal.lfilter([(1 - g) ** 2], [1, -2 * g, g * g], x, axis=1)
+
+        for k, n in enumerate(lens):
+            xk = x[k, :n]
+            # calculate activity threshold
+            at = np.max(xk) * (10 ** (-dBth / 20))
+
+            if at == 0:
+                raise ValueError("Input vector has no signal")
+            active = xk > at
+            # Extend each active interval tau samples forward in time
+            trans = np.nonzero(np.abs(np.diff(active)))[0]
+            for t in trans:
+                active[t:min(t + tau, n - 1) + 1] = 1
+
+            # Test for both activity and non-zeroness to prevent log(0)
+            xk = xk[np.logical_and(0 < xk, active)]
+            levels[start + k] = 20 * np.mean(np.log10(xk)) - 81
+
+    return levels
+
+
+class noise_mixer():
+    """
+    Mix background noise into clips at a given signal to noise ratio.
+
+    The noise file is read, resampled and its level measured once, when the
+    mixer is created. Clip levels can be measured once, with `speech_levels`,
+    and reused to mix the same clips at several SNRs.
+
+    Parameters
+    ----------
+    noise_file : str
+        WAV file with background noise.
+    fs : int
+        Sample rate of the clips that noise will be mixed with.
+
+    Attributes
+    ----------
+    noise : numpy array
+        Noise resampled to `fs`.
+    noise_level : float
+        Active speech level of the noise.
+
+    Examples
+    --------
+    >>> mixer = noise_mixer('noise.wav', 48000)
+    >>> levels = mixer.speech_levels(clips)
+    >>> for snr in (0, 10, 20):
+    ...     noisy = mixer.mix(clips, snr, levels=levels)
+    """
+
+    def __init__(self, noise_file, fs):
+        self.fs = fs
+
+        nfs, nf = mcvqoe.base.audio_read(noise_file)
+        if nfs != fs:
+            rs = Fraction(int(fs), int(nfs))
+            nf = scipy.signal.resample_poly(nf, rs.numerator, rs.denominator)
+
+        self.noise = nf
+        self.noise_level = speech_levels([nf], fs)[0]
+
+    def speech_levels(self, clips):
+        """Measure the active speech level of clips at the mixer sample rate."""
+        return speech_levels(clips, self.fs)
+
+    def mix(self, clips, snr, levels=None):
+        """
+        Add noise to clips.
+
+        Parameters
+        ----------
+        clips : list of numpy arrays
+            Clips to add noise to.
+        snr : float
+            Signal to noise ratio, in dB.
+        levels : numpy array, optional
+            Levels of clips from `speech_levels`. Measured if not given.
+
+        Returns
+        -------
+        list of numpy arrays
+            Clips with noise added. Noise is repeated to the length of each
+            clip.
+        """
+        if levels is None:
+            levels = self.speech_levels(clips)
+
+        # noise gain required to get desired SNR
+        noise_gains = 10 ** ((levels - (snr + self.noise_level)) / 20)
+
+        return [c + g * np.resize(self.noise, c.size) for c, g in zip(clips, noise_gains)]
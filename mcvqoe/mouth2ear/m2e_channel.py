@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+"""
+Lightweight synthetic channel for fast, simulated, M2E runs.
+"""
+
+import mcvqoe.base
+import numpy as np
+
+from .m2e_audio import speech_levels
+
+
+class delay_channel():
+    """
+    Synthetic channel that delays, scales and adds noise to audio.
+
+    Unlike `mcvqoe.simulation.QoEsim`, no vocoder is simulated. Each clip is
+    delayed by a fixed, or randomly jittered, number of samples, scaled by a
+    gain and has white noise added. `simulate` processes a whole batch of clips
+    at once with NumPy so, large numbers of trials can be generated quickly for
+    regression tests, estimator validation and load testing.
+
+    The object provides the parts of the audio interface and radio interface
+    that `measure` uses, so it can be used for both `measure.audio_interface`
+    and `measure.ri`.
+
+    Parameters
+    ----------
+    **kwargs
+        Values for attributes, see below.
+
+    Attributes
+    ----------
+    sample_rate : int, default=48000
+        Sample rate of audio, in Hz.
+    overplay : float, default=1.0
+        Seconds of silence added to the end of each clip before it goes through
+        the channel.
+    rec_chans : dict, default={'rx_voice': 0}
+        Channels to record. Only 'rx_voice' is supported.
+    playback_chans : dict, default={'tx_voice': 0}
+        Channels to play. Only 'tx_voice' is supported.
+    m2e_latency : float, default=0.1
+        Mean mouth to ear latency, in seconds.
+    jitter : float, default=0
+        Standard deviation, in seconds, of random variation added to
+        m2e_latency for each clip. Delays are never less than zero.
+    gain : float, default=1
+        Gain applied to audio.
+    rec_snr : float or None, default=60
+        Signal to noise ratio, in dB, of the received audio. If None, no noise
+        is added.
+    seed : int or None, default=None
+        Seed for the random number generator used for jitter and noise.
+
+    See Also
+    --------
+    mcvqoe.simulation.QoEsim : Full channel simulation.
+
+    Examples
+    --------
+    Run a quick M2E test with 5 ms of jitter.
+
+    >>> import mcvqoe.mouth2ear
+    >>> from mcvqoe.mouth2ear.m2e_channel import delay_channel
+    >>> chan = delay_channel(m2e_latency=0.2, jitter=5e-3, seed=0)
+    >>> test_obj = mcvqoe.mouth2ear.measure(audio_interface=chan, ri=chan)
+    >>> test_obj.run()
+
+    Delay a batch of clips directly.
+
+    >>> rx = chan.simulate(clips)
+    """
+
+    def __init__(self, **kwargs):
+        self.sample_rate = int(48e3)
+        self.overplay = 1.0
+        self.rec_chans = {"rx_voice": 0}
+        self.playback_chans = {"tx_voice": 0}
+        self.m2e_latency = 0.1
+        self.jitter = 0
+        self.gain = 1
+        self.rec_snr = 60
+        self.seed = None
+        # fake audio interface settings for logs
+        self.blocksize = 512
+        self.buffersize = 20
+        # fake device info for logs
+        self.device = str(__class__)
+        self.port_name = "SIM"
+        self.default_radio = 1
+        self.PTT_state = [False] * 2
+
+        for k, v in kwargs.items():
+            if hasattr(self, k):
+                setattr(self, k, v)
+            else:
+                raise TypeError(f"{k} is not a valid keyword argument")
+
+        self.rng = np.random.default_rng(self.seed)
+
+    def __repr__(self):
+        props = ("sample_rate", "overplay", "rec_chans", "playback_chans",
+                 "m2e_latency", "jitter", "gain", "rec_snr", "seed")
+        props = [f"{p} = {repr(getattr(self, p))}" for p in props]
+        return f'{type(self).__name__}({", ".join(props)})'
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        pass
+
+    # -------------------------[Radio interface methods]-------------------------
+
+    def ptt(self, state, num=None):
+        """Set the state of the fake push-to-talk."""
+        if num is None:
+            num = self.default_radio
+        self.PTT_state[num] = bool(state)
+
+    def led(self, num, state):
+        """Fake LEDs, does nothing."""
+        pass
+
+    def ptt_delay(self, delay, num=None, use_signal=False):
+        """Fake delayed PTT, only sets the PTT state."""
+        self.ptt(True, num)
+
+    def get_version(self):
+        """Get the version of the fake radio interface."""
+        return "delay_channel"
+
+    def get_id(self):
+        """Get the ID of the fake radio interface."""
+        return "delay_channel"
+
+    # ---------------------------[Channel simulation]---------------------------
+
+    def delays(self, n):
+        """
+        Draw per-clip delays.
+
+        Parameters
+        ----------
+        n : int
+            Number of delays to generate.
+
+        Returns
+        -------
+        numpy array
+            Delay, in samples, for each clip.
+        """
+        dly = np.full(n, float(self.m2e_latency))
+        if self.jitter:
+            dly += self.rng.normal(scale=self.jitter, size=n)
+
+        return np.maximum(np.round(dly * self.sample_rate), 0).astype(int)
+
+    def simulate(self, clips, delays=None):
+        """
+        Pass a batch of clips through the channel.
+
+        Parameters
+        ----------
+        clips : list of numpy arrays
+            Clips to send through the channel. Integer clips are converted with
+            `mcvqoe.base.audio_float`.
+        delays : array of ints, optional
+            Delay, in samples, for each clip. Drawn with `delays` if not given.
+
+        Returns
+        -------
+        list of numpy arrays
+            Received audio for each clip. Each is the length of the clip plus
+            overplay.
+        """
+        clips = [mcvqoe.base.audio_float(c) for c in clips]
+
+        if delays is None:
+            delays = self.delays(len(clips))
+        delays = np.asarray(delays, dtype=int)
+
+        overplay_samples = int(self.overplay * self.sample_rate)
+        lens = np.array([len(c) for c in clips]) + overplay_samples
+
+        # clips, with overplay, in a zero padded matrix
+        x = np.zeros((len(clips), max(lens)))
+        for k, c in enumerate(clips):
+            x[k, :len(c)] = c
+
+        # delay line, shift each row by its delay
+        idx = np.arange(x.shape[1]) - delays[:, np.newaxis]
+        rx = np.where(idx >= 0, np.take_along_axis(x, np.maximum(idx, 0), axis=1), 0)
+        rx *= self.gain
+
+        if self.rec_snr is not None:
+            noise = self.rng.normal(size=rx.shape)
+            # measure levels of each clip and its noise
+            levels = speech_levels(clips, self.sample_rate) + 20 * np.log10(abs(self.gain))
+            noise_levels = speech_levels([n[:len(c)] for n, c in zip(noise, clips)], self.sample_rate)
+            # calculate noise gain required to get desired SNR
+            noise_gains = 10 ** ((levels - (self.rec_snr + noise_levels)) / 20)
+            rx += noise_gains[:, np.newaxis] * noise
+
+        return [r[:n] for r, n in zip(rx, lens)]
+
+    def play_record(self, audio, out_name):
+        """
+        Simulate playing and recording audio through the channel.
+
+        Parameters
+        ----------
+        audio : numpy array
+            Audio to pass through the channel.
+        out_name : str or file-like
+            Where to write the received audio as a .wav file.
+
+        Returns
+        -------
+        list of strings
+            Recorded channels, in the order they appear in the output file.
+        """
+        for k in self.playback_chans:
+            if k != "tx_voice":
+                raise ValueError(f"Unknown output channel : {k}")
+
+        for k in self.rec_chans:
+            if k != "rx_voice":
+                raise RuntimeError(f"{__class__} can not generate recordings of type '{k}'")
+
+        rx_voice = self.simulate([audio])[0]
+
+        mcvqoe.base.audio_write(out_name, int(self.sample_rate), rx_voice)
+
+        return list(self.rec_chans)
@@ -0,0 +1,447 @@
+#!/usr/bin/env python
+"""
+Fixed delay estimation with cached reference clip spectra.
+
+This implements the fixed delay ('f') mode of `mcvqoe.delay.ITS_delay_est`
+with the parts of the computation that only depend on the transmit clip done
+once, when the clip is loaded, instead of for every trial.
+"""
+
+import warnings
+
+from fractions import Fraction
+
+import numpy as np
+import scipy.fft
+import scipy.signal as sig
+
+from mcvqoe.delay.ITS_delay import (
+    active_speech_level,
+    find_fir_coeffs,
+    fxd_delay_comp,
+)
+
+# sample rate used internally by the ITS delay estimation algorithm
+_est_fs = 8000
+
+# subsampling factor for the coarse envelope correlation
+_env_sub = 64
+
+# minimum number of overlapping samples needed for fine delay estimation
+_min_overlap = 1185
+
+# half width of the fine delay search
+_fine_ran = 128
+# extra lags, before and after the fine search, used for smoothing
+_fine_head = 500
+_fine_tail = 200
+
+
+class delay_estimator():
+    """
+    Delay estimator for a single transmit clip.
+
+    Everything in `mcvqoe.delay.ITS_delay_est` that depends only on the
+    transmit clip (resampling, level normalization, speech envelope and the
+    envelope spectrum) is computed once, when the estimator is created. Each
+    call to `estimate` then only needs to process the received audio and do
+    one cross correlation for the coarse delay.
+
+    Parameters
+    ----------
+    x_speech : numpy array
+        Transmit clip that will be used for all delay estimates.
+    fs : int, default=8000
+        Sample rate of `x_speech` and of the audio passed to `estimate`.
+    dlyBounds : array, default=[-Inf, Inf]
+        The interval of acceptable delays in seconds.
+    min_corr : float, default=0
+        Minimum correlation threshold. If the coarse delay correlation is
+        lower than min_corr, the delay estimate is determined to be
+        unsuccessful.
+    windowed : bool, default=False
+        Use the windowed search. The coarse search is limited to `window`
+        seconds around the prior delay passed to `estimate`. Only the part of
+        the received envelope that overlaps the clip, for shifts in the
+        window, is computed and correlated so the cost of the coarse search
+        depends on the window and clip length rather than the length of the
+        received audio.
+    window : float, default=0.1
+        Half width, in seconds, of the coarse search around the prior delay.
+    window_corr : float, default=0.5
+        If the coarse correlation in the window is below this, or the peak is
+        on the edge of the window, the full range is searched instead.
+    poly_resample : bool, default=False
+        Resample audio with a polyphase filter instead of the FFT resampling
+        used by `mcvqoe.delay.ITS_delay_est`. This is much faster for long
+        recordings but results can differ slightly from ITS_delay_est.
+
+    Attributes
+    ----------
+    x : numpy array or None
+        Level normalized transmit clip at 8 kHz. None if the clip contained no
+        signal.
+    fallbacks : int
+        Number of windowed searches that fell back to the full range.
+
+    See Also
+    --------
+    mcvqoe.delay.ITS_delay_est : Estimator that this is equivalent to.
+
+    Examples
+    --------
+    >>> est = delay_estimator(tx_clip, fs=48000)
+    >>> pos, dly = est.estimate(rx_audio)
+
+    Use the windowed search, around the last delay found.
+
+    >>> est = delay_estimator(tx_clip, fs=48000, windowed=True)
+    >>> pos, dly = est.estimate(rx_audio, prior=dly)
+    """
+
+    def __init__(self, x_speech, fs=8000, dlyBounds=[-np.inf, np.inf], min_corr=0,
+                 windowed=False, window=0.1, window_corr=0.5, poly_resample=False):
+
+        x_speech = np.array(x_speech, dtype=np.float64)
+        if len(x_speech) == 0:
+            raise ValueError("x_speech can not have zero length")
+        if x_speech.ndim != 1:
+            raise ValueError(f"Expected 1 dimension for x_speech but {x_speech.ndim} found")
+
+        dlyBounds = np.array(dlyBounds, dtype=np.float64)
+        if len(dlyBounds) != 2:
+            raise ValueError(f"Expected dlyBounds len to be 2 but got {len(dlyBounds)}")
+        elif dlyBounds[1] <= dlyBounds[0]:
+            raise ValueError(f"dlyBounds must be increasing. got {dlyBounds}")
+
+        self.fs = fs
+        self.dlyBounds = dlyBounds
+        self.min_corr = min_corr
+        self.windowed = windowed
+        self.window = window
+        self.window_corr = window_corr
+        self.poly_resample = poly_resample
+        self.fallbacks = 0
+
+        # cached envelope spectra, keyed by correlation length
+        self._spec = {}
+
+        # filter coefficients for the 63 Hz envelope LPF
+        self._fir_coeff = find_fir_coeffs(400, 1 / 133.33)
+
+        # ----------------------[Resample clip to 8kHz]-----------------------
+
+        x_speech = self._resample(x_speech)
+
+        # -------------------------[Level Normalization]-----------------------
+
+        try:
+            asl_x = active_speech_level(x_speech)
+        except ValueError:
+            # no signal, every estimate will fail
+            self.x = None
+            self._ex = None
+            return
+
+        self.x = x_speech * 10 ** ((asl_x + 26) / -20)
+
+        # ---------------------------[Speech envelope]-------------------------
+
+        self._ex = self._envelope(self.x)
+
+        # mean and sum of squared deviations for windowed correlations
+        self._ex_mean = np.mean(self._ex)
+        self._ex_ss = np.sum((self._ex - self._ex_mean) ** 2)
+
+    def _resample(self, dat):
+        """Resample `dat` from self.fs to the estimator rate."""
+        if self.fs != _est_fs:
+            if self.poly_resample:
+                rs = Fraction(_est_fs, int(self.fs))
+                dat = sig.resample_poly(dat, rs.numerator, rs.denominator)
+            else:
+                dat = sig.resample(dat, int(len(dat) * _est_fs / self.fs))
+        return dat
+
+    def _envelope(self, dat):
+        """Compute the subsampled speech envelope of `dat`."""
+        return sig.lfilter(self._fir_coeff, 1, np.abs(dat))[0::_env_sub]
+
+    def _envelope_slice(self, dat, start, stop):
+        """
+        Compute samples start to stop of the envelope of `dat`.
+
+        This gives the same values as `_envelope(dat)[start:stop]` but the
+        filter output is only computed at the subsampled points, from the
+        samples of dat that they depend on. Samples outside of dat are zero.
+        """
+        env = np.zeros(stop - start)
+
+        # envelope samples that overlap dat
+        first = max(start, 0)
+        last = min(stop, (len(dat) - 1) // _env_sub + 1)
+        if last <= first:
+            return env
+
+        flen = len(self._fir_coeff)
+        # rectified samples, with zeros for the filter history before dat
+        a = _env_sub * first - (flen - 1)
+        seg = np.abs(dat[max(a, 0):_env_sub * (last - 1) + 1])
+        if a < 0:
+            seg = np.concatenate((np.zeros(-a), seg))
+
+        # filter output at every _env_sub-th sample
+        frames = np.lib.stride_tricks.sliding_window_view(seg, flen)[::_env_sub]
+        env[first - start:last - start] = frames @ self._fir_coeff[::-1]
+
+        return env
+
+    def _clip_spectrum(self, corrlen):
+        """
+        Get the envelope spectrum of the clip for a given correlation length.
+
+        Received audio is normally the same length for every trial so the
+        spectrum is only computed the first time each length is seen.
+
+        Parameters
+        ----------
+        corrlen : int
+            Length of the zero padded envelopes.
+
+        Returns
+        -------
+        spec : numpy array
+            Spectrum of the mean removed, zero padded envelope.
+        m : float
+            Mean of the zero padded envelope.
+        std : float
+            Standard deviation of the mean removed, zero padded envelope.
+        """
+        try:
+            return self._spec[corrlen]
+        except KeyError:
+            pass
+
+        ex = np.append(self._ex, np.zeros(corrlen - len(self._ex)))
+        m = np.mean(ex)
+        ex = ex - m
+
+        spec = np.fft.rfft(ex, 2 * corrlen)
+
+        self._spec[corrlen] = (spec, m, np.std(ex, ddof=1))
+
+        return self._spec[corrlen]
+
+    def _coarse_dly(self, y):
+        """
+        Coarse average delay estimate using the cached clip envelope.
+
+        This matches `coarse_avg_dly_est` in `mcvqoe.delay.ITS_delay`.
+        """
+        ey = self._envelope(y)
+
+        corrlen = max(len(self._ex), len(ey))
+        ey = np.append(ey, np.zeros(corrlen - len(ey)))
+
+        spec_x, m, std_x = self._clip_spectrum(corrlen)
+
+        # Remove mean of ex from ey
+        ey = ey - m
+
+        # FFT based cross correlation
+        xc = np.fft.irfft(spec_x * np.fft.rfft(ey[::-1], 2 * corrlen), 2 * corrlen)
+
+        # calculate shifts in samples
+        shift = _env_sub * (corrlen - np.arange(1, len(xc) + 1))
+        # calculate which shifts are valid
+        valid = np.logical_and(
+                shift > (self.dlyBounds[0] * _est_fs),
+                shift < (self.dlyBounds[1] * _est_fs),
+            )
+        valid_shifts = shift[valid]
+
+        check = xc[valid]
+        index = np.argmax(check)
+        # Convert peak location to a shift
+        tau_0 = valid_shifts[index]
+        # Normalize to get cross correlation value
+        rho_0 = check[index] / ((corrlen - 1) * std_x * np.std(ey, ddof=1))
+
+        return tau_0, rho_0
+
+    def _coarse_dly_windowed(self, y, lo, hi):
+        """
+        Coarse delay estimate for shifts between lo and hi.
+
+        Only the envelope samples of y that overlap the clip, for shifts in
+        the window, are computed and only those shifts are correlated. The
+        correlation at each shift is normalized over the overlap, so the peak
+        is found the same way no matter how much of y is outside the window.
+
+        Parameters
+        ----------
+        y : numpy array
+            Level normalized received speech at the estimator rate.
+        lo : float
+            Smallest shift, in samples at the estimator rate, to search.
+        hi : float
+            Largest shift, in samples at the estimator rate, to search.
+
+        Returns
+        -------
+        tau_0 : int
+            Shift with the largest correlation.
+        rho_0 : float
+            Correlation at tau_0.
+        edge : bool
+            True if tau_0 is on the edge of the window or there are no valid
+            shifts in the window.
+        """
+        # envelope lags in the window, shifts must be in dlyBounds
+        lags = np.arange(int(np.ceil(lo / _env_sub)), int(np.floor(hi / _env_sub)) + 1)
+        shift = _env_sub * lags
+        lags = lags[np.logical_and(
+                shift > (self.dlyBounds[0] * _est_fs),
+                shift < (self.dlyBounds[1] * _est_fs),
+            )]
+
+        if len(lags) == 0:
+            # window is out of bounds
+            return 0, 0, True
+
+        n = len(self._ex)
+        ey = self._envelope_slice(y, lags[0], lags[-1] + n)
+
+        # sums of ey over the overlap for each lag
+        cs = np.concatenate(([0], np.cumsum(ey)))
+        cs2 = np.concatenate(([0], np.cumsum(ey ** 2)))
+        s1 = cs[n:] - cs[:-n]
+        ss_y = (cs2[n:] - cs2[:-n]) - s1 ** 2 / n
+
+        # correlation coefficient at each lag
+        cov = sig.correlate(ey, self._ex, mode="valid") - self._ex_mean * s1
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rho = np.where(ss_y > 0, cov / np.sqrt(self._ex_ss * ss_y), 0)
+
+        index = np.argmax(rho)
+
+        return _env_sub * lags[index], rho[index], index in (0, len(lags) - 1)
+
+    def _fine_dly(self, x, y):
+        """
+        Fine delay estimate that only computes the correlation lags it uses.
+
+        This gives the same result as `fxd_fine_dly_est` in
+        `mcvqoe.delay.ITS_delay` but, the cross correlation is done with real
+        FFTs that are just long enough to cover the search range instead of
+        twice the length of the audio.
+        """
+        min_d = -(_fine_ran + _fine_head)
+        max_d = _fine_ran + _fine_tail
+
+        # Remove the mean of x from each rectified signal
+        x = np.abs(x)
+        y = np.abs(y)
+        m = np.mean(x)
+        x = x - m
+        y = y - m
+
+        corrlen = len(x)
+        nfft = scipy.fft.next_fast_len(corrlen + max(-min_d, max_d), real=True)
+
+        # circular correlation, long enough that requested lags don't wrap
+        xc = scipy.fft.irfft(np.conj(scipy.fft.rfft(x, nfft)) * scipy.fft.rfft(y, nfft), nfft)
+        xc = np.concatenate((xc[min_d:], xc[:max_d + 1]))
+
+        denom = (corrlen - 1) * np.std(x, ddof=1) * np.std(y, ddof=1)
+
+        # extract relevant portion
+        txc = xc[_fine_head:_fine_head + 1 + 2 * _fine_ran]
+        index = np.argmax(txc)
+        maxrho = txc[index] / denom
+
+        if 0.73 < maxrho:
+            # For high correlations, no smoothing is required
+            return index - _fine_ran
+
+        if 0.67 < maxrho:
+            # For medium correlations, some smoothing helps
+            m = 64
+        else:
+            # For lower correlations, more smoothing helps
+            m = 128
+        flen = 3 * m
+        sxc = sig.lfilter(find_fir_coeffs(flen, 1 / m), 1, xc)
+        # smoothed cross-correlation with filter delay removed
+        start = int(_fine_head + flen / 2)
+        sxc = sxc[start:start + 1 + 2 * _fine_ran]
+
+        return np.argmax(sxc) - _fine_ran
+
+    def estimate(self, y_speech, prior=None):
+        """
+        Estimate the fixed delay of `y_speech` relative to the clip.
+
+        Parameters
+        ----------
+        y_speech : numpy array
+            Received speech samples, at the same sample rate as the clip.
+        prior : int, optional
+            Expected delay, in samples, usually from previous trials. Only used
+            for windowed searches. If not given, the full range is searched.
+
+        Returns
+        -------
+        pos : int
+            End of the delay estimate segment in samples.
+        dly : int
+            Delay estimate in samples. Zero if no estimate could be made.
+        """
+
+        y_speech = np.array(y_speech, dtype=np.float64)
+        if len(y_speech) == 0:
+            raise ValueError("y_speech can not have zero length")
+        if y_speech.ndim != 1:
+            raise ValueError(f"Expected 1 dimension for y_speech but {y_speech.ndim} found")
+
+        # --------------------------[Resample to 8kHz]-------------------------
+
+        y_speech = self._resample(y_speech)
+
+        # -------------------------[Level Normalization]-----------------------
+
+        try:
+            if self.x is None:
+                raise ValueError("Input vector has no signal")
+            asl_y = active_speech_level(y_speech)
+        except ValueError:
+            warnings.warn("Input vector has no signal")
+            return (0, 0)
+
+        y_speech = y_speech * 10 ** ((asl_y + 26) / -20)
+
+        # -------------------[Coarse Average Delay Estimation]-----------------
+
+        if self.windowed and prior is not None:
+            center = prior * (_est_fs / self.fs)
+            half = self.window * _est_fs
+            tau_0, rho_0, edge = self._coarse_dly_windowed(y_speech, center - half, center + half)
+
+            if edge or rho_0 < self.window_corr:
+                # not confident in windowed result, search everything
+                self.fallbacks += 1
+                tau_0, rho_0 = self._coarse_dly(y_speech)
+        else:
+            tau_0, rho_0 = self._coarse_dly(y_speech)
+
+        comp_x_speech, comp_y_speech = fxd_delay_comp(self.x, y_speech, tau_0)
+
+        # Not enough overlap or correlation for an estimate
+        if len(comp_x_speech) < _min_overlap or rho_0 < self.min_corr:
+            return (0, 0)
+
+        # ------------------------[Fine Delay Estimation]----------------------
+
+        D_fxd = tau_0 + self._fine_dly(comp_x_speech, comp_y_speech)
+
+        return (int((len(y_speech) - 1) * (self.fs / _est_fs)), int(D_fxd * (self.fs / _est_fs)))
@@ -6,17 +6,844 @@ Created on Mon Aug  16 01:46:20 2021
 @author: wrm3
 """
 import argparse
+import hashlib
+import io
 import json
 import os
+import tempfile
 import warnings
 
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import scipy.signal
+
+
+def has_autocorrelation(x):
+    """
+    Check if there is likely autocorrelation at lags other than zero.
+
+    This gives the same result as checking if
+    `mcvqoe.math.improved_autocorrelation` returns more than one lag, but
+    the sample autocorrelation is computed with an FFT and the uncertainty
+    bounds with a cumulative sum.
+
+    Parameters
+    ----------
+    x : numpy array
+        Numerical data on which to detect autocorrelation.
+
+    Returns
+    -------
+    bool
+        True if autocorrelation was detected at a nonzero lag.
+
+    See Also
+    --------
+    mcvqoe.math.improved_autocorrelation : Reference implementation.
+    """
+    x = np.asarray(x, dtype=float)
+    N = len(x)
+    # Zhang NF (2006) recommends using a maximum lag of N/4
+    lag_max = int(np.floor(N/4))
+
+    if lag_max == 0:
+        return False
+
+    # Sample autocorrelation estimate via FFT, padded to avoid wrap around
+    xm = x - np.mean(x)
+    nfft = 2**int(np.ceil(np.log2(2*N)))
+    spec = np.fft.rfft(xm, nfft)
+    acov = np.fft.irfft(spec * np.conj(spec), nfft)[:lag_max]
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        corrs = acov/np.sum(xm**2)
+
+    # Respective uncertainties, sigmas[k] uses the sum of corrs[1:k]**2
+    summer = np.concatenate(([0, 0], np.cumsum(corrs[1:]**2)))[:lag_max]
+    sigmas = np.sqrt((1 + 2*summer)/N)
+
+    # Lag 0 always present, lagged if there are more than that
+    return np.count_nonzero(np.abs(corrs) > 1.96 * sigmas) > 1
+
+
+def chunked_mean(x, chunk):
+    """
+    Mean of a, possibly memory mapped, array read in chunks.
+
+    Arrays no longer than chunk are copied and averaged with `np.mean` so the
+    result is the same as for an in memory array.
+    """
+    N = len(x)
+    if N <= chunk:
+        return np.mean(np.array(x, dtype=float))
+    return sum(np.sum(x[a:a + chunk], dtype=float) for a in range(0, N, chunk))/N
+
+
+def has_autocorrelation_chunked(x, chunk=2**20):
+    """
+    Check for autocorrelation, like `has_autocorrelation`, with bounded memory.
+
+    Data longer than chunk is read in chunks and the sample autocorrelation
+    is computed one block of lags at a time, from FFT cross-correlations of
+    chunks, stopping at the first block with a significant lag. Memory use is
+    proportional to chunk rather than the length of x.
+
+    Parameters
+    ----------
+    x : array-like
+        Numerical data, such as a view of a memory mapped array.
+    chunk : int, default=2**20
+        Number of samples, and lags, to work with at once. Shorter data is
+        checked with `has_autocorrelation`.
+
+    Returns
+    -------
+    bool
+        True if autocorrelation was detected at a nonzero lag.
+    """
+    N = len(x)
+    if N <= chunk:
+        return has_autocorrelation(np.array(x, dtype=float))
+
+    lag_max = N//4
+    m = chunked_mean(x, chunk)
+
+    def centered(a, b):
+        return np.asarray(x[a:min(b, N)], dtype=float) - m
+
+    denom = sum(np.sum(centered(a, a + chunk)**2) for a in range(0, N, chunk))
+
+    # sum of corrs[1:k]**2 for lags before this block
+    summer = 0
+    for l0 in range(0, lag_max, chunk):
+        L = min(chunk, lag_max - l0)
+
+        acov = np.zeros(L)
+        for a in range(0, N - l0, chunk):
+            u = centered(a, a + chunk)
+            v = centered(a + l0, a + l0 + len(u) + L - 1)
+            # zero pad past the end of the data
+            v = np.pad(v, (0, len(u) + L - 1 - len(v)))
+            acov += scipy.signal.correlate(v, u, mode='valid', method='fft')
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            corrs = acov/denom
+
+        sq = corrs**2
+        if l0 == 0:
+            # lag 0 is not part of the sum
+            sq[0] = 0
+        prev = summer + np.concatenate(([0], np.cumsum(sq[:-1])))
+        sigmas = np.sqrt((1 + 2*prev)/N)
+
+        lagged = np.abs(corrs) > 1.96 * sigmas
+        if l0 == 0:
+            # Lag 0 always present
+            lagged[0] = False
+        if np.any(lagged):
+            return True
+
+        summer += np.sum(sq)
+
+    return False
+
+
+def common_thinning_factor(*datasets, chunk=None):
+    """
+    Find the smallest thinning factor that removes autocorrelation.
+
+    Parameters
+    ----------
+    *datasets : numpy arrays
+        Data for each session.
+    chunk : int, optional
+        If given, autocorrelation is checked with
+        `has_autocorrelation_chunked` using chunks of this size so that data,
+        such as memory mapped arrays, is not copied all at once.
+
+    Returns
+    -------
+    int or float
+        Smallest thinning factor that removes autocorrelation from all
+        datasets. NaN if none was found.
+    list
+        Smallest thinning factor that removes autocorrelation from each
+        dataset. NaN if none was found.
+    """
+    # smallest thinning factor for each session
+    sesh_thinning = [np.nan]*len(datasets)
+
+    # get common thinning factor
+    thinning_factor = 1
+    # TODO: Make this more robust for data sets of different sizes rather than
+    # Limiting to smallest data set
+    max_lag = np.min([np.floor(len(dat)/4) for dat in datasets])
+    is_lag = True
+
+    while is_lag and thinning_factor <= max_lag:
+        # Initialize list of lags for each data set
+        lags = []
+
+        for k, dat in enumerate(datasets):
+            # Thin data and check for autocorrelation
+            if chunk is None:
+                lagged = has_autocorrelation(dat[::thinning_factor])
+            else:
+                lagged = has_autocorrelation_chunked(dat[::thinning_factor], chunk)
+            lags.append(lagged)
+
+            if not lagged and np.isnan(sesh_thinning[k]):
+                sesh_thinning[k] = thinning_factor
+        if not any(lags):
+            is_lag = False
+        else:
+            thinning_factor += 1
+    if is_lag:
+        thinning_factor = np.nan
+    return thinning_factor, sesh_thinning
+
+
+# datasets used by bootstrap worker processes
+_boot_datasets = None
+
+
+def _init_boot_worker(datasets):
+    """Store bootstrap datasets in a worker process."""
+    global _boot_datasets
+    _boot_datasets = datasets
+
+
+def _resample_sums(rng, dataset, size, N, block):
+    """
+    Sum the values of `size` resamples, of N values each, from dataset.
+
+    Indices are drawn rather than values and at most `block` indices are
+    drawn at once. Random values are used in the same order no matter what
+    block is, so the sums only depend on the state of rng, up to rounding.
+    """
+    sums = np.zeros(size)
+    if N <= block:
+        # whole resamples at once
+        rows = block // max(N, 1)
+        for start in range(0, size, rows):
+            idx = rng.integers(0, len(dataset), size=(min(rows, size - start), N))
+            sums[start:start + len(idx)] = np.sum(dataset[idx], axis=1)
+    else:
+        # one resample at a time, in blocks of indices
+        for r in range(size):
+            for start in range(0, N, block):
+                idx = rng.integers(0, len(dataset), size=min(block, N - start))
+                sums[r] += np.sum(dataset[idx])
+    return sums
+
+
+def _boot_chunk(args, datasets=None):
+    """
+    Compute resampled means of the averaged datasets for one chunk.
+
+    If datasets is not given, the datasets stored in a worker process by
+    `_init_boot_worker` are used.
+    """
+    N, size, seed_seq, block = args
+    if datasets is None:
+        datasets = _boot_datasets
+    rng = np.random.default_rng(seed_seq)
+
+    x_bar = np.zeros(size)
+    for dataset in datasets:
+        # take the mean of each resample
+        x_bar += _resample_sums(rng, dataset, size, N, block)/N
+
+    # Means across sessions
+    return x_bar/len(datasets)
 
 
-import mcvqoe.math
+def bootstrap_datasets_ci(*datasets, R=int(1e4), alpha=0.5, seed=None, jobs=1, max_elements=2**22,
+                          block_size=None):
+    """
+    Bootstrap for averaging means from different datasets.
+
+    This computes the same interval as `mcvqoe.math.bootstrap_datasets_ci`
+    but resamples are drawn as matrices of indices in chunks, so memory use is
+    bounded by `block_size` rather than growing with `R` or the size of the
+    datasets. Each chunk gets its own random generator, spawned from `seed`,
+    so the interval only depends on `seed` and not on the number of processes
+    used. Changing `block_size` only changes the interval by rounding.
+
+    Parameters
+    ----------
+    *datasets : numpy arrays
+        Datasets from which to take sample means. In context, the datasets
+        are the different M2E sessions within a test.
+    R : int, optional
+        Number of resamples. The default is int(1e4).
+    alpha : float, optional
+        Alpha level of the test. The default is 0.5.
+    seed : int or None, optional
+        Seed for the random generator. If None, a fresh seed is used and the
+        result is not reproducible. The default is None.
+    jobs : int, optional
+        Number of processes to split chunks across. The default is 1.
+    max_elements : int, optional
+        Number of indices, for each dataset, in each chunk of resamples. This
+        sets how the work is split and so, the random values used. The
+        default is 2**22.
+    block_size : int, optional
+        Maximum number of indices to draw at once. Only changes the result
+        by rounding. The default is max_elements.
+
+    Returns
+    -------
+    ci : numpy array
+        Two element array containing the upper and lower confidence bound on
+        the mean.
+
+    See Also
+    --------
+    mcvqoe.math.bootstrap_datasets_ci : Reference implementation.
+
+    """
+    datasets = tuple(np.asarray(d, dtype=float) for d in datasets)
+    R = int(R)
+    if block_size is None:
+        block_size = max_elements
+
+    # TODO: No need to limit this to first dataset
+    N = len(datasets[0])
+
+    # resamples per chunk, independent of jobs so results are too
+    chunk = max(1, min(R, max_elements // max(N, 1)))
+    sizes = [min(chunk, R - start) for start in range(0, R, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    chunk_args = [(N, size, ss, block_size) for size, ss in zip(sizes, seeds)]
+
+    if jobs > 1 and len(chunk_args) > 1:
+        with ProcessPoolExecutor(
+                max_workers=jobs,
+                initializer=_init_boot_worker,
+                initargs=(datasets,),
+                ) as executor:
+            x_bar_dist = list(executor.map(_boot_chunk, chunk_args))
+    else:
+        x_bar_dist = [_boot_chunk(a, datasets) for a in chunk_args]
+
+    x_bar_dist = np.concatenate(x_bar_dist)
+
+    # percentiles
+    ql = alpha/2
+    qu = 1 - ql
+    ci = np.quantile(x_bar_dist, [ql, qu])
+    return ci
+
+
+# columns stored as categoricals in session sidecars
+_categorical_cols = ('Filename', 'channels')
+
+
+def encode_columns(df):
+    """
+    Convert a DataFrame to arrays that can be stored in an npz file.
+
+    Numeric and datetime columns are stored as typed arrays, string columns
+    are stored as category codes and categories.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Data to encode.
+
+    Returns
+    -------
+    dict
+        Arrays, keyed by name.
+    """
+    arrays = {'__columns__': np.array(df.columns, dtype=str)}
+    for col in df.columns:
+        dat = df[col]
+        if isinstance(dat.dtype, pd.CategoricalDtype) or dat.dtype == object:
+            cat = pd.Categorical(dat)
+            arrays[col + '.codes'] = cat.codes
+            arrays[col + '.categories'] = np.array(cat.categories, dtype=str)
+        else:
+            arrays[col] = dat.to_numpy()
+    return arrays
+
+
+def decode_columns(dat):
+    """
+    Convert arrays from `encode_columns` back to a DataFrame.
+
+    Parameters
+    ----------
+    dat : dict or NpzFile
+        Arrays, keyed by name.
+
+    Returns
+    -------
+    pd.DataFrame
+        Decoded data.
+    """
+    cols = {}
+    for col in dat['__columns__']:
+        if col in dat:
+            cols[col] = dat[col]
+        else:
+            cols[col] = pd.Categorical.from_codes(
+                dat[col + '.codes'],
+                categories=dat[col + '.categories'],
+                )
+    return pd.DataFrame(cols)
+
+
+def sidecar_name(path):
+    """Get the name of the columnar sidecar file for a session csv."""
+    return os.path.splitext(path)[0] + '.npz'
+
+
+def source_stamp(path):
+    """
+    Get the size and modification time, in nanoseconds, of a file.
+
+    This is stored in sidecar files to check that they match their csv.
+
+    Parameters
+    ----------
+    path : str
+        File name.
+
+    Returns
+    -------
+    numpy array
+        Size, in bytes, and modification time, in nanoseconds.
+    """
+    st = os.stat(path)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def write_sidecar(df, path, stamp=None):
+    """
+    Write session data to a columnar sidecar file.
+
+    Columns are stored as described in `encode_columns`.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Session data, as returned by `read_session`.
+    path : str
+        Sidecar file name.
+    stamp : numpy array, optional
+        `source_stamp` of the csv that df was read from. Stored so
+        `read_sidecar` can check that the sidecar is current.
+    """
+    arrays = encode_columns(df)
+    if stamp is not None:
+        arrays['__source__'] = stamp
+
+    # write to temp file and rename so partial files are never read
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def read_sidecar(path, stamp=None):
+    """
+    Read session data from a columnar sidecar file.
+
+    Parameters
+    ----------
+    path : str
+        Sidecar file name.
+    stamp : numpy array, optional
+        `source_stamp` of the csv. If given, the sidecar is only read if it
+        was written from a csv with the same size and modification time.
+
+    Returns
+    -------
+    pd.DataFrame or None
+        Session data, or None if the sidecar does not match stamp.
+    """
+    with np.load(path, allow_pickle=False) as dat:
+        if stamp is not None:
+            if '__source__' not in dat or not np.array_equal(dat['__source__'], stamp):
+                return None
+        return decode_columns(dat)
+
+
+def index_data(df):
+    """
+    Index evaluation data by session name, talker and trial.
+
+    The name and Filename columns are made categorical and the index is set
+    to (name, Filename, trial), where trial is the position of the row in its
+    session. Rows are kept in trial order and the columns are kept so the
+    data can be used as before.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Data for all sessions, with name and Filename columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed data.
+    """
+    df = df.reset_index(drop=True)
+    for col in ('name', 'Filename'):
+        df[col] = df[col].astype('category')
+
+    trial = df.groupby('name', sort=False, observed=True).cumcount()
+    df.index = pd.MultiIndex.from_arrays(
+        [df['name'], df['Filename'], trial],
+        names=['name', 'Filename', 'trial'],
+        )
+    return df
+
+
+def append_indexed(df, new):
+    """
+    Append data for new sessions to indexed data.
+
+    This gives the same data as calling `index_data` on all of the data but
+    only the new rows are indexed. Categories of the name and Filename columns
+    are combined so they stay categorical.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Data indexed with `index_data`.
+    new : pd.DataFrame
+        Data for the new sessions, with name and Filename columns.
+
+    Returns
+    -------
+    pd.DataFrame
+        Indexed data with the new rows at the end.
+    """
+    new = index_data(new)
+    trial = np.concatenate((
+        df.index.get_level_values('trial'),
+        new.index.get_level_values('trial'),
+        ))
+
+    parts = [df.reset_index(drop=True), new.reset_index(drop=True)]
+    for col in ('name', 'Filename'):
+        cats = df[col].cat.categories.union(new[col].cat.categories)
+        for part in parts:
+            part[col] = part[col].cat.set_categories(cats)
+
+    df = pd.concat(parts, ignore_index=True)
+    df.index = pd.MultiIndex.from_arrays(
+        [df['name'], df['Filename'], trial],
+        names=['name', 'Filename', 'trial'],
+        )
+    return df
+
+
+def level_mask(index, level, values):
+    """
+    Find rows with any of the given values in a level of a MultiIndex.
+
+    Values are looked up in the level once and rows are selected by their
+    level codes, so row labels are never compared.
+
+    Parameters
+    ----------
+    index : pd.MultiIndex
+        Index to search.
+    level : str
+        Name of the level.
+    values : list
+        Values to look for.
+
+    Returns
+    -------
+    numpy array
+        Boolean mask of matching rows.
+    """
+    n = index.names.index(level)
+    found = index.levels[n].get_indexer(values)
+
+    # lookup table of matching codes, -1 is for missing values
+    lut = np.zeros(len(index.levels[n]) + 1, dtype=bool)
+    lut[found[found >= 0]] = True
+    return lut[index.codes[n]]
+
+
+# default number of points above which plots aggregate data
+plot_max_points = 20000
+
+# largest number of bins for aggregated histograms
+_max_hist_bins = 200
+
+
+def minmax_decimate(y, buckets):
+    """
+    Reduce a series to the smallest and largest values in each bucket.
+
+    The series is split into buckets of consecutive points and the positions
+    of the minimum and maximum in each bucket are kept so that peaks are
+    still visible after decimation.
+
+    Parameters
+    ----------
+    y : numpy array
+        Series to decimate.
+    buckets : int
+        Number of buckets. At most two points are kept from each.
+
+    Returns
+    -------
+    numpy array
+        Sorted positions of the points to keep.
+    """
+    n = len(y)
+    if n <= 2 * buckets:
+        return np.arange(n)
+
+    bucket = np.arange(n) * buckets // n
+    # sort by value within each bucket
+    order = np.lexsort((y, bucket))
+    ends = np.searchsorted(bucket[order], np.arange(1, buckets + 1))
+    starts = np.concatenate(([0], ends[:-1]))
+
+    return np.unique(np.concatenate((order[starts], order[ends - 1])))
+
+
+def read_session(path, use_sidecar=False):
+    """
+    Read data for an M2E session.
+
+    If `use_sidecar` is True, data is read from a columnar sidecar next to the
+    session csv. The sidecar is created, or regenerated, from the csv if it
+    does not exist or if the size or modification time, in nanoseconds, of
+    the csv does not match the one stored in the sidecar.
+
+    Parameters
+    ----------
+    path : str
+        Session csv file name.
+    use_sidecar : bool, default=False
+        Whether to use, and create, the columnar sidecar file.
+
+    Returns
+    -------
+    pd.DataFrame
+        Session data with Timestamp as datetime and string columns as
+        categoricals.
+    """
+    side_path = sidecar_name(path)
+
+    if use_sidecar:
+        # stamp before reading, so a csv that changes while it is read does
+        # not match the sidecar written from it
+        stamp = source_stamp(path)
+        try:
+            df = read_sidecar(side_path, stamp=stamp)
+            if df is not None:
+                return df
+        except (OSError, ValueError, KeyError):
+            # missing or unreadable sidecar, read csv
+            pass
+
+    df = pd.read_csv(path, dtype={col: 'category' for col in _categorical_cols})
+    # Force timestamp to be datetime
+    df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+
+    if use_sidecar:
+        try:
+            write_sidecar(df, side_path, stamp=stamp)
+        except OSError as e:
+            # read only location, just use csv
+            warnings.warn(f'Unable to write sidecar for \'{path}\' : {e}')
+
+    return df
+
+
+def _thinning_value(x):
+    """Convert a stored thinning factor back to an int, or NaN."""
+    x = float(x)
+    return np.nan if np.isnan(x) else int(x)
+
+
+def session_hash(latency):
+    """
+    Get a key for per-session statistics.
+
+    The key is a hash of the latency data, so it changes when the data does
+    but not when a session file is renamed or copied.
+
+    Parameters
+    ----------
+    latency : numpy array
+        Latencies for the session.
+
+    Returns
+    -------
+    str
+        Hex digest of the data.
+    """
+    return hashlib.sha1(np.ascontiguousarray(latency, dtype=float).tobytes()).hexdigest()
+
+
+def bootstrap_means(dataset, N, R, seed_seq, max_elements=2**22):
+    """
+    Draw bootstrap resample means from one dataset.
+
+    Parameters
+    ----------
+    dataset : numpy array
+        Data to resample.
+    N : int
+        Size of each resample.
+    R : int
+        Number of resamples.
+    seed_seq : np.random.SeedSequence
+        Seed for the random generator.
+    max_elements : int, default=2**22
+        Maximum number of indices to draw at once.
+
+    Returns
+    -------
+    numpy array
+        Mean of each resample.
+    """
+    rng = np.random.default_rng(seed_seq)
+    return _resample_sums(rng, dataset, R, N, max_elements)/N
+
+
+class session_cache():
+    """
+    Cache of per-session evaluation statistics.
+
+    Entries are dicts of arrays keyed by `session_hash`. Entries are kept in
+    memory and, if path is given, stored as .npz files so they can be used by
+    later evaluations.
+
+    Parameters
+    ----------
+    path : str, optional
+        Directory to store entries in. Created if it does not exist. If None,
+        entries are only kept in memory.
+
+    Examples
+    --------
+    >>> cache = session_cache(path)
+    >>> eval_obj = evaluate(names, cache=cache, seed=0)
+    >>> eval_obj.add_sessions(new_names)
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._entries = {}
+
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+    def _name(self, key):
+        return os.path.join(self.path, key + '.npz')
+
+    def get(self, key):
+        """
+        Get the statistics for a session.
+
+        Parameters
+        ----------
+        key : str
+            Session key from `session_hash`.
+
+        Returns
+        -------
+        dict
+            Cached arrays, empty if the session has not been seen.
+        """
+        if key not in self._entries:
+            entry = {}
+            if self.path:
+                try:
+                    with np.load(self._name(key), allow_pickle=False) as dat:
+                        entry = {k: dat[k] for k in dat.files}
+                except (OSError, ValueError):
+                    # missing or unreadable, start over
+                    pass
+            self._entries[key] = entry
+        return self._entries[key]
+
+    def update(self, key, persist=True, drop=(), **arrays):
+        """
+        Add statistics for a session.
+
+        Parameters
+        ----------
+        key : str
+            Session key from `session_hash`.
+        persist : bool, default=True
+            If False, arrays are only kept in memory.
+        drop : iterable of str, optional
+            Names of arrays to remove from the entry.
+        **arrays
+            Arrays to store.
+        """
+        entry = self.get(key)
+        for name in drop:
+            entry.pop(name, None)
+        entry.update(arrays)
+
+        if self.path and persist:
+            # only write entries that should persist
+            stored = {k: v for k, v in entry.items() if not k.startswith('_')}
+            tmp_path = f'{self._name(key)}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **stored)
+            os.replace(tmp_path, self._name(key))
+
+
+def session_paths(test_names, test_path=''):
+    """
+    Get session file paths and names.
+
+    Parameters
+    ----------
+    test_names : str or list of str
+        Session names or file names.
+    test_path : str, optional
+        Directory containing the sessions, used for names without a path or
+        extension.
+
+    Returns
+    -------
+    full_paths : list of str
+        Session csv files.
+    names : list of str
+        Session names.
+    """
+    # If only one test, make a list for iterating
+    if isinstance(test_names, str):
+        test_names = [test_names]
+
+    full_paths = []
+    names = []
+    for test_name in test_names:
+        # If no extension given use csv
+        dat_path, name = os.path.split(test_name)
+        fname, fext = os.path.splitext(test_name)
+
+        if not dat_path and not fext == '.csv':
+            # generate using test_path
+            # Looking in the top level directory now
+            dat_file = os.path.join(test_path, fname + '.csv')
+        else:
+            dat_file = test_name
+
+        full_paths.append(dat_file)
+        names.append(os.path.basename(fname))
+
+    return full_paths, names
 
 
 # Main class for evaluating
@@ -35,11 +862,39 @@ class evaluate():
     use_reprocess : bool
         Whether or not to use reprocessed data, if it exists.
 
+    json_data : str or dict, optional
+        Evaluation data from `to_json`. Used instead of reading sessions.
+
+    npz_data : str, bytes or file-like, optional
+        Evaluation data and results from `to_npz`. Used instead of reading
+        sessions. Thinning and results are restored rather than recomputed.
+
+    use_sidecar : bool, default=False
+        Whether to read session data from columnar sidecar files, creating
+        them, next to the session csv files, if needed. See `read_session`.
+
+    cache : session_cache or str, optional
+        Cache, or directory for a cache, of per-session statistics. If given,
+        evaluation is incremental: autocorrelation checks, thinned means and
+        bootstrap resample means of each session are cached so that sessions
+        added with `add_sessions`, or cached by an earlier evaluation, only
+        cost work for new data. Each session is resampled with its own
+        random stream, so the confidence interval differs, within bootstrap
+        error, from a non-incremental evaluation with the same seed. jobs is
+        not used for incremental evaluation.
+
     Attributes
     ----------
     full_paths : list of str
         Full file paths to the sessions.
 
+    data : pd.DataFrame
+        Data from all sessions, indexed by (name, Filename, trial). See
+        `index_data`.
+
+    thinned_data : pd.DataFrame
+        Data thinned by the common thinning factor.
+
     mean : float
         Average of all the means of the thinned session data part of the test.
 
@@ -49,11 +904,27 @@ class evaluate():
     common_thinning : int
         The largest thinning factor among the sessions.
 
+    resamples : int
+        Number of bootstrap resamples used for the confidence interval.
+
+    seed : int or None
+        Seed for the bootstrap. Results are reproducible if this is set.
+
+    jobs : int
+        Number of processes to use for the bootstrap.
+
+    session_thinning : dict
+        Smallest thinning factor that removes autocorrelation for each
+        session, NaN if none was found.
+
     Methods
     -------
     eval()
         Determine the mouth to ear latency of a test.
 
+    add_sessions()
+        Add sessions and update results.
+
     See Also
     --------
         mcvqoe.m2e.measure : Measurement class for generating M2E data.
@@ -64,49 +935,59 @@ class evaluate():
                  test_path='',
                  use_reprocess=False,
                  json_data=None,
+                 use_sidecar=False,
+                 npz_data=None,
+                 cache=None,
                  **kwargs):
-        
-        if json_data is None:
-            # If only one test, make a list for iterating
-            if isinstance(test_names, str):
-                test_names = [test_names]
-            
+
+        # stored results, if any
+        results = None
+
+        self.use_sidecar = use_sidecar
+
+        if isinstance(cache, str):
+            cache = session_cache(cache)
+        self.cache = cache
+        # session keys for the cache, by name
+        self._session_keys = {}
+
+        if npz_data is not None:
+            self.data, self.test_names, self.full_paths, results = evaluate.load_npz_data(npz_data)
+        elif json_data is None:
             # Initialize full paths attribute
-            self.full_paths = []
-            self.test_names = []
-            for test_name in test_names:
-                # If no extension given use csv
-                dat_path, name = os.path.split(test_name)
-                fname, fext = os.path.splitext(test_name)
-                
-                if not dat_path and not fext == '.csv':
-                    # generate using test_path
-                    # dat_path = os.path.join(test_path, 'csv')
-                    # Looking in the top level directory now
-                    dat_path = test_path
-                    dat_file = os.path.join(dat_path, fname + '.csv')
-                else:
-                    dat_file = test_name
-                
-                self.full_paths.append(dat_file)
-                self.test_names.append(os.path.basename(fname))
-    
+            self.full_paths, self.test_names = session_paths(test_names, test_path)
+
             # Initialize attributes
             data =[]
             for path, name in zip(self.full_paths, self.test_names):
-                df = pd.read_csv(path)
-                # Force timestamp to be datetime
-                df['Timestamp'] = pd.to_datetime(df['Timestamp'])
+                df = read_session(path, use_sidecar=use_sidecar)
                 df['name'] = name
                 data.append(df)
             self.data = pd.concat(data, ignore_index=True)
             
         else:
             self.data, self.test_names, self.full_paths = evaluate.load_json_data(json_data)
-        
-        self.common_thinning = self.find_thinning_factor()
+
+        # concat only keeps categoricals if categories match so, categorize
+        # after and index for fast lookups
+        self.data = index_data(self.data)
+
+        if results is None:
+            self.common_thinning = self.find_thinning_factor()
+        else:
+            self.common_thinning = results['common_thinning']
+            self.session_thinning = results['session_thinning']
         
         self.thinned_data = self.thin_data()
+
+        # Bootstrap settings
+        self.resamples = int(1e4)
+        self.seed = None
+        self.jobs = 1
+
+        if results is not None:
+            self.resamples = results['resamples']
+            self.seed = results['seed']
         
         # Check for kwargs
         for k, v in kwargs.items():
@@ -114,8 +995,12 @@ class evaluate():
                 setattr(self, k, v)
             else:
                 raise TypeError(f"{k} is not a valid keyword argument")
-        
-        self.mean, self.ci = self.eval()
+
+        if results is None:
+            self.mean, self.ci = self.eval()
+        else:
+            self.mean = results['mean']
+            self.ci = results['ci']
     
     def to_json(self, filename=None):
         """
@@ -136,7 +1021,7 @@ class evaluate():
             test_info[tname] = tpath
         
         out_json = {
-            'measurement': self.data.to_json(),
+            'measurement': self.data.reset_index(drop=True).to_json(),
             'test_info': test_info,
             # 'test_names': self.test_names,
             # 'test_paths': self.full_paths,
@@ -150,6 +1035,94 @@ class evaluate():
         
         return final_json
     
+    def to_npz(self, file=None, compress=True):
+        """
+        Save data and results in a compact binary format.
+
+        Data is stored column by column, with string columns as category
+        codes, in an npz file. Thinning and bootstrap results are stored too
+        so the object can be restored exactly with `evaluate(npz_data=...)`.
+
+        Parameters
+        ----------
+        file : str or file-like, optional
+            File to write to. If None, the data is returned as bytes.
+        compress : bool, default=True
+            Whether to compress the data.
+
+        Returns
+        -------
+        bytes or None
+            Encoded data, if file is None.
+        """
+        arrays = encode_columns(self.data.reset_index(drop=True))
+
+        arrays['__test_names__'] = np.array(self.test_names, dtype=str)
+        arrays['__full_paths__'] = np.array(self.full_paths, dtype=str)
+        arrays['__common_thinning__'] = np.array(self.common_thinning, dtype=float)
+        arrays['__session_thinning__'] = np.array(
+            [self.session_thinning[name] for name in self.test_names],
+            dtype=float,
+            )
+        arrays['__mean__'] = np.array(self.mean, dtype=float)
+        arrays['__ci__'] = np.asarray(self.ci, dtype=float)
+        arrays['__resamples__'] = np.array(self.resamples)
+        # seeds can be larger than an int64, store as text
+        arrays['__seed__'] = np.array([] if self.seed is None else [str(self.seed)], dtype=str)
+
+        save = np.savez_compressed if compress else np.savez
+
+        if file is None:
+            buf = io.BytesIO()
+            save(buf, **arrays)
+            return buf.getvalue()
+
+        save(file, **arrays)
+
+    @staticmethod
+    def load_npz_data(npz_data):
+        """
+        Load data and results written by `to_npz`.
+
+        Parameters
+        ----------
+        npz_data : str, bytes or file-like
+            File name, encoded data or open file.
+
+        Returns
+        -------
+        data : pd.DataFrame
+            Data for all sessions.
+        test_names : list of str
+            Session names.
+        test_paths : list of str
+            Session file paths.
+        results : dict
+            Thinning factors, mean, confidence interval and bootstrap
+            settings.
+        """
+        if isinstance(npz_data, bytes):
+            npz_data = io.BytesIO(npz_data)
+
+        with np.load(npz_data, allow_pickle=False) as dat:
+            data = decode_columns(dat)
+            test_names = dat['__test_names__'].tolist()
+            test_paths = dat['__full_paths__'].tolist()
+
+            seed = dat['__seed__']
+            results = {
+                'common_thinning': _thinning_value(dat['__common_thinning__']),
+                'session_thinning': {
+                    name: _thinning_value(t) for name, t in zip(test_names, dat['__session_thinning__'])
+                    },
+                'mean': float(dat['__mean__']),
+                'ci': dat['__ci__'],
+                'resamples': int(dat['__resamples__']),
+                'seed': int(seed[0]) if len(seed) else None,
+                }
+
+        return data, test_names, test_paths, results
+
     @staticmethod
     def load_json_data(json_data):
         """
@@ -176,7 +1149,7 @@ class evaluate():
         if isinstance(json_data, str):
             json_data = json.loads(json_data)
         # Extract data, cps, and test_info from json_data
-        data = pd.read_json(json_data['measurement'])
+        data = pd.read_json(io.StringIO(json_data['measurement']))
         
         test_info = json_data['test_info']
         
@@ -193,47 +1166,123 @@ class evaluate():
         return data, test_names, test_paths, 
         
     
+    def add_sessions(self, test_names, test_path=''):
+        """
+        Add sessions to the evaluation and update the results.
+
+        If a cache is used, only the new sessions are checked for
+        autocorrelation and resampled, unless they need a larger thinning
+        factor. Otherwise, everything is evaluated again.
+
+        Parameters
+        ----------
+        test_names : str or list of str
+            File names of M2E sessions to add.
+        test_path : str, optional
+            Full path to the directory containing the sessions.
+
+        Returns
+        -------
+        float
+            Mean of test data.
+        numpy array
+            Upper and lower confidence bound on the mean of the test data.
+        """
+        full_paths, names = session_paths(test_names, test_path)
+
+        for name in names:
+            if name in self.test_names:
+                raise ValueError(f"Session '{name}' is already part of the evaluation")
+
+        data = []
+        for path, name in zip(full_paths, names):
+            df = read_session(path, use_sidecar=self.use_sidecar)
+            df['name'] = name
+            data.append(df)
+
+        self.full_paths += full_paths
+        self.test_names += names
+        # only the new rows need to be indexed
+        self.data = append_indexed(self.data, pd.concat(data, ignore_index=True))
+
+        self.common_thinning = self.find_thinning_factor()
+        self.thinned_data = self.thin_data()
+
+        return self.eval()
+
+    def _keys(self, sesh_dat):
+        """Get cache keys for session data, hashing new sessions only."""
+        for name, dat in zip(self.test_names, sesh_dat):
+            if name not in self._session_keys:
+                self._session_keys[name] = session_hash(dat)
+        return [self._session_keys[name] for name in self.test_names]
+
+    def _cached_thinning(self, sesh_dat):
+        """
+        Find thinning factors, as `common_thinning_factor` does, with cached
+        autocorrelation checks.
+        """
+        keys = self._keys(sesh_dat)
+        # lagged[n][k - 1] is True if session n, thinned by k, is autocorrelated
+        lagged = [list(self.cache.get(key).get('lagged', [])) for key in keys]
+        checked = [len(lag) for lag in lagged]
+
+        max_lag = np.min([np.floor(len(dat)/4) for dat in sesh_dat])
+
+        thinning_factor = 1
+        while thinning_factor <= max_lag:
+            for lag, dat in zip(lagged, sesh_dat):
+                # check all sessions, like common_thinning_factor, for session thinning
+                while len(lag) < thinning_factor:
+                    lag.append(has_autocorrelation(dat[::len(lag) + 1]))
+            if not any(lag[thinning_factor - 1] for lag in lagged):
+                break
+            thinning_factor += 1
+        else:
+            thinning_factor = np.nan
+
+        for key, lag, n in zip(keys, lagged, checked):
+            if len(lag) > n:
+                self.cache.update(key, lagged=np.array(lag, dtype=bool))
+
+        # only factors up to the common one count, cache may have more
+        last = max_lag if np.isnan(thinning_factor) else thinning_factor
+        sesh_thinning = []
+        for lag in lagged:
+            found = [k for k, is_lag in enumerate(lag[:int(last)], start=1) if not is_lag]
+            sesh_thinning.append(found[0] if found else np.nan)
+
+        return thinning_factor, sesh_thinning
+
     def find_thinning_factor(self):
         """
         Determine common thinning factor for data that removes autocorrelation.
 
+        Session data is grouped once and the autocorrelation of each thinned
+        session is found with an FFT. The smallest thinning factor that
+        removes autocorrelation from each session is stored in
+        session_thinning.
+
         Returns
         -------
         int:
             Thinning factor that removes autocorrelation.
 
         """
-        # get common thinning factor
-        thinning_factor = 1
-        # TODO: Make this more robust for data sets of different sizes rather than
-        # Limiting to smallest data set
-        sesh_counts = [np.sum(self.data['name'] == name) for name in self.test_names]
-        max_lag = np.min([np.floor(N/4) for N in sesh_counts])
-        is_lag = True
-        
-        while is_lag and thinning_factor <= max_lag:
-            # Initialize list of lags for each data set
-            lags = []
-            
-            for name in self.test_names:
-                # Filter by session
-                filt_dat = self.data[self.data['name'] == name]
-                # Thin data and calculate autocorrelation
-                thin_dat = filt_dat["m2e_latency"][::thinning_factor]
-                autocorr_lags = mcvqoe.math.improved_autocorrelation(thin_dat)
-                
-                # Lag 0 always present, store if more than that
-                lagged = len(autocorr_lags) > 1
-                lags.append(lagged)
-            if not any(lags):
-                is_lag = False
-            else:
-                thinning_factor += 1
-        if is_lag:
+        sesh_dat = self.session_latency(self.data)
+
+        if self.cache is None:
+            thinning_factor, sesh_thinning = common_thinning_factor(*sesh_dat)
+        else:
+            thinning_factor, sesh_thinning = self._cached_thinning(sesh_dat)
+
+        # smallest thinning factor for each session
+        self.session_thinning = dict(zip(self.test_names, sesh_thinning))
+
+        if np.isnan(thinning_factor):
             warnings.warn("No common thinning factor found ")
-            thinning_factor = np.nan
         return thinning_factor
-        
+
     def thin_data(self):
         """
         Thin data by common thinning factor
@@ -248,17 +1297,31 @@ class evaluate():
             thin = 1
         else:
             thin = self.common_thinning
-        
-        thinned_data = []
-        for name in self.test_names:
-            fdata = self.data[self.data['name'] == name]
-            tdata = fdata[::thin]
-            
-            thinned_data.append(tdata)
-        
-        return pd.concat(thinned_data)
-    
-    
+
+        # every thin-th trial of each session
+        trial = self.data.index.get_level_values('trial')
+        return self.data[trial % thin == 0]
+
+    def session_latency(self, df):
+        """
+        Get latency data for each session.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Data indexed with `index_data`.
+
+        Returns
+        -------
+        list of numpy arrays
+            Latencies for each session in test_names.
+        """
+        groups = {
+            name: dat.to_numpy()
+            for name, dat in df.groupby(level='name', sort=False, observed=True)['m2e_latency']
+            }
+        return [groups.get(name, np.array([])) for name in self.test_names]
+
     def eval(self):
         """
         Evaluate mouth to ear test data provided.
@@ -271,59 +1334,193 @@ class evaluate():
             Upper and lower confidence bound on the mean of the test data.
 
         """
-        
-        mean_cum = 0
-        
-        ci_dsets = []
-        for name in self.test_names:
-            thin_data = self.thinned_data[self.thinned_data['name'] == name]
-            m2e_vals = thin_data['m2e_latency']
-            ci_dsets.append(m2e_vals)
-            mean_cum += np.mean(m2e_vals)
-
-        self.mean = mean_cum/len(self.test_names)
-        
-        
-        self.ci = mcvqoe.math.bootstrap_datasets_ci(*ci_dsets)
+        if self.cache is not None:
+            return self._cached_eval()
+
+        ci_dsets = self.session_latency(self.thinned_data)
+
+        self.mean = np.mean([np.mean(d) for d in ci_dsets])
+
+        self.ci = bootstrap_datasets_ci(*ci_dsets,
+                                        R=self.resamples,
+                                        seed=self.seed,
+                                        jobs=self.jobs,
+                                        )
+
+        return (self.mean, self.ci)
+
+    def _cached_eval(self, alpha=0.5):
+        """
+        Evaluate with cached per-session means and bootstrap resample means.
+
+        Each session is resampled with its own random stream, spawned from
+        seed, the session key and the session name, so resample means can be
+        cached and combined and sessions with the same data are still resampled
+        independently. As in `bootstrap_datasets_ci`, resamples are the size
+        of the first session. Only resample means for the current settings are
+        kept, older ones are removed from the cache when new ones are stored.
+        """
+        ci_dsets = self.session_latency(self.thinned_data)
+        keys = self._keys(self.session_latency(self.data))
+
+        thin = 1 if np.isnan(self.common_thinning) else self.common_thinning
+        R = int(self.resamples)
+        N = len(ci_dsets[0])
+
+        # a fresh seed can't be reused by later evaluations, keep in memory
+        persist = self.seed is not None
+        if persist:
+            entropy = self.seed
+        else:
+            if not hasattr(self, '_fresh_entropy'):
+                self._fresh_entropy = np.random.SeedSequence().entropy
+            entropy = self._fresh_entropy
+
+        # underscore names are not written to disk
+        boot_prefix = f'boot_{thin}_{N}_{R}_{entropy}_'
+        if not persist:
+            boot_prefix = '_' + boot_prefix
+
+        means = []
+        x_bar = np.zeros(R)
+        for name, key, dat in zip(self.test_names, keys, ci_dsets):
+            entry = self.cache.get(key)
+
+            mean_name = f'mean_{thin}'
+            if mean_name not in entry:
+                self.cache.update(key, **{mean_name: np.mean(dat)})
+            means.append(float(entry[mean_name]))
+
+            name_id = int(hashlib.sha1(name.encode()).hexdigest()[:16], 16)
+            boot_name = f'{boot_prefix}{name_id:016x}'
+            if boot_name not in entry:
+                seed_seq = np.random.SeedSequence(entropy, spawn_key=(int(key[:16], 16), name_id))
+                # resample means for other settings won't be used again
+                stale = [k for k in entry if k.lstrip('_').startswith('boot_') and not k.startswith(boot_prefix)]
+                self.cache.update(key, persist=persist, drop=stale,
+                                  **{boot_name: bootstrap_means(dat, N, R, seed_seq)})
+            x_bar += entry[boot_name]
+
+        self.mean = np.mean(means)
+
+        # percentiles of means across sessions
+        x_bar /= len(ci_dsets)
+        ql = alpha/2
+        self.ci = np.quantile(x_bar, [ql, 1 - ql])
 
         return (self.mean, self.ci)
     
     def filter_data(self, df, test_name, talkers):
+        """
+        Select data from sessions and talkers.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Data indexed with `index_data`.
+        test_name : str or list of str or None
+            Session names to keep. If None, all sessions are kept.
+        talkers : str or list of str or None
+            Talkers, audio clip names, to keep. If None, all talkers are
+            kept.
+
+        Returns
+        -------
+        pd.DataFrame
+            Selected rows, in their original order.
+        """
+        keep = np.ones(len(df), dtype=bool)
         # Filter by session name if given
         if test_name is not None:
-            df_filt = []
             if not isinstance(test_name, list):
                 test_name = [test_name]
-            for name in test_name:
-                df_filt.append(df[df['name'] == name])
-            df = pd.concat(df_filt)
+            keep &= level_mask(df.index, 'name', test_name)
         # Filter by talkers if given
         if talkers is not None:
-            df_filt = []
             if isinstance(talkers, str):
                 talkers = [talkers]
-            for talker in talkers:
-                df_filt.append(df[df['Filename'] == talker])
-            df = pd.concat(df_filt)
-        return df
-    
+            keep &= level_mask(df.index, 'Filename', talkers)
+        return df[keep]
+
     def histogram(self, thinned=True, test_name=None, talkers=None,
-                  color_palette=px.colors.qualitative.Plotly,
-                  title='Histogram of mouth-to-ear latency results'):
+                  color_palette=None,
+                  title='Histogram of mouth-to-ear latency results',
+                  max_points=plot_max_points):
+        """
+        Plot a histogram of latencies for each session.
+
+        If there are more than max_points trials, counts are computed here
+        and only bin counts are sent to the plot rather than every trial.
+
+        Parameters
+        ----------
+        thinned : bool, default=True
+            Whether to plot thinned data.
+        test_name : str or list of str, optional
+            Sessions to plot. See `filter_data`.
+        talkers : str or list of str, optional
+            Talkers to plot. See `filter_data`.
+        color_palette : list of str, optional
+            Colors for sessions. Defaults to the plotly palette.
+        title : str, optional
+            Plot title.
+        max_points : int or None, default=plot_max_points
+            Number of trials above which bins are computed here. If None,
+            data is never aggregated.
+
+        Returns
+        -------
+        plotly.graph_objects.Figure
+            Histogram figure.
+        """
+        # plotly is slow to import, only load it when plotting
+        import plotly.express as px
+
+        if color_palette is None:
+            color_palette = px.colors.qualitative.Plotly
+
         if not thinned:
             df = self.data
         else:
             df = self.thinned_data
         
         df = self.filter_data(df, test_name=test_name, talkers=talkers)
-        
-        fig = px.histogram(df, x='m2e_latency', color='name',
-                           labels={
-                               'm2e_latency': 'Mouth-to-ear latency [s]',
-                               },
-                           title=title,
-                           color_discrete_sequence=color_palette,
-                           )
+
+        labels = {
+            'm2e_latency': 'Mouth-to-ear latency [s]',
+            }
+
+        if max_points is None or len(df) <= max_points:
+            fig = px.histogram(df, x='m2e_latency', color='name',
+                               labels=labels,
+                               title=title,
+                               color_discrete_sequence=color_palette,
+                               )
+        else:
+            # same bins for all sessions
+            lat = df['m2e_latency'].to_numpy()
+            edges = np.histogram_bin_edges(lat, bins='auto')
+            if len(edges) > _max_hist_bins + 1:
+                edges = np.histogram_bin_edges(lat, bins=_max_hist_bins)
+
+            counts = []
+            for name, dat in df.groupby(level='name', sort=False, observed=True)['m2e_latency']:
+                count, _ = np.histogram(dat.to_numpy(), bins=edges)
+                counts.append(pd.DataFrame({
+                    'name': name,
+                    'm2e_latency': (edges[:-1] + edges[1:]) / 2,
+                    'count': count,
+                    }))
+
+            fig = px.bar(pd.concat(counts, ignore_index=True),
+                         x='m2e_latency', y='count', color='name',
+                         labels=labels,
+                         title=title,
+                         color_discrete_sequence=color_palette,
+                         )
+            fig.update_traces(width=np.diff(edges))
+            fig.update_layout(bargap=0)
+
         fig.add_vline(x=self.mean, line_width=3, line_dash="dash")
         fig.add_vline(x=self.ci[0], line_width=2, line_dash="dot")
         fig.add_vline(x=self.ci[1], line_width=2, line_dash="dot")
@@ -346,9 +1543,44 @@ class evaluate():
         return fig
     
     def plot(self, thinned=True, test_name=None, x=None, talkers=None,
-             color_palette=px.colors.qualitative.Plotly,
-             title='Mouth-to-ear latency scatter plot'):
-        
+             color_palette=None,
+             title='Mouth-to-ear latency scatter plot',
+             max_points=plot_max_points):
+        """
+        Plot latency of each trial.
+
+        If there are more than max_points trials, points are drawn with WebGL
+        and each session and talker is reduced, with `minmax_decimate`, so
+        that about max_points are plotted in total.
+
+        Parameters
+        ----------
+        thinned : bool, default=True
+            Whether to plot thinned data.
+        test_name : str or list of str, optional
+            Sessions to plot. See `filter_data`.
+        x : str or array-like, optional
+            Column, or values, for the x-axis. Defaults to trial number.
+        talkers : str or list of str, optional
+            Talkers to plot. See `filter_data`.
+        color_palette : list of str, optional
+            Colors for sessions. Defaults to the plotly palette.
+        title : str, optional
+            Plot title.
+        max_points : int or None, default=plot_max_points
+            Number of trials above which data is decimated. If None, all
+            trials are plotted.
+
+        Returns
+        -------
+        plotly.graph_objects.Figure
+            Scatter plot figure.
+        """
+        import plotly.express as px
+
+        if color_palette is None:
+            color_palette = px.colors.qualitative.Plotly
+
         # Grab thinned or unthinned data
         if not thinned:
             df = self.data
@@ -359,17 +1591,34 @@ class evaluate():
         
         # Set x-axis value
         if x is None:
-            x = df.index
-        
+            df = df.reset_index(level='trial')
+            x = 'trial'
+        elif not isinstance(x, str):
+            # keep values with their rows when decimating
+            df = df.assign(x=np.asarray(x))
+            x = 'x'
+
+        large = max_points is not None and len(df) > max_points
+        if large:
+            # decimate each trace, traces are session and talker pairs
+            groups = df.groupby(level=['name', 'Filename'], sort=False, observed=True).indices
+            buckets = max(1, max_points // (2 * len(groups)))
+            keep = np.concatenate([
+                pos[minmax_decimate(df['m2e_latency'].to_numpy()[pos], buckets)]
+                for pos in groups.values()
+                ])
+            df = df.iloc[np.sort(keep)]
+
         fig = px.scatter(df, x=x, y='m2e_latency',
                          color='name',
                          symbol='Filename',
                          labels={
                              'm2e_latency': 'Mouth-to-ear latency [s]',
-                             'index': 'Trial Number',
+                             'trial': 'Trial Number',
                              },
                          title=title,
                          color_discrete_sequence=color_palette,
+                         render_mode='webgl' if large else 'auto',
                          )
         
         fig.update_layout(legend=dict(
@@ -382,6 +1631,182 @@ class evaluate():
         return fig
 
 
+class streaming_evaluate():
+    """
+    Evaluate mouth to ear latency of tests too large to fit in memory.
+
+    Session files are read in chunks and only the latency column is kept, in
+    temporary memory mapped files, so memory use is bounded by chunk_size
+    rather than the size of the test. Online moments of each session are
+    kept as data is read. Thinning uses `has_autocorrelation_chunked` and the
+    bootstrap draws resamples from the memory mapped data, with the same
+    random values as `evaluate` but at most chunk_size indices at a time, so
+    results match `evaluate`, up to rounding, for tests that fit in memory.
+
+    Parameters
+    ----------
+    test_names : str or list of str
+        File names of M2E sessions part of a test.
+    test_path : str, optional
+        Full path to the directory containing the sessions within a test.
+    chunk_size : int, default=2**20
+        Number of rows to read, and samples to process, at once.
+    tmp_dir : str, optional
+        Directory for the temporary latency files. Defaults to the system
+        temporary directory.
+    **kwargs
+        Bootstrap settings, resamples, seed and jobs, as for `evaluate`. If
+        jobs is more than one, thinned data is copied to each process.
+
+    Attributes
+    ----------
+    full_paths : list of str
+        Full file paths to the sessions.
+    test_names : list of str
+        Session names.
+    session_stats : dict
+        Number of trials, mean and standard deviation of latency for each
+        session.
+    common_thinning : int
+        The largest thinning factor among the sessions.
+    session_thinning : dict
+        Smallest thinning factor that removes autocorrelation for each
+        session, NaN if none was found.
+    mean : float
+        Average of all the means of the thinned session data.
+    ci : numpy array
+        Lower and upper confidence bound on the mean.
+
+    See Also
+    --------
+    evaluate : In memory evaluation, with plotting.
+
+    Examples
+    --------
+    >>> with streaming_evaluate(names, seed=0) as eval_obj:
+    ...     print(eval_obj.mean, eval_obj.ci)
+    """
+
+    def __init__(self, test_names, test_path='', chunk_size=2**20, tmp_dir=None, **kwargs):
+        self.full_paths, self.test_names = session_paths(test_names, test_path)
+        self.chunk_size = int(chunk_size)
+
+        # Bootstrap settings
+        self.resamples = int(1e4)
+        self.seed = None
+        self.jobs = 1
+
+        # Check for kwargs
+        for k, v in kwargs.items():
+            if hasattr(self, k):
+                setattr(self, k, v)
+            else:
+                raise TypeError(f"{k} is not a valid keyword argument")
+
+        self._tmp = tempfile.TemporaryDirectory(dir=tmp_dir, prefix='m2e_eval_')
+
+        self.session_stats = {}
+        self._latency = []
+        for k, (path, name) in enumerate(zip(self.full_paths, self.test_names)):
+            lat_name = os.path.join(self._tmp.name, f'session{k}.dat')
+            self.session_stats[name] = self._stream_session(path, lat_name)
+            if self.session_stats[name]['trials']:
+                self._latency.append(np.memmap(lat_name, dtype=float, mode='r'))
+            else:
+                # can't memory map an empty file
+                self._latency.append(np.array([]))
+
+        self.common_thinning = self.find_thinning_factor()
+
+        self.mean, self.ci = self.eval()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        """Remove temporary latency files."""
+        self._latency = []
+        self._tmp.cleanup()
+
+    def _stream_session(self, path, lat_name):
+        """Copy latency from a session csv to lat_name, returning moments."""
+        n = 0
+        mean = 0.0
+        m2 = 0.0
+        with open(lat_name, 'wb') as f:
+            for chunk in pd.read_csv(path, usecols=['m2e_latency'], dtype=float, chunksize=self.chunk_size):
+                x = chunk['m2e_latency'].to_numpy()
+                f.write(x.tobytes())
+
+                # combine moments of chunk with running moments
+                n_x = len(x)
+                if n_x == 0:
+                    continue
+                mean_x = np.mean(x)
+                delta = mean_x - mean
+                m2 += np.sum((x - mean_x)**2) + delta**2 * n * n_x/(n + n_x)
+                n += n_x
+                mean += delta * n_x/n
+
+        return {
+            'trials': n,
+            'mean': mean if n else np.nan,
+            'std': np.sqrt(m2/(n - 1)) if n > 1 else np.nan,
+            }
+
+    def find_thinning_factor(self):
+        """
+        Determine common thinning factor for data that removes autocorrelation.
+
+        Returns
+        -------
+        int:
+            Thinning factor that removes autocorrelation.
+        """
+        thinning_factor, sesh_thinning = common_thinning_factor(*self._latency, chunk=self.chunk_size)
+
+        # smallest thinning factor for each session
+        self.session_thinning = dict(zip(self.test_names, sesh_thinning))
+
+        if np.isnan(thinning_factor):
+            warnings.warn("No common thinning factor found ")
+        return thinning_factor
+
+    def eval(self):
+        """
+        Evaluate mouth to ear test data provided.
+
+        Returns
+        -------
+        float
+            Mean of test data.
+        numpy array
+            Upper and lower confidence bound on the mean of the test data.
+        """
+        if np.isnan(self.common_thinning):
+            thin = 1
+        else:
+            thin = self.common_thinning
+
+        # views of the memory mapped data, nothing is copied
+        ci_dsets = [dat[::thin] for dat in self._latency]
+
+        self.mean = np.mean([chunked_mean(d, self.chunk_size) for d in ci_dsets])
+
+        # at most chunk_size indices are drawn at once
+        self.ci = bootstrap_datasets_ci(*ci_dsets,
+                                        R=self.resamples,
+                                        seed=self.seed,
+                                        jobs=self.jobs,
+                                        block_size=self.chunk_size,
+                                        )
+
+        return (self.mean, self.ci)
+
+
 # Main definition
 def main():
     """
@@ -410,12 +1835,54 @@ def main():
                         default=True,
                         action="store_false",
                         help="Do not use reprocessed data if it exists.")
+    parser.add_argument('-s', '--seed',
+                        default=None,
+                        type=int,
+                        help="Seed for bootstrap confidence interval.")
+    parser.add_argument('-R', '--resamples',
+                        default=int(1e4),
+                        type=int,
+                        help="Number of bootstrap resamples.")
+    parser.add_argument('-j', '--jobs',
+                        default=1,
+                        type=int,
+                        help="Number of processes to use for bootstrap.")
+    parser.add_argument('--sidecar',
+                        default=False,
+                        action="store_true",
+                        help="Read session data from .npz files next to the csv files, creating them if needed.")
+    parser.add_argument('--cache',
+                        default=None,
+                        metavar='DIR',
+                        help="Cache per-session statistics in DIR to speed up later evaluations.")
+    parser.add_argument('--out-of-core',
+                        default=False,
+                        action="store_true",
+                        help="Stream session files rather than loading them into memory.")
+    parser.add_argument('--chunk-size',
+                        default=2**20,
+                        type=int,
+                        help="Rows to process at once with --out-of-core (default: %(default)s).")
 
     args = parser.parse_args()
-    t = evaluate(args.test_names, test_path=args.test_path,
-                 use_reprocess=args.no_reprocess)
+    if args.out_of_core:
+        # close memmaps, and remove temporary files, when done
+        with streaming_evaluate(args.test_names, test_path=args.test_path,
+                                chunk_size=args.chunk_size,
+                                seed=args.seed,
+                                resamples=args.resamples,
+                                jobs=args.jobs) as t:
+            res = t.eval()
+    else:
+        t = evaluate(args.test_names, test_path=args.test_path,
+                     use_reprocess=args.no_reprocess,
+                     seed=args.seed,
+                     resamples=args.resamples,
+                     jobs=args.jobs,
+                     use_sidecar=args.sidecar,
+                     cache=args.cache)
 
-    res = t.eval()
+        res = t.eval()
 
     print(res)
 
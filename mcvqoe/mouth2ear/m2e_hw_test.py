@@ -6,7 +6,7 @@ import mcvqoe.gui
 import os
 
 from contextlib import nullcontext
-from .m2e import measure
+from .m2e import add_run_options, apply_run_options, measure
 
 import numpy as np   
 
@@ -75,8 +75,9 @@ def main():
                         help='Save audio in the wav directory')
     parser.add_argument('--no-save-audio', dest='save_audio', action='store_false',
                         help='Don\'t save audio in the wav directory, implies'+
-                        '--no-save-tx-audio')             
-    
+                        '--no-save-tx-audio')
+    add_run_options(parser, test_obj)
+
     args = parser.parse_args()
 
     # check if audio files were given
@@ -84,9 +85,8 @@ def main():
         # remove audio_files (keep default value)
         delattr(args, "audio_files")
     # Set M2E object variables to terminal arguments
-    for k, v in vars(args).items():
-        if hasattr(test_obj, k):
-            setattr(test_obj, k, v)
+    apply_run_options(test_obj, args)
+
     # Check for value errors with M2E instance variables
     test_obj.param_check()
 
@@ -8,7 +8,7 @@ import scipy.io.wavfile
 import sys
 import tempfile
 
-from .m2e import measure
+from .m2e import add_process_options, measure
     
 def main():
     #---------------------------[Create Test object]---------------------------
@@ -26,10 +26,17 @@ def main():
                         help='file to write reprocessed CSV data to. Can be the same name as datafile to overwrite results. if omitted output will be written to stdout')
     parser.add_argument('--audio-path', type=str, default=None, metavar='P', dest='audio_path',
                         help='Path to audio files for test. Will be found automatically if not given')
+    add_process_options(parser, test_obj)
                                                               
     #-----------------------------[Parse arguments]-----------------------------
 
     args = parser.parse_args()
+
+    test_obj.jobs = args.jobs
+    test_obj.windowed_search = args.windowed_search
+    test_obj.search_window = args.search_window
+    test_obj.poly_resample = args.poly_resample
+    test_obj.param_check()
     
     with tempfile.TemporaryDirectory() as tmp_dir:
         
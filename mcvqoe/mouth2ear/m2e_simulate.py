@@ -7,7 +7,7 @@ import mcvqoe.gui
 import os
 import sys
 
-from .m2e import measure
+from .m2e import add_run_options, apply_run_options, measure
 
 import numpy as np
 
@@ -24,6 +24,8 @@ def main():
     #don't save audio for simulation
     test_obj.save_tx_audio = False
     test_obj.save_audio = False
+    #keep recordings in memory when not saving audio
+    test_obj.in_memory = True
 
     # ------------------------[Create simulation object]------------------------
 
@@ -80,7 +82,12 @@ def main():
     parser.add_argument('--no-save-audio', dest='save_audio', action='store_false',
                         help='Don\'t save audio in the wav directory, implies'+
                         '--no-save-tx-audio')
-                        
+    parser.add_argument('--in-memory', dest='in_memory', action='store_true', default=test_obj.in_memory,
+                        help='Keep recordings in memory when audio is not saved (default)')
+    parser.add_argument('--no-in-memory', dest='in_memory', action='store_false',
+                        help='Write recordings to the wav directory even when audio is not saved')
+    add_run_options(parser, test_obj)
+
     args = parser.parse_args()
 
     # check if audio files were given
@@ -89,9 +96,7 @@ def main():
         delattr(args, "audio_files")
 
     # Set M2E object variables to terminal arguments
-    for k, v in vars(args).items():
-        if hasattr(test_obj, k):
-            setattr(test_obj, k, v)
+    apply_run_options(test_obj, args)
 
     # Check for value errors with M2E instance variables
     test_obj.param_check()
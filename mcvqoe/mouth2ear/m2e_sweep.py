@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+Run simulated M2E tests over a grid of settings in parallel.
+"""
+
+import argparse
+import itertools
+import os
+import sys
+
+from concurrent.futures import ProcessPoolExecutor
+
+import mcvqoe.simulation
+import numpy as np
+import pandas as pd
+
+from .m2e import measure
+from .m2e_eval import evaluate
+
+
+def sweep_combinations(grid):
+    """
+    Expand a grid of settings into a list of combinations.
+
+    Parameters
+    ----------
+    grid : dict
+        Setting names and a list of values for each.
+
+    Returns
+    -------
+    list of dicts
+        Every combination of settings from grid.
+
+    Examples
+    --------
+    >>> sweep_combinations({'m2e_latency': [0.1, 0.2], 'channel_tech': ['clean']})
+    [{'m2e_latency': 0.1, 'channel_tech': 'clean'}, {'m2e_latency': 0.2, 'channel_tech': 'clean'}]
+    """
+    keys = list(grid)
+    return [dict(zip(keys, vals)) for vals in itertools.product(*(grid[k] for k in keys))]
+
+
+def _quiet_progress(prog_type, num_trials, current_trial, **kwargs):
+    """Progress update that doesn't print, used for sweep workers."""
+    return True
+
+
+def _apply_settings(sim_obj, test_obj, settings):
+    """Set sweep settings on the simulation or measure object that has them."""
+    for k, v in settings.items():
+        if hasattr(sim_obj, k):
+            setattr(sim_obj, k, v)
+        elif hasattr(test_obj, k):
+            setattr(test_obj, k, v)
+        else:
+            raise ValueError(f"Unknown sweep setting '{k}'")
+
+
+def _run_combination(args):
+    """Run one combination of a sweep, in a worker process."""
+    index, settings, outdir, seed_seq, test_settings = args
+
+    res = {"combination": index, **settings}
+
+    try:
+        sim_obj = mcvqoe.simulation.QoEsim()
+        test_obj = measure(**test_settings)
+
+        test_obj.audio_interface = sim_obj
+        test_obj.ri = sim_obj
+        test_obj.outdir = outdir
+        test_obj.get_post_notes = lambda: {}
+        test_obj.progress_update = _quiet_progress
+
+        _apply_settings(sim_obj, test_obj, settings)
+
+        # simulate the device delay that measure removes, unless it is swept
+        if "device_delay" not in settings:
+            sim_obj.device_delay = test_obj.dev_dly
+
+        # QoEsim uses the global generator for noise
+        np.random.seed(seed_seq.generate_state(1)[0])
+        test_obj.rng = np.random.default_rng(seed_seq)
+
+        # construct string for system name
+        system = sim_obj.channel_tech
+        if sim_obj.channel_rate is not None:
+            system += " at " + str(sim_obj.channel_rate)
+
+        test_obj.info = {
+            "Test Type": "simulation",
+            "tx_dev": "none",
+            "rx_dev": "none",
+            "system": system,
+            "test_loc": "N/A",
+            "Pre Test Notes": f"Sweep combination {index}",
+        }
+
+        test_obj.param_check()
+        data_files = test_obj.run()
+
+        eval_obj = evaluate(data_files, seed=seed_seq.generate_state(1)[0])
+        res["trials"] = len(eval_obj.data)
+        res["mean"] = eval_obj.mean
+        res["ci_lower"], res["ci_upper"] = eval_obj.ci
+        res["data_file"] = ";".join(data_files)
+        res["error"] = ""
+    except Exception as e:
+        # keep going with other combinations
+        res["error"] = f"{type(e).__name__}: {e}"
+
+    return res
+
+
+def sweep(grid, outdir="", jobs=None, seed=None, **kwargs):
+    """
+    Run simulated M2E tests for every combination in a grid of settings.
+
+    Combinations are run in a process pool. Each combination gets its own
+    output directory and random seed so results are repeatable and workers
+    never share files.
+
+    Parameters
+    ----------
+    grid : dict
+        Setting names and a list of values for each. Settings can be
+        attributes of `mcvqoe.simulation.QoEsim` (e.g. 'channel_tech',
+        'channel_rate', 'm2e_latency') or `measure` (e.g. 'bgnoise_snr').
+    outdir : str, default=''
+        Directory to store results in. Combination N is stored in the
+        'combination_N' subdirectory.
+    jobs : int, optional
+        Number of processes to use. Defaults to the number of CPUs.
+    seed : int, optional
+        Seed used to generate the seed for each combination.
+    **kwargs
+        Settings for `measure` used for all combinations.
+
+    Returns
+    -------
+    pandas DataFrame
+        One row per combination with its settings, the mean and confidence
+        interval from `evaluate`, the data files and any error that occurred.
+        The table is also written to 'sweep_results.csv' in outdir.
+
+    Raises
+    ------
+    ValueError
+        If a setting in grid is not an attribute of `QoEsim` or `measure`.
+    TypeError
+        If kwargs has a setting that `measure` does not have.
+    """
+    combos = sweep_combinations(grid)
+
+    # simulation, don't wait or save audio unless asked to
+    test_settings = {
+        "ptt_wait": 0,
+        "ptt_gap": 0,
+        "save_tx_audio": False,
+        "save_audio": False,
+        "in_memory": True,
+        **kwargs,
+    }
+
+    # check setting names before starting, errors in combinations are recorded
+    sim_obj = mcvqoe.simulation.QoEsim()
+    test_obj = measure(**test_settings)
+    for k in grid:
+        if not (hasattr(sim_obj, k) or hasattr(test_obj, k)):
+            raise ValueError(f"Unknown sweep setting '{k}'")
+
+    seeds = np.random.SeedSequence(seed).spawn(len(combos))
+
+    work = [
+        (n, settings, os.path.join(outdir, f"combination_{n}"), s, test_settings)
+        for n, (settings, s) in enumerate(zip(combos, seeds))
+    ]
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(_run_combination, work))
+
+    results = pd.DataFrame(results)
+
+    if outdir:
+        os.makedirs(outdir, exist_ok=True)
+    results.to_csv(os.path.join(outdir, "sweep_results.csv"), index=False)
+
+    return results
+
+
+def main():
+    """Run a sweep of simulated M2E tests from the command line."""
+
+    sim_obj = mcvqoe.simulation.QoEsim()
+    test_obj = measure()
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--channel-tech', default=[sim_obj.channel_tech], nargs='+', metavar='TECH',
+                        dest='channel_tech', help='Channel technologies to simulate (default: %(default)s)')
+    parser.add_argument('--channel-rate', default=[str(sim_obj.channel_rate)], nargs='+', metavar='RATE',
+                        dest='channel_rate', help='Channel technology rates to simulate. Passing \'None\' will use '+
+                        'the technology default. (default: %(default)s)')
+    parser.add_argument('--channel-m2e', type=float, default=[sim_obj.m2e_latency], nargs='+', metavar='L',
+                        dest='m2e_latency', help='Channel mouth to ear latencies, in seconds, to simulate. '+
+                        '(default: %(default)s)')
+    parser.add_argument('-N', '--bgnoise-snr', type=float, default=[test_obj.bgnoise_snr], nargs='+',
+                        dest='bgnoise_snr', help='Signal to noise ratios for background noise (default: %(default)s)')
+    parser.add_argument('-z', '--bgnoisefile', dest='bgnoise_file', default=test_obj.bgnoise_file,
+                        help='Noise file to mix with the test audio. Default is no background noise')
+    parser.add_argument('-t', '--trials', type=int, default=test_obj.trials, metavar='T',
+                        help='Number of trials to use for each combination (default: %(default)s)')
+    parser.add_argument('-d', '--outdir', default=test_obj.outdir, metavar='DIR',
+                        help='Directory to store results in')
+    parser.add_argument('-j', '--jobs', type=int, default=None, metavar='N',
+                        help='Number of processes to use (default: number of CPUs)')
+    parser.add_argument('-s', '--seed', type=int, default=None,
+                        help='Seed for the sweep, makes results repeatable')
+
+    args = parser.parse_args()
+
+    grid = {
+        'channel_tech': args.channel_tech,
+        'channel_rate': [None if r == 'None' else r for r in args.channel_rate],
+        'm2e_latency': args.m2e_latency,
+        'bgnoise_snr': args.bgnoise_snr,
+    }
+
+    results = sweep(grid, outdir=args.outdir, jobs=args.jobs, seed=args.seed,
+                    trials=args.trials, bgnoise_file=args.bgnoise_file)
+
+    print(results.to_string(index=False))
+
+    if any(results['error']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
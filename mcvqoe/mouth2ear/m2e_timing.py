@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Per-trial timing of measurement stages.
+"""
+
+import contextlib
+import cProfile
+import csv
+import pstats
+import time
+
+import numpy as np
+
+
+@contextlib.contextmanager
+def timed(durations, name):
+    """
+    Time a block of code and store the duration in a dictionary.
+
+    This is used where there is no `trial_timer`, such as in worker processes,
+    so durations can be passed back and added with `trial_timer.add`.
+
+    Parameters
+    ----------
+    durations : dict or None
+        Dictionary to store the duration, in seconds, in. If None, nothing is
+        timed.
+    name : str
+        Key to store the duration under.
+    """
+    if durations is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        durations[name] = durations.get(name, 0) + time.perf_counter() - start
+
+
+class timing_hook():
+    """
+    Base class for objects that are notified of timed stages.
+
+    Subclasses override any of the methods below. Hooks are passed to
+    `trial_timer`, usually through `measure.timing_hooks`.
+    """
+
+    def stage_start(self, trial, name):
+        """Called before a stage, in the measurement process, starts."""
+        pass
+
+    def stage_end(self, trial, name, duration):
+        """Called when a stage, started with `stage_start`, ends."""
+        pass
+
+    def test_end(self, timer):
+        """Called when the test is done with the `trial_timer` that was used."""
+        pass
+
+
+class profile_hook(timing_hook):
+    """
+    Run cProfile during timed stages.
+
+    Parameters
+    ----------
+    stages : list of str, optional
+        Names of stages to profile. If None, all stages are profiled.
+    filename : str, optional
+        File to dump profile stats to at the end of the test. If None, the top
+        functions are printed.
+    lines : int, default=20
+        Number of functions to print when filename is None.
+
+    Attributes
+    ----------
+    profile : cProfile.Profile
+        Collected profile.
+
+    Examples
+    --------
+    >>> test_obj.timing = True
+    >>> test_obj.timing_hooks = [profile_hook(stages=['play_record'])]
+    """
+
+    def __init__(self, stages=None, filename=None, lines=20):
+        self.stages = stages
+        self.filename = filename
+        self.lines = lines
+        self.profile = cProfile.Profile()
+
+    def _use(self, name):
+        return self.stages is None or name in self.stages
+
+    def stage_start(self, trial, name):
+        if self._use(name):
+            self.profile.enable()
+
+    def stage_end(self, trial, name, duration):
+        if self._use(name):
+            self.profile.disable()
+
+    def test_end(self, timer):
+        if self.filename:
+            self.profile.dump_stats(self.filename)
+        else:
+            pstats.Stats(self.profile).sort_stats("cumulative").print_stats(self.lines)
+
+
+class trial_timer():
+    """
+    Collect durations of named stages for each trial.
+
+    Parameters
+    ----------
+    hooks : list of timing_hook, default=()
+        Hooks to notify as stages start and end.
+
+    Attributes
+    ----------
+    durations : dict
+        Durations, in seconds, keyed by trial number then stage name. Stages
+        that happen more than once in a trial are added together.
+
+    Examples
+    --------
+    >>> timer = trial_timer()
+    >>> with timer.stage(0, 'play_record'):
+    ...     play_record()
+    >>> print(timer.summary())
+    """
+
+    def __init__(self, hooks=()):
+        self.hooks = list(hooks)
+        self.durations = {}
+        # stage names in the order they were first seen
+        self._names = []
+
+    @contextlib.contextmanager
+    def stage(self, trial, name):
+        """
+        Time a stage of a trial.
+
+        Parameters
+        ----------
+        trial : int
+            Trial number.
+        name : str
+            Name of the stage.
+        """
+        for h in self.hooks:
+            h.stage_start(trial, name)
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            self.add(trial, name, duration)
+
+            for h in self.hooks:
+                h.stage_end(trial, name, duration)
+
+    def add(self, trial, name, duration):
+        """
+        Add a duration that was measured elsewhere, such as in a worker process.
+
+        Hooks are not notified, they only see stages timed with `stage`, so
+        that every `stage_end` follows a matching `stage_start`.
+
+        Parameters
+        ----------
+        trial : int
+            Trial number.
+        name : str
+            Name of the stage.
+        duration : float
+            Duration, in seconds.
+        """
+        if name not in self._names:
+            self._names.append(name)
+
+        trial_dur = self.durations.setdefault(trial, {})
+        trial_dur[name] = trial_dur.get(name, 0) + duration
+
+    def end(self):
+        """Tell hooks that the test is done."""
+        for h in self.hooks:
+            h.test_end(self)
+
+    def write(self, filename):
+        """
+        Write durations to a .csv file with one row per trial.
+
+        Parameters
+        ----------
+        filename : str
+            File to write.
+        """
+        with open(filename, "wt", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["trial"] + self._names)
+            for trial, dur in sorted(self.durations.items()):
+                writer.writerow([trial + 1] + [dur.get(n, "") for n in self._names])
+
+    def summary(self):
+        """
+        Get a table summarizing durations of each stage.
+
+        Returns
+        -------
+        str
+            Table with count, total, mean, median, 95th percentile and max
+            duration, in milliseconds, of each stage.
+        """
+        lines = [f"{'Stage':<14}{'Count':>7}{'Total (s)':>11}{'Mean':>9}{'Median':>9}{'P95':>9}{'Max':>9}"]
+        for name in self._names:
+            dur = np.array([d[name] for d in self.durations.values() if name in d]) * 1e3
+            lines.append(
+                f"{name:<14}{len(dur):>7}{np.sum(dur) / 1e3:>11.3f}{np.mean(dur):>9.1f}"
+                f"{np.median(dur):>9.1f}{np.percentile(dur, 95):>9.1f}{np.max(dur):>9.1f}"
+            )
+        return "\n".join(lines) + "\n"
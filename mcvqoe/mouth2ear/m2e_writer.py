@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+"""
+Background file writing for M2E trial data.
+"""
+
+import os
+import queue
+import threading
+import time
+
+
+class background_writer():
+    """
+    Write trial data and audio files in order, in a background thread.
+
+    Writes are queued with `submit` or `append` and done, in the order they
+    were queued, by a worker thread so that the caller does not wait for
+    storage. The queue is bounded so, if storage can not keep up, `submit`
+    blocks until there is room. How often and how long this happens is
+    reported by `stats`.
+
+    Files opened with `append` are kept open until `close`, which waits for
+    all queued writes and flushes and fsyncs all files. An exception raised by
+    a write is raised, again, by the next call to `submit`, `append`, `flush`
+    or `close`.
+
+    Parameters
+    ----------
+    max_queue : int, default=64
+        Maximum number of writes that can be waiting at once.
+    threaded : bool, default=True
+        If False, writes are done immediately in the calling thread. This
+        allows the same code to be used for synchronous writes.
+
+    Examples
+    --------
+    >>> with background_writer() as writer:
+    ...     writer.append('data.csv', 'header\\n')
+    ...     writer.submit(os.remove, 'old.wav')
+    >>> writer.stats()
+    """
+
+    def __init__(self, max_queue=64, threaded=True):
+        self.max_queue = max_queue
+        self.threaded = threaded
+
+        # open files, only used by the writer thread
+        self._files = {}
+        # exception from the writer thread
+        self._error = None
+
+        self._tasks = 0
+        self._blocked = 0
+        self._blocked_time = 0
+        self._max_depth = 0
+        self._write_time = 0
+
+        if self.threaded:
+            self._queue = queue.Queue(maxsize=max_queue)
+            self._thread = threading.Thread(target=self._run, name="m2e-writer", daemon=True)
+            self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def _run(self):
+        """Do queued writes until told to stop."""
+        while True:
+            task = self._queue.get()
+            try:
+                if task is None:
+                    return
+                # skip writes after an error, it will be raised by the caller
+                if self._error is None:
+                    self._do(*task)
+            except BaseException as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _do(self, func, args):
+        start = time.perf_counter()
+        func(*args)
+        self._write_time += time.perf_counter() - start
+
+    def _check(self):
+        """Raise an exception if a background write failed."""
+        if self._error is not None:
+            err = self._error
+            self._error = None
+            raise RuntimeError(f"Background write failed : {err}") from err
+
+    def submit(self, func, *args):
+        """
+        Queue a call to `func`, with `args`, in the writer thread.
+
+        Parameters
+        ----------
+        func : callable
+            Function that does the write.
+        *args
+            Arguments for func.
+        """
+        self._check()
+        self._tasks += 1
+
+        if not self.threaded:
+            self._do(func, args)
+            return
+
+        try:
+            self._queue.put_nowait((func, args))
+        except queue.Full:
+            # storage can't keep up, wait for room
+            self._blocked += 1
+            start = time.perf_counter()
+            self._queue.put((func, args))
+            self._blocked_time += time.perf_counter() - start
+
+        self._max_depth = max(self._max_depth, self._queue.qsize())
+
+    def append(self, filename, text):
+        """
+        Queue text to be appended to a file.
+
+        Parameters
+        ----------
+        filename : str
+            File to append to. It is opened the first time it is used.
+        text : str
+            Text to write.
+        """
+        self.submit(self._append, filename, text)
+
+    def _append(self, filename, text):
+        try:
+            f = self._files[filename]
+        except KeyError:
+            f = self._files[filename] = open(filename, "at")
+        f.write(text)
+        # keep the file up to date in case the test is interrupted
+        f.flush()
+
+    def flush(self):
+        """Wait for all queued writes to finish."""
+        if self.threaded:
+            self._queue.join()
+        self._check()
+
+    def close(self):
+        """Wait for queued writes, then flush, fsync and close all files."""
+        try:
+            if self.threaded:
+                self._queue.join()
+            for f in self._files.values():
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+            self._files = {}
+        finally:
+            if self.threaded and self._thread.is_alive():
+                self._queue.put(None)
+                self._thread.join()
+        self._check()
+
+    def stats(self):
+        """
+        Get statistics on queued writes.
+
+        Returns
+        -------
+        dict
+            'writes' : number of queued writes.
+            'blocked' : number of times `submit` waited for the queue.
+            'blocked_time' : total time, in seconds, spent waiting.
+            'max_depth' : most writes waiting at once.
+            'write_time' : total time, in seconds, spent writing.
+        """
+        return {
+            "writes": self._tasks,
+            "blocked": self._blocked,
+            "blocked_time": self._blocked_time,
+            "max_depth": self._max_depth,
+            "write_time": self._write_time,
+        }
@@ -27,13 +27,15 @@ setuptools.setup(
         "plotly",
         "pandas",
         'numpy',
+        'soundfile',
     ],
     entry_points={
         "console_scripts": [
             "m2e-sim=mcvqoe.mouth2ear.m2e_simulate:main",
             "m2e-measure=mcvqoe.mouth2ear.m2e_hw_test:main",
             "m2e-reprocess=mcvqoe.mouth2ear.m2e_reprocess:main",
+            "m2e-sweep=mcvqoe.mouth2ear.m2e_sweep:main",
         ],
     },
-    python_requires=">=3.6",
+    python_requires=">=3.7",
 )
@@ -0,0 +1,77 @@
+import timeit
+import unittest
+from unittest import mock
+
+import mcvqoe.base
+import mcvqoe.delay
+import numpy as np
+
+from mcvqoe.mouth2ear.m2e import _clip_path
+from mcvqoe.mouth2ear.m2e_delay import delay_estimator
+
+
+class DelayEstimatorTest(unittest.TestCase):
+
+    clips = (
+        "F1_harvard_phrases.wav",
+        "M2_harvard_phrases.wav",
+    )
+
+    def test_matches_its(self):
+        rng = np.random.default_rng(0)
+        for clip in self.clips:
+            fs, x = mcvqoe.base.audio_read(_clip_path(clip))
+            est = delay_estimator(x, fs=fs)
+            for dly in [0, 17, 2400, 14400]:
+                y = np.concatenate((np.zeros(dly), x, np.zeros(int(0.1 * fs))))
+                y += rng.normal(scale=1e-3, size=y.shape)
+
+                its_pos, its_dly = mcvqoe.delay.ITS_delay_est(x, y, "f", fs=fs)
+                pos, est_dly = est.estimate(y)
+
+                self.assertEqual(pos, its_pos)
+                self.assertLessEqual(abs(est_dly - its_dly), 1, msg=f"{clip} with {dly} sample delay")
+
+    def test_windowed(self):
+        rng = np.random.default_rng(1)
+        fs, x = mcvqoe.base.audio_read(_clip_path(self.clips[0]))
+        full = delay_estimator(x, fs=fs)
+        est = delay_estimator(x, fs=fs, windowed=True, window=0.05)
+        for dly, prior in [(2400, None), (2400, 2500), (14400, 14000), (14400, 2400)]:
+            y = np.concatenate((np.zeros(dly), x, np.zeros(int(0.5 * fs))))
+            y += rng.normal(scale=1e-3, size=y.shape)
+
+            self.assertEqual(est.estimate(y, prior=prior), full.estimate(y),
+                             msg=f"{dly} sample delay with prior of {prior}")
+
+        # prior that is far off should fall back to a full search
+        self.assertEqual(est.fallbacks, 1)
+
+    def test_windowed_cost(self):
+        rng = np.random.default_rng(2)
+        fs, x = mcvqoe.base.audio_read(_clip_path(self.clips[0]))
+        est = delay_estimator(x, fs=fs, windowed=True, window=0.05)
+        # long overplay, most of the recording is outside the window
+        y = np.concatenate((np.zeros(2400), x, np.zeros(5 * fs)))
+        y += rng.normal(scale=1e-3, size=y.shape)
+
+        # envelope of the whole recording is not computed
+        with mock.patch.object(est, "_envelope", side_effect=AssertionError):
+            self.assertEqual(est.estimate(y, prior=2500)[1], 2400)
+
+        # coarse search is the only part that differs between modes
+        y = est._resample(y)
+        y = y / np.sqrt(np.mean(y ** 2))
+        windowed = min(timeit.repeat(lambda: est._coarse_dly_windowed(y, 0, 800), number=5, repeat=5))
+        full = min(timeit.repeat(lambda: est._coarse_dly(y), number=5, repeat=5))
+        self.assertLess(windowed, full / 4)
+
+    def test_no_signal(self):
+        fs, x = mcvqoe.base.audio_read(_clip_path(self.clips[0]))
+        est = delay_estimator(x, fs=fs)
+        with self.assertWarns(UserWarning):
+            self.assertEqual(est.estimate(np.zeros_like(x)), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# modules that should only be imported when evaluating or plotting
+deferred = ("plotly", "pkg_resources", "mcvqoe.mouth2ear.m2e_eval")
+
+
+class ImportTest(unittest.TestCase):
+    def loaded(self, stmt):
+        """Get the deferred modules that are loaded after running stmt in a new interpreter."""
+        code = f"import sys\n{stmt}\nprint(' '.join(m for m in {deferred!r} if m in sys.modules))"
+        out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+        return out.stdout.split()
+
+    def test_measure(self):
+        for module in ("mcvqoe.mouth2ear", "mcvqoe.mouth2ear.m2e_reprocess"):
+            with self.subTest(module=module):
+                self.assertEqual(self.loaded(f"import {module}"), [])
+
+    def test_evaluate(self):
+        loaded = self.loaded("from mcvqoe.mouth2ear import evaluate")
+        self.assertEqual(loaded, ["mcvqoe.mouth2ear.m2e_eval"])
+
+    def test_clips(self):
+        from mcvqoe.mouth2ear import measure
+
+        test_obj = measure()
+        self.assertEqual(len(test_obj.audio_files), 4)
+        for f in test_obj.audio_files:
+            self.assertTrue(os.path.exists(f), f)
+
+
+if __name__ == "__main__":
+    unittest.main()
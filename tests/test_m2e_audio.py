@@ -0,0 +1,114 @@
+import io
+import os
+import tempfile
+import unittest
+
+import mcvqoe.base
+import numpy as np
+
+from mcvqoe.delay.ITS_delay import active_speech_level
+from mcvqoe.mouth2ear.m2e_audio import (
+    audio_read,
+    audio_read_channel,
+    clip_cache,
+    compress_audio,
+    noise_mixer,
+    speech_levels,
+)
+
+
+class M2eAudioTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.fs = 8000
+        # bursts of noise, with silence, of different lengths
+        self.clips = []
+        for n in (4000, 9000, 12000):
+            c = self.rng.normal(scale=0.1, size=n)
+            c[n // 3 : n // 2] = 0
+            self.clips.append(c)
+
+    def test_speech_levels(self):
+        expected = [active_speech_level(c, self.fs) for c in self.clips]
+        np.testing.assert_allclose(speech_levels(self.clips, self.fs, chunk_size=2), expected)
+
+    def test_noise_mixer(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            noise_name = os.path.join(tmp_dir, "noise.wav")
+            mcvqoe.base.audio_write(noise_name, 16000, self.rng.normal(scale=0.05, size=4000))
+
+            mixer = noise_mixer(noise_name, self.fs)
+            self.assertEqual(len(mixer.noise), 2000)
+
+            levels = mixer.speech_levels(self.clips)
+            for snr in (0, 20):
+                for clip, noisy in zip(self.clips, mixer.mix(self.clips, snr, levels=levels)):
+                    noise = (noisy - clip)[: len(mixer.noise)]
+                    self.assertAlmostEqual(
+                        active_speech_level(clip, self.fs) - active_speech_level(noise, self.fs),
+                        snr,
+                        places=3,
+                    )
+
+    def test_read_channel(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            name = os.path.join(tmp_dir, "rec.wav")
+            dat = self.rng.uniform(-0.5, 0.5, size=(1000, 2))
+            mcvqoe.base.audio_write(name, self.fs, dat)
+
+            _, full = mcvqoe.base.audio_read(name)
+            fs, chan = audio_read_channel(name, 1)
+
+            self.assertEqual(fs, self.fs)
+            np.testing.assert_allclose(mcvqoe.base.audio_type(chan, np.dtype("float32")), full[:, 1])
+
+            # in memory recordings
+            buf = io.BytesIO()
+            mcvqoe.base.audio_write(buf, self.fs, dat)
+            _, mem_chan = audio_read_channel(buf, 1)
+            np.testing.assert_array_equal(mem_chan, chan)
+
+    def test_flac(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            name = os.path.join(tmp_dir, "rec.wav")
+            dat = self.rng.uniform(-0.5, 0.5, size=(1000, 2))
+            mcvqoe.base.audio_write(name, self.fs, dat)
+
+            _, wav_chan = audio_read_channel(name, 1)
+            _, wav_full = audio_read(name)
+            wav_chan = np.array(wav_chan)
+
+            flac_name = compress_audio(name, "flac")
+            self.assertEqual(flac_name, os.path.join(tmp_dir, "rec.flac"))
+            self.assertFalse(os.path.exists(name))
+
+            # still found with the old name
+            fs, flac_chan = audio_read_channel(name, 1)
+            self.assertEqual(fs, self.fs)
+            np.testing.assert_array_equal(flac_chan, wav_chan)
+            np.testing.assert_array_equal(audio_read(name)[1], wav_full)
+
+    def test_clip_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            src = os.path.join(tmp_dir, "clip.wav")
+            mcvqoe.base.audio_write(src, self.fs, self.clips[0])
+
+            cache = clip_cache(os.path.join(tmp_dir, "cache"), max_size=2.5 * self.clips[0].nbytes)
+
+            keys = [cache.key(src, sample_rate=fs) for fs in (8000, 16000, 48000)]
+            self.assertEqual(len(set(keys)), 3)
+            self.assertIsNone(cache.load(keys[0]))
+
+            for k in keys:
+                cache.store(k, self.clips[0])
+                # make sure access times differ
+                os.utime(cache._name(k), (0, keys.index(k) + 1))
+
+            # oldest clip should have been evicted
+            cache.evict()
+            self.assertIsNone(cache.load(keys[0]))
+            np.testing.assert_array_equal(cache.load(keys[2]), self.clips[0])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+import csv
+import tempfile
+import unittest
+
+import numpy as np
+
+import mcvqoe.mouth2ear
+from mcvqoe.delay.ITS_delay import active_speech_level
+from mcvqoe.mouth2ear.m2e_channel import delay_channel
+
+
+class DelayChannelTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.clips = [self.rng.normal(scale=0.1, size=n) for n in (4000, 9000, 12000)]
+
+    def test_delay(self):
+        chan = delay_channel(sample_rate=8000, overplay=0.5, rec_snr=None, gain=0.5)
+        dly = [0, 100, 5000]
+        for c, r, d in zip(self.clips, chan.simulate(self.clips, delays=dly), dly):
+            self.assertEqual(len(r), len(c) + 4000)
+            np.testing.assert_array_equal(r[:d], 0)
+            np.testing.assert_allclose(r[d:d + len(c)], 0.5 * c[:len(r) - d])
+
+    def test_jitter(self):
+        chan = delay_channel(sample_rate=8000, m2e_latency=0.1, jitter=1e-3, seed=3)
+        dly = chan.delays(10000)
+        self.assertAlmostEqual(np.mean(dly) / 8000, 0.1, places=4)
+        self.assertAlmostEqual(np.std(dly) / 8000, 1e-3, places=4)
+        # same seed, same delays
+        np.testing.assert_array_equal(delay_channel(sample_rate=8000, jitter=1e-3, seed=3).delays(5),
+                                      delay_channel(sample_rate=8000, jitter=1e-3, seed=3).delays(5))
+
+    def test_snr(self):
+        chan = delay_channel(sample_rate=8000, overplay=0, m2e_latency=0, rec_snr=20, seed=0)
+        for c, r in zip(self.clips, chan.simulate(self.clips)):
+            self.assertAlmostEqual(
+                active_speech_level(c, 8000) - active_speech_level(r - c, 8000), 20, delta=0.5
+            )
+
+    def test_measure(self):
+        chan = delay_channel(m2e_latency=0.25, jitter=2e-3, seed=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=10,
+                ptt_wait=0,
+                ptt_gap=0,
+                dev_dly=0,
+                outdir=tmp_dir,
+                save_audio=False,
+                in_memory=True,
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.run()
+
+            with open(test_obj.data_filename[0], newline="") as f:
+                rows = list(csv.DictReader(f))
+
+        self.assertEqual(len(rows), 10)
+        for row in rows:
+            self.assertAlmostEqual(float(row["m2e_latency"]), 0.25, delta=0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,281 @@
+import os
+import tempfile
+import tracemalloc
+import unittest
+from unittest import mock
+
+import mcvqoe.math
+import numpy as np
+import pandas as pd
+
+from mcvqoe.mouth2ear import evaluate, m2e_eval, streaming_evaluate
+from mcvqoe.mouth2ear.m2e_eval import (
+    bootstrap_datasets_ci,
+    has_autocorrelation,
+    has_autocorrelation_chunked,
+    minmax_decimate,
+    read_session,
+    session_cache,
+    sidecar_name,
+)
+
+
+def ar_session(rng, N, phi, mean=0.2, scale=1e-3):
+    """Generate autocorrelated latency data."""
+    e = rng.normal(scale=scale, size=N)
+    x = np.zeros(N)
+    for n in range(1, N):
+        x[n] = phi * x[n - 1] + e[n]
+    return mean + x
+
+
+def write_sessions(path, sessions):
+    """Write latency data to session csv files and return their names."""
+    names = []
+    for k, dat in enumerate(sessions):
+        name = os.path.join(path, f"01-Jan-2021_00-00-{k:02d}_M2E.csv")
+        pd.DataFrame({
+            "Timestamp": "01-Jan-2021 00:00:00",
+            "Filename": [f"F{n % 2 + 1}_harvard_phrases" for n in range(len(dat))],
+            "m2e_latency": dat,
+            "channels": "(rx_voice)",
+        }).to_csv(name, index=False)
+        names.append(name)
+    return names
+
+
+class EvaluateTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = np.random.default_rng(0)
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sessions = [ar_session(self.rng, n, phi) for n, phi in ((400, 0.8), (300, 0.5), (500, 0.0))]
+        self.names = write_sessions(self.tmp_dir.name, self.sessions)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_has_autocorrelation(self):
+        for phi in (-0.4, 0, 0.3, 0.9):
+            for N in (8, 100, 1000):
+                x = ar_session(self.rng, N, phi)
+                self.assertEqual(
+                    has_autocorrelation(x),
+                    len(mcvqoe.math.improved_autocorrelation(x)) > 1,
+                    msg=f"N={N}, phi={phi}",
+                )
+
+    def test_has_autocorrelation_chunked(self):
+        for phi in (-0.3, 0, 0.05, 0.5):
+            for N in (100, 1001, 5000):
+                x = ar_session(self.rng, N, phi)
+                for thin in (1, 3):
+                    self.assertEqual(
+                        has_autocorrelation_chunked(x[::thin], chunk=64),
+                        has_autocorrelation(x[::thin]),
+                        msg=f"N={N}, phi={phi}, thin={thin}",
+                    )
+
+    def test_streaming(self):
+        eval_obj = evaluate(self.names, seed=2, resamples=2000)
+        # chunk size smaller than the sessions
+        with streaming_evaluate(self.names, seed=2, resamples=2000, chunk_size=64) as stream_obj:
+            self.assertEqual(stream_obj.common_thinning, eval_obj.common_thinning)
+            self.assertEqual(stream_obj.session_thinning, eval_obj.session_thinning)
+            self.assertAlmostEqual(stream_obj.mean, eval_obj.mean, places=12)
+            np.testing.assert_array_equal(stream_obj.ci, eval_obj.ci)
+
+            for name, dat in zip(stream_obj.test_names, self.sessions):
+                stats = stream_obj.session_stats[name]
+                self.assertEqual(stats["trials"], len(dat))
+                self.assertAlmostEqual(stats["mean"], np.mean(dat), places=9)
+                self.assertAlmostEqual(stats["std"], np.std(dat, ddof=1), places=9)
+
+    def test_streaming_memory(self):
+        sessions = [ar_session(self.rng, 20000, 0.0) for _ in range(2)]
+        names = write_sessions(self.tmp_dir.name, sessions)
+        eval_obj = evaluate(names, seed=4, resamples=200)
+        chunk_size = 64
+        with streaming_evaluate(names, seed=4, resamples=200, chunk_size=chunk_size) as stream_obj:
+            N = len(stream_obj._latency[0][::stream_obj.common_thinning])
+            self.assertGreater(N, chunk_size)
+
+            tracemalloc.start()
+            try:
+                stream_obj.eval()
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+
+        # nothing keeps the memory mapped data open after close
+        self.assertIsNone(m2e_eval._boot_datasets)
+
+        # resamples are not drawn all at once
+        self.assertLess(peak, 64 * chunk_size * 8)
+        self.assertLess(peak, N * stream_obj.resamples * 8)
+        np.testing.assert_allclose(stream_obj.ci, eval_obj.ci, rtol=1e-12)
+
+    def test_thinning(self):
+        eval_obj = evaluate(self.names)
+
+        # reference search, one thinning factor at a time
+        thinning = 1
+        while any(len(mcvqoe.math.improved_autocorrelation(dat[::thinning])) > 1 for dat in self.sessions):
+            thinning += 1
+
+        self.assertEqual(eval_obj.common_thinning, thinning)
+        for name in eval_obj.test_names:
+            self.assertLessEqual(eval_obj.session_thinning[name], thinning)
+
+    def test_bootstrap(self):
+        ci = bootstrap_datasets_ci(*self.sessions, R=2000, seed=1, max_elements=10000)
+        # same seed, same result, no matter how work is split
+        np.testing.assert_array_equal(
+            ci, bootstrap_datasets_ci(*self.sessions, R=2000, seed=1, max_elements=10000, jobs=2)
+        )
+        self.assertFalse(np.array_equal(ci, bootstrap_datasets_ci(*self.sessions, R=2000, seed=2)))
+
+        # should agree with the reference implementation
+        ref = mcvqoe.math.bootstrap_datasets_ci(*self.sessions, R=2000)
+        np.testing.assert_allclose(ci, ref, atol=2e-5)
+
+        eval_obj = evaluate(self.names, seed=5)
+        self.assertEqual(eval_obj.ci.tolist(), evaluate(self.names, seed=5).ci.tolist())
+
+    def test_index(self):
+        eval_obj = evaluate(self.names, seed=0)
+        self.assertEqual(eval_obj.data.index.names, ["name", "Filename", "trial"])
+
+        # reference filter with string comparisons
+        df = eval_obj.data
+        names = eval_obj.test_names[1:]
+        ref = df[df["name"].isin(names) & (df["Filename"] == "F2_harvard_phrases")]
+        pd.testing.assert_frame_equal(eval_obj.filter_data(df, names, "F2_harvard_phrases"), ref)
+        self.assertEqual(len(eval_obj.filter_data(df, "missing", None)), 0)
+
+        # thinning is done within each session
+        thin = eval_obj.common_thinning
+        for name, dat in zip(eval_obj.test_names, self.sessions):
+            np.testing.assert_allclose(
+                eval_obj.filter_data(eval_obj.thinned_data, name, None)["m2e_latency"], dat[::thin]
+            )
+
+        # index is rebuilt from json
+        json_obj = evaluate(json_data=eval_obj.to_json(), seed=0)
+        pd.testing.assert_index_equal(json_obj.data.index, eval_obj.data.index)
+        self.assertAlmostEqual(json_obj.mean, eval_obj.mean)
+
+    def test_decimate(self):
+        y = self.rng.normal(size=10001)
+        keep = minmax_decimate(y, 100)
+        self.assertLessEqual(len(keep), 200)
+        self.assertTrue(np.all(np.diff(keep) > 0))
+        self.assertIn(np.argmin(y), keep)
+        self.assertIn(np.argmax(y), keep)
+        # short series are not changed
+        np.testing.assert_array_equal(minmax_decimate(y[:50], 100), np.arange(50))
+
+    def test_large_plots(self):
+        eval_obj = evaluate(self.names, seed=0)
+        n = len(eval_obj.data)
+
+        fig = eval_obj.histogram(thinned=False, max_points=100)
+        self.assertTrue(all(t.type == "bar" for t in fig.data))
+        self.assertEqual(sum(np.sum(t.y) for t in fig.data), n)
+
+        fig = eval_obj.plot(thinned=False, max_points=100)
+        self.assertTrue(all(t.type == "scattergl" for t in fig.data))
+        self.assertLessEqual(sum(len(t.y) for t in fig.data), 100)
+
+        # small data is plotted as is
+        fig = eval_obj.plot(thinned=False, max_points=None)
+        self.assertEqual(sum(len(t.y) for t in fig.data), n)
+
+    def test_npz(self):
+        eval_obj = evaluate(self.names, seed=4, resamples=500)
+
+        name = os.path.join(self.tmp_dir.name, "eval.npz")
+        eval_obj.to_npz(name)
+        for npz_data in (eval_obj.to_npz(), eval_obj.to_npz(compress=False), name):
+            loaded = evaluate(npz_data=npz_data)
+            pd.testing.assert_frame_equal(loaded.data, eval_obj.data)
+            pd.testing.assert_frame_equal(loaded.thinned_data, eval_obj.thinned_data)
+            self.assertEqual(loaded.common_thinning, eval_obj.common_thinning)
+            self.assertEqual(loaded.session_thinning, eval_obj.session_thinning)
+            self.assertEqual(loaded.full_paths, eval_obj.full_paths)
+            self.assertEqual(loaded.mean, eval_obj.mean)
+            np.testing.assert_array_equal(loaded.ci, eval_obj.ci)
+            # bootstrap settings are restored too
+            np.testing.assert_array_equal(loaded.eval()[1], eval_obj.ci)
+
+    def test_incremental(self):
+        eval_obj = evaluate(self.names, seed=3)
+        cache_dir = os.path.join(self.tmp_dir.name, "cache")
+
+        inc_obj = evaluate(self.names[:2], seed=3, cache=cache_dir)
+        inc_obj.add_sessions(self.names[2])
+        self.assertEqual(inc_obj.test_names, eval_obj.test_names)
+        pd.testing.assert_frame_equal(inc_obj.data, eval_obj.data)
+        self.assertEqual(inc_obj.common_thinning, eval_obj.common_thinning)
+        self.assertEqual(inc_obj.session_thinning, eval_obj.session_thinning)
+        self.assertAlmostEqual(inc_obj.mean, eval_obj.mean, places=12)
+        # different random streams, same distribution
+        np.testing.assert_allclose(inc_obj.ci, eval_obj.ci, atol=1e-4)
+
+        with self.assertRaises(ValueError):
+            inc_obj.add_sessions(self.names[0])
+
+        # everything comes from the cache the second time
+        with mock.patch("mcvqoe.mouth2ear.m2e_eval.has_autocorrelation", side_effect=AssertionError), \
+                mock.patch("mcvqoe.mouth2ear.m2e_eval.bootstrap_means", side_effect=AssertionError):
+            cached_obj = evaluate(self.names, seed=3, cache=cache_dir)
+        self.assertEqual(cached_obj.mean, inc_obj.mean)
+        np.testing.assert_array_equal(cached_obj.ci, inc_obj.ci)
+
+    def test_cache_entries(self):
+        # two sessions with the same data
+        names = write_sessions(self.tmp_dir.name, [self.sessions[2]] * 2)
+        cache = session_cache(os.path.join(self.tmp_dir.name, "cache"))
+        eval_obj = evaluate(names, seed=3, cache=cache)
+        key = eval_obj._session_keys[eval_obj.test_names[0]]
+        self.assertEqual(key, eval_obj._session_keys[eval_obj.test_names[1]])
+
+        boot = [v for k, v in cache.get(key).items() if k.startswith("boot_")]
+        self.assertEqual(len(boot), 2)
+        # resampled independently
+        self.assertFalse(np.array_equal(boot[0], boot[1]))
+
+        # only resample means for the latest settings are kept
+        for resamples in (500, 1000):
+            eval_obj.resamples = resamples
+            eval_obj.eval()
+        with np.load(os.path.join(cache.path, key + ".npz")) as dat:
+            boot_names = [k for k in dat.files if k.startswith("boot_")]
+        self.assertEqual(len(boot_names), 2)
+        N = len(eval_obj.session_latency(eval_obj.thinned_data)[0])
+        prefix = f"boot_{eval_obj.common_thinning}_{N}_1000_3_"
+        self.assertTrue(all(k.startswith(prefix) for k in boot_names), msg=boot_names)
+
+    def test_sidecar(self):
+        name = self.names[0]
+
+        # off by default
+        df = read_session(name)
+        self.assertFalse(os.path.exists(sidecar_name(name)))
+
+        pd.testing.assert_frame_equal(read_session(name, use_sidecar=True), df)
+        self.assertTrue(os.path.exists(sidecar_name(name)))
+
+        # second read comes from the sidecar
+        with mock.patch("pandas.read_csv", side_effect=AssertionError):
+            pd.testing.assert_frame_equal(read_session(name, use_sidecar=True), df)
+
+        # replaced csv, with the old modification time, should regenerate sidecar
+        st = os.stat(name)
+        new = self.sessions[1][:-1]
+        write_sessions(self.tmp_dir.name, [new])
+        os.utime(name, ns=(st.st_atime_ns, st.st_mtime_ns))
+        np.testing.assert_allclose(read_session(name, use_sidecar=True)["m2e_latency"], new)
+
+
+if __name__ == "__main__":
+    unittest.main()
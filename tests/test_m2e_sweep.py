@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+
+from mcvqoe.mouth2ear.m2e_sweep import sweep, sweep_combinations
+
+
+class SweepTest(unittest.TestCase):
+    def test_combinations(self):
+        combos = sweep_combinations({"m2e_latency": [0.1, 0.2], "bgnoise_snr": [10, 20, 30]})
+        self.assertEqual(len(combos), 6)
+        self.assertIn({"m2e_latency": 0.2, "bgnoise_snr": 10}, combos)
+
+    def test_sweep(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            res = sweep(
+                {"m2e_latency": [0.1, 0.3], "channel_tech": ["clean"]},
+                outdir=tmp_dir,
+                jobs=2,
+                seed=0,
+                trials=4,
+            )
+            self.assertTrue(os.path.exists(os.path.join(tmp_dir, "sweep_results.csv")))
+            # each combination has its own directory
+            self.assertEqual(len(set(res["data_file"])), 2)
+
+        self.assertEqual(list(res["error"]), ["", ""])
+        self.assertEqual(list(res["trials"]), [4, 4])
+        for dly, mean in zip(res["m2e_latency"], res["mean"]):
+            self.assertAlmostEqual(mean, dly, delta=0.01)
+
+    def test_failed_combination(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            res = sweep(
+                {"trials": [4, 0], "channel_tech": ["clean"]},
+                outdir=tmp_dir,
+                jobs=2,
+                seed=0,
+            )
+
+        # failure is recorded, other combinations still have results
+        self.assertEqual(res["error"][0], "")
+        self.assertEqual(res["trials"][0], 4)
+        self.assertTrue(res["error"][1].startswith("ValueError"))
+
+    def test_unknown_setting(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            with self.assertRaises(ValueError):
+                sweep({"not_a_setting": [1, 2]}, outdir=tmp_dir, jobs=2)
+            # nothing was run
+            self.assertEqual(os.listdir(tmp_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
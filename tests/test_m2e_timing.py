@@ -0,0 +1,118 @@
+import csv
+import os
+import pstats
+import tempfile
+import unittest
+
+import mcvqoe.mouth2ear
+from mcvqoe.mouth2ear.m2e_channel import delay_channel
+from mcvqoe.mouth2ear.m2e_timing import profile_hook, timing_hook, trial_timer
+
+
+class RecordHook(timing_hook):
+    def __init__(self):
+        self.events = []
+
+    def stage_start(self, trial, name):
+        self.events.append(("start", trial, name))
+
+    def stage_end(self, trial, name, duration):
+        self.events.append(("end", trial, name))
+
+    def test_end(self, timer):
+        self.events.append(("test_end",))
+
+
+class TrialTimerTest(unittest.TestCase):
+    def test_timer(self):
+        hook = RecordHook()
+        timer = trial_timer([hook])
+        for trial in range(3):
+            with timer.stage(trial, "a"):
+                pass
+            timer.add(trial, "b", 0.5)
+            timer.add(trial, "b", 0.25)
+        timer.end()
+
+        self.assertEqual(timer.durations[1]["b"], 0.75)
+        # added durations don't notify hooks, so starts and ends match
+        self.assertEqual(hook.events[:3], [("start", 0, "a"), ("end", 0, "a"), ("start", 1, "a")])
+        self.assertEqual(hook.events[-1], ("test_end",))
+
+        summary = timer.summary().splitlines()
+        self.assertEqual(len(summary), 3)
+        self.assertTrue(summary[2].startswith("b"))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            name = os.path.join(tmp_dir, "timing.csv")
+            timer.write(name)
+            with open(name, newline="") as f:
+                rows = list(csv.DictReader(f))
+        self.assertEqual([r["trial"] for r in rows], ["1", "2", "3"])
+        self.assertEqual(float(rows[0]["b"]), 0.75)
+
+    def test_measure(self):
+        chan = delay_channel(m2e_latency=0.1, seed=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            prof_name = os.path.join(tmp_dir, "prof.stats")
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=5,
+                ptt_wait=0,
+                ptt_gap=0,
+                outdir=tmp_dir,
+                save_audio=False,
+                pipeline=True,
+                timing=True,
+                timing_hooks=[profile_hook(stages=["play_record"], filename=prof_name)],
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.run()
+
+            timing_name = test_obj.data_filename[0].replace(".csv", "_timing.csv")
+            with open(timing_name, newline="") as f:
+                rows = list(csv.DictReader(f))
+            self.assertTrue(os.path.exists(prof_name))
+
+        self.assertEqual(len(rows), 5)
+        for stage in ("ptt_wait", "play_record", "audio_read", "delay_est", "csv_write"):
+            self.assertIn(stage, rows[0])
+            self.assertGreaterEqual(float(rows[0][stage]), 0)
+
+    def test_profile_delay_est(self):
+        chan = delay_channel(m2e_latency=0.1, seed=0)
+        hook = profile_hook(stages=["delay_est"])
+        record = RecordHook()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            hook.filename = os.path.join(tmp_dir, "prof.stats")
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=3,
+                ptt_wait=0,
+                ptt_gap=0,
+                outdir=tmp_dir,
+                save_audio=False,
+                timing=True,
+                timing_hooks=[hook, record],
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.run()
+
+        funcs = [(os.path.basename(f), name) for f, _, name in pstats.Stats(hook.profile).stats]
+        self.assertIn(("m2e_delay.py", "estimate"), funcs)
+        # play_record is not profiled
+        self.assertNotIn(("m2e.py", "_play_record"), funcs)
+
+        starts = [e[1:] for e in record.events if e[0] == "start"]
+        ends = [e[1:] for e in record.events if e[0] == "end"]
+        self.assertEqual(starts, ends)
+        self.assertIn((2, "delay_est"), starts)
+        self.assertIn((2, "audio_read"), starts)
+
+
+if __name__ == "__main__":
+    unittest.main()
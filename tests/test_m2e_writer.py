@@ -0,0 +1,81 @@
+import csv
+import os
+import tempfile
+import time
+import unittest
+
+import mcvqoe.mouth2ear
+from mcvqoe.mouth2ear.m2e_channel import delay_channel
+from mcvqoe.mouth2ear.m2e_writer import background_writer
+
+
+class BackgroundWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.name = os.path.join(self.tmp_dir.name, "data.csv")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_order(self):
+        for threaded in (True, False):
+            with background_writer(max_queue=4, threaded=threaded) as writer:
+                for n in range(100):
+                    writer.append(self.name, f"{n}\n")
+
+            with open(self.name) as f:
+                self.assertEqual(f.read(), "".join(f"{n}\n" for n in range(100)))
+            self.assertEqual(writer.stats()["writes"], 100)
+            os.remove(self.name)
+
+    def test_backpressure(self):
+        with background_writer(max_queue=2) as writer:
+            for n in range(6):
+                writer.submit(time.sleep, 0.05)
+
+        stats = writer.stats()
+        self.assertGreater(stats["blocked"], 0)
+        self.assertGreater(stats["blocked_time"], 0)
+        self.assertLessEqual(stats["max_depth"], 2)
+
+    def test_error(self):
+        writer = background_writer()
+        writer.submit(os.remove, os.path.join(self.tmp_dir.name, "missing.wav"))
+        writer.append(self.name, "skipped\n")
+        with self.assertRaises(RuntimeError):
+            writer.close()
+        # writes after the error are skipped
+        self.assertFalse(os.path.exists(self.name))
+
+    def test_measure(self):
+        chan = delay_channel(m2e_latency=0.1, seed=0)
+        test_obj = mcvqoe.mouth2ear.measure(
+            audio_interface=chan,
+            ri=chan,
+            trials=6,
+            ptt_wait=0,
+            ptt_gap=0,
+            dev_dly=0,
+            outdir=self.tmp_dir.name,
+            background_write=True,
+            audio_format="flac",
+        )
+        test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+        test_obj.get_post_notes = lambda: {}
+        test_obj.run()
+
+        with open(test_obj.data_filename[0], newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(len(rows), 6)
+
+        wav_dir = os.path.join(test_obj.data_dirs[0], "wav")
+        rx_files = [f for f in os.listdir(wav_dir) if f.startswith("Rx")]
+        self.assertEqual(len(rx_files), 6)
+        self.assertTrue(all(f.endswith(".flac") for f in rx_files))
+
+        with open(os.path.join(test_obj.data_dirs[0], "tests.log")) as f:
+            self.assertIn("===Background Writer===", f.read())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,10 +1,19 @@
+import argparse
 import csv
 import os
+import pickle
+import re
+import tempfile
 import unittest
+from unittest import mock
 
 import mcvqoe.mouth2ear
 import mcvqoe.simulation
-import pkg_resources
+import numpy as np
+from mcvqoe.mouth2ear.m2e import _clip_path, add_run_options, apply_run_options
+from mcvqoe.mouth2ear.m2e_audio import audio_write
+from mcvqoe.mouth2ear.m2e_channel import delay_channel
+from mcvqoe.mouth2ear.m2e_eval import bootstrap_datasets_ci
 
 try:
     # try to import importlib.metadata
@@ -25,6 +34,8 @@ class MeasureTest(unittest.TestCase):
         test_obj.ptt_gap = 0
         test_obj.param_check()
         sim_obj = mcvqoe.simulation.QoEsim()
+        # simulate the device delay that measure removes
+        sim_obj.device_delay = test_obj.dev_dly
 
         test_obj.audio_interface = sim_obj
         test_obj.ri = sim_obj
@@ -47,13 +58,11 @@ class MeasureTest(unittest.TestCase):
                 test_obj.info["Pre Test Notes"] = ""
 
                 test_obj.run()
-                with open(test_obj.data_filename, newline="") as f:
+                with open(test_obj.data_filename[-1], newline="") as f:
                     reader = csv.reader(f)
                     next(reader)
 
-                    clip_names = os.listdir(
-                        pkg_resources.resource_filename("mcvqoe.mouth2ear", "audio_clips/")
-                    )
+                    clip_names = os.listdir(_clip_path(""))
                     clip_names = list(map(lambda x: x.split(".")[0], clip_names))
 
                     for row in reader:
@@ -61,6 +70,294 @@ class MeasureTest(unittest.TestCase):
                         self.assert_tol(float(row[2]), dly, 0.01)
                         self.assertEqual(row[3], "(rx_voice)")
 
+    def test_worker_copy(self):
+        chan = delay_channel(m2e_latency=0.1, seed=0)
+        test_obj = mcvqoe.mouth2ear.measure(
+            audio_interface=chan,
+            ri=chan,
+            dev_dly=0.01,
+            windowed_search=True,
+            search_window=0.2,
+        )
+        test_obj.get_post_notes = lambda: {}
+        test_obj.load_audio()
+
+        # workers get every setting, without hardware or callbacks
+        worker_obj = pickle.loads(pickle.dumps(test_obj._worker_copy()))
+        for k, v in vars(test_obj).items():
+            if not k.startswith("_") and k not in ("audio_interface", "ri", "get_post_notes",
+                                                    "progress_update", "gui_extras", "timing_hooks", "info",
+                                                    "dly_est", "y", "rng"):
+                self.assertEqual(getattr(worker_obj, k), v, msg=k)
+        self.assertEqual(worker_obj.audio_interface.sample_rate, chan.sample_rate)
+        self.assertFalse(hasattr(worker_obj, "ri"))
+
+        worker_obj.load_dly_est()
+        self.assertTrue(worker_obj.dly_est[0].windowed)
+
+    def test_full_audio_dir(self):
+        chan = delay_channel(m2e_latency=0.1, seed=0)
+        rng = np.random.default_rng(0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for name in ("F1.wav", "F1.flac", "F2.wav", "M1.flac"):
+                audio_write(os.path.join(tmp_dir, name), chan.sample_rate, rng.normal(scale=0.1, size=4800))
+
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                audio_path=tmp_dir,
+                full_audio_dir=True,
+                audio_format="flac",
+            )
+            test_obj.load_audio()
+
+        # one file per clip, in the saved format if there is one
+        self.assertEqual(sorted(test_obj.audio_files), ["F1.flac", "F2.wav", "M1.flac"])
+        self.assertEqual(len(test_obj.y), 3)
+
+    def test_trial_loop(self):
+        chan = delay_channel(m2e_latency=0.1, seed=0)
+        progress = mock.Mock(return_value=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=4,
+                ptt_wait=0,
+                ptt_gap=0,
+                outdir=tmp_dir,
+                save_audio=False,
+                progress_update=progress,
+                gui_extras=["extra"],
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.load_audio()
+            test_obj.cutpoints = [({"Clip": 1, "Start": 0, "End": len(y)},) for y in test_obj.y]
+            test_obj.run()
+
+            # cutpoints are written even when audio is not saved
+            cp_names = [f for f in os.listdir(os.path.join(test_obj.data_dirs[0], "wav")) if f.endswith(".csv")]
+
+        self.assertEqual(len(cp_names), len(test_obj.y))
+        trial_calls = [c for c in progress.call_args_list if c.args[0] == "test"]
+        self.assertEqual(len(trial_calls), 4)
+        for c in trial_calls:
+            self.assertEqual(c.kwargs["gui_extras"], ["extra"])
+
+    def test_pause_exit(self):
+        chan = delay_channel(m2e_latency=0.1, seed=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=20,
+                ptt_wait=0,
+                ptt_gap=0,
+                outdir=tmp_dir,
+                save_audio=False,
+                pipeline=True,
+                batch_size=4,
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.pause_trials = 6
+            # stop at the first pause
+            test_obj.user_check = mock.Mock(return_value=True)
+
+            with self.assertRaises(SystemExit):
+                test_obj.run()
+
+            # trials still being processed at the pause are written
+            with open(test_obj.data_filename[0], newline="") as f:
+                rows = list(csv.DictReader(f))
+
+        test_obj.user_check.assert_called_once()
+        self.assertEqual(len(rows), 6)
+
+    def test_run_options(self):
+        test_obj = mcvqoe.mouth2ear.measure()
+        parser = argparse.ArgumentParser()
+        add_run_options(parser, test_obj)
+
+        # defaults come from the object
+        apply_run_options(test_obj, parser.parse_args([]))
+        self.assertEqual(test_obj.search_window, mcvqoe.mouth2ear.measure().search_window)
+        self.assertEqual(test_obj.timing_hooks, [])
+
+        args = parser.parse_args(["--pipeline", "-j", "2", "--ci-target", "0.001", "--profile", "prof.stats"])
+        apply_run_options(test_obj, args)
+        self.assertTrue(test_obj.pipeline)
+        self.assertEqual(test_obj.jobs, 2)
+        self.assertEqual(test_obj.ci_target, 0.001)
+        self.assertTrue(test_obj.timing)
+        self.assertEqual(test_obj.timing_hooks[0].filename, "prof.stats")
+
+    def test_sequential(self):
+        chan = delay_channel(m2e_latency=0.1, jitter=0.002, seed=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=300,
+                ci_target=0.001,
+                ptt_wait=0,
+                ptt_gap=0,
+                dev_dly=0,
+                outdir=tmp_dir,
+                save_audio=False,
+                in_memory=True,
+                rng=np.random.default_rng(0),
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.param_check()
+            test_obj.run()
+
+            stats = test_obj._stop_stats[test_obj.data_dirs[0]]
+            eval_obj = mcvqoe.mouth2ear.evaluate(test_obj.data_filename[0], use_sidecar=False)
+
+        # stopped early, at a check
+        self.assertEqual(stats["reason"], "CI target reached")
+        self.assertLess(stats["trials"], test_obj.trials)
+        self.assertEqual((stats["trials"] - test_obj.min_trials) % test_obj.ci_check_trials, 0)
+        self.assertEqual(len(eval_obj.data), stats["trials"])
+
+        # corrected for the number of checks
+        self.assertAlmostEqual(stats["alpha"], test_obj.ci_alpha / test_obj._ci_looks())
+        self.assertLessEqual(stats["half_width"], test_obj.ci_target)
+
+        # final data meets the target at the overall confidence level
+        lat = eval_obj.data["m2e_latency"].to_numpy()[::eval_obj.common_thinning]
+        ci = bootstrap_datasets_ci(lat, alpha=test_obj.ci_alpha, seed=1)
+        self.assertLessEqual((ci[1] - ci[0]) / 2, test_obj.ci_target)
+
+    def test_sequential_pipeline(self):
+        chan = delay_channel(m2e_latency=0.1, jitter=0.002, seed=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=300,
+                ci_target=0.001,
+                pipeline=True,
+                batch_size=4,
+                ptt_wait=0,
+                ptt_gap=0,
+                dev_dly=0,
+                outdir=tmp_dir,
+                save_audio=False,
+                in_memory=True,
+                rng=np.random.default_rng(0),
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.param_check()
+
+            checks = []
+            check_due = test_obj._ci_check_due
+
+            def record_check():
+                due = check_due()
+                if due:
+                    checks.append(len(test_obj._latencies))
+                return due
+
+            test_obj._ci_check_due = record_check
+            test_obj.run()
+
+            stats = test_obj._stop_stats[test_obj.data_dirs[0]]
+            with open(test_obj.data_filename[0], newline="") as f:
+                rows = len(list(csv.DictReader(f)))
+            with open(os.path.join(test_obj.data_dirs[0], "tests.log")) as f:
+                log = f.read()
+
+        self.assertEqual(stats["reason"], "CI target reached")
+        self.assertLess(rows, test_obj.trials)
+
+        # each check is at a new, later, check point
+        self.assertEqual(checks, sorted(set(checks)))
+        self.assertGreaterEqual(checks[0], test_obj.min_trials)
+        self.assertLessEqual(len(checks), test_obj._ci_looks())
+
+        # logged stopping stats are for all written trials
+        self.assertEqual(stats["trials"], rows)
+        logged = re.search(r"CI target reached after (\d+) trials", log)
+        self.assertEqual(int(logged.group(1)), rows)
+
+    def test_reprocess_jobs(self):
+        chan = delay_channel(m2e_latency=0.1, jitter=0.005, seed=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=12,
+                ptt_wait=0,
+                ptt_gap=0,
+                dev_dly=0,
+                outdir=tmp_dir,
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+            test_obj.get_post_notes = lambda: {}
+            test_obj.run()
+            data_file = test_obj.data_filename[0]
+            wav_dir = os.path.join(test_obj.data_dirs[0], "wav")
+
+            results = {}
+            for jobs in (1, 2):
+                proc_obj = mcvqoe.mouth2ear.measure(jobs=jobs)
+                test_dat = proc_obj.load_test_data(data_file, audio_path=wav_dir)
+                out_name = os.path.join(tmp_dir, f"R{jobs}.csv")
+                proc_obj.post_process(test_dat, out_name, wav_dir)
+                with open(out_name, newline="") as f:
+                    results[jobs] = list(csv.DictReader(f))
+
+            with open(data_file, newline="") as f:
+                orig = list(csv.DictReader(f))
+
+        self.assertEqual(len(results[2]), len(orig))
+        # rows stay in trial order and match serial processing
+        self.assertEqual([r["Timestamp"] for r in results[2]], [r["Timestamp"] for r in orig])
+        self.assertEqual([r["Filename"] for r in results[2]], [r["Filename"] for r in orig])
+        for serial, parallel in zip(results[1], results[2]):
+            self.assertEqual(serial["Filename"], parallel["Filename"])
+            self.assertAlmostEqual(float(parallel["m2e_latency"]), float(serial["m2e_latency"]))
+        # latencies vary between trials, so a reordering would be caught
+        self.assertGreater(len({r["m2e_latency"] for r in results[2]}), 1)
+
+    def test_post_write(self):
+        chan = delay_channel(m2e_latency=0.1, jitter=0.001, seed=0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            test_obj = mcvqoe.mouth2ear.measure(
+                audio_interface=chan,
+                ri=chan,
+                trials=20,
+                iterations=2,
+                jobs=2,
+                ptt_wait=0,
+                ptt_gap=0,
+                dev_dly=0,
+                outdir=tmp_dir,
+                save_audio=False,
+            )
+            test_obj.info = {"Test Type": "simulation", "Pre Test Notes": ""}
+
+            # results come from memory, data files are not read back
+            with mock.patch("mcvqoe.mouth2ear.m2e_eval.evaluate", side_effect=AssertionError):
+                test_obj.run()
+
+            with open(os.path.join(tmp_dir, "tests.log")) as f:
+                outer = f.read()
+            self.assertEqual(outer.count("===M2E Results==="), 2)
+
+            for folder, name in zip(test_obj.data_dirs, test_obj.data_filename):
+                eval_obj = mcvqoe.mouth2ear.evaluate(name)
+                with open(os.path.join(folder, "tests.log")) as f:
+                    log = f.read()
+                self.assertEqual(log.count("===M2E Results==="), 1)
+                mean = re.search(r"Mouth-To-Ear Latency Estimate: ([-\d.e]+),", log).group(1)
+                self.assertAlmostEqual(float(mean), eval_obj.mean)
+
 
 if __name__ == "__main__":
     unittest.main()